@@ -0,0 +1,334 @@
+import heapq
+import math
+import os
+import random
+from bisect import bisect_left
+
+import numpy as np
+
+from cost_models import LinearCost
+from routing import INF, dijkstra_csr
+from utilities import file_content_hash
+
+LANDMARKS_VERSION = 1
+
+# relative margin taken off every bound, so floating point rounding never lifts one above the true cost
+_BOUND_SLACK = 1e-9
+
+
+class GeometricBound:
+    """Lower bounds from the node coordinates: the straight line distance times the least cost per unit of length.
+
+    The scale is the least cost/length ratio over all the edges, so every edge costs at least
+    scale * its length and, by the triangle inequality, every path at least scale * the straight
+    line between its ends. With cost = distance + time and distance >= length, the scale is about 1.
+    The costs are those of `cost_model` (see `cost_models`) at load 0, the lowest for any load.
+    """
+
+    def __init__(self, csr, cost_model=None):
+        """Constructor."""
+        if not csr.has_coordinates:
+            raise Exception("The graph has no node coordinates, generate it again to use the geometric bound.")
+        self.cost_model = cost_model
+        src = np.repeat(np.arange(csr.n_nodes), np.diff(csr.indptr))
+        length = np.hypot(csr.x[src] - csr.x[csr.indices], csr.y[src] - csr.y[csr.indices])
+        positive = length > 0
+        cost = csr.edge_costs(cost_model)
+        scale = float((cost[positive] / length[positive]).min()) if positive.any() else 0.0
+        self.scale = max(scale, 0.0) * (1 - _BOUND_SLACK)
+        self.x = np.asarray(csr.x, dtype=np.float64)
+        self.y = np.asarray(csr.y, dtype=np.float64)
+        self._x_list = self.x.tolist()
+        self._y_list = self.y.tolist()
+
+    def lower_bounds(self, source, targets):
+        """Lower bound of the cost from the dense node `source` to each of the dense nodes `targets`."""
+        return self.scale * np.hypot(self.x[targets] - self.x[source], self.y[targets] - self.y[source])
+
+    def upper_bounds(self, source, targets):
+        """No upper bound from the coordinates alone."""
+        return None
+
+    def edges_changed(self, src, dst, old_cost, new_cost):
+        """Keep the bound admissible after edge cost updates: a cheaper edge may lower the scale."""
+        length = np.hypot(self.x[src] - self.x[dst], self.y[src] - self.y[dst])
+        positive = length > 0
+        if positive.any():
+            scale = float((np.asarray(new_cost)[positive] / length[positive]).min()) * (1 - _BOUND_SLACK)
+            self.scale = max(min(self.scale, scale), 0.0)
+
+    def heuristic(self, targets):
+        """h(u): lower bound of the cost from the dense node u to the closest of `targets`."""
+        scale = self.scale
+        x = self._x_list
+        y = self._y_list
+        if len(targets) == 1:
+            tx = x[targets[0]]
+            ty = y[targets[0]]
+            return lambda u: scale * math.hypot(x[u] - tx, y[u] - ty)
+        tx = self.x[targets]
+        ty = self.y[targets]
+        return lambda u: scale * math.sqrt(float((np.square(tx - x[u]) + np.square(ty - y[u])).min()))
+
+
+class LandmarkBound:
+    """ALT lower bounds: for any landmark l, |d(l, t) - d(l, u)| <= d(u, t) by the triangle inequality.
+
+    `dist[k]` holds the least path cost from the k-th landmark to every node (dense index),
+    INF when unreachable. The landmarks are picked far apart (farthest point selection) so
+    that most pairs of nodes have one landmark roughly behind one of them. The same arrays
+    also give upper bounds, d(u, t) <= d(l, u) + d(l, t).
+
+    After edge cost updates (`edges_changed`) the rows are kept: no path got cheaper by more
+    than the sum of the decreases, nor dearer by more than the sum of the increases, so the
+    bounds are loosened by these sums until `rebuild` searches the rows again.
+
+    The costs are those of `cost_model` (see `cost_models`) at load 0. For a model which
+    depends on the load the lower bounds hold for any load, the upper bounds only at load 0.
+    """
+
+    def __init__(self, landmarks, node_ids, dist, cost_model=None):
+        """Constructor."""
+        self.landmarks = np.asarray(landmarks, dtype=np.int64)
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+        self.dist = np.asarray(dist, dtype=np.float64)
+        self.cost_model = cost_model
+        # set by `from_graph_file` when the landmarks were read from their cache file
+        self.from_cache = False
+        self._dist_lists = [row.tolist() for row in self.dist]
+        # sums of the cost decreases and increases since the rows were searched
+        self.decreased = 0.0
+        self.increased = 0.0
+
+    @property
+    def n_landmarks(self):
+        return len(self.landmarks)
+
+    @classmethod
+    def build(cls, csr, n_landmarks=8, seed=0, cost_model=None):
+        """Pick the landmarks and run one full Dijkstra from each of them."""
+        indptr, indices, cost = csr.adjacency_lists(cost_model)
+        n_landmarks = min(n_landmarks, csr.n_nodes)
+        landmarks = []
+        dist = np.empty((n_landmarks, csr.n_nodes), dtype=np.float64)
+        # the first landmark is the farthest node from a random one, then each next one the
+        # farthest from all the previous ones (unreachable nodes count as nearest)
+        start, _ = dijkstra_csr(indptr, indices, cost, random.Random(seed).randrange(csr.n_nodes))
+        closest = np.asarray(start)
+        for k in range(n_landmarks):
+            reachable = np.where(np.isfinite(closest), closest, -1.0)
+            landmark = int(np.argmax(reachable))
+            landmarks.append(landmark)
+            dist_k, _ = dijkstra_csr(indptr, indices, cost, landmark)
+            dist[k] = dist_k
+            closest = dist[k] if k == 0 else np.minimum(closest, dist[k])
+        return cls(landmarks, csr.node_ids, dist, cost_model)
+
+    @staticmethod
+    def cache_path_for(graph_path, content_hash, n_landmarks, cost_model=None):
+        model_tag = "-{}".format(cost_model.tag()) if cost_model is not None else ""
+        return "{}.landmarks{}{}-{}.npz".format(os.path.splitext(graph_path)[0], n_landmarks, model_tag, content_hash[:16])
+
+    @classmethod
+    def from_graph_file(cls, csr, graph_path, n_landmarks=8, cost_model=None):
+        """Load the landmarks cached next to the input .txt, or build and cache them (see `stop_table.StopTable`)."""
+        cache_path = cls.cache_path_for(graph_path, file_content_hash(graph_path), n_landmarks, cost_model)
+        if os.path.exists(cache_path):
+            bound = cls.load(cache_path, cost_model)
+            bound.from_cache = True
+            return bound
+        bound = cls.build(csr, n_landmarks, cost_model=cost_model)
+        bound.save(cache_path)
+        return bound
+
+    def save(self, path):
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, version=LANDMARKS_VERSION, landmarks=self.landmarks, node_ids=self.node_ids, dist=self.dist)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, cost_model=None):
+        with np.load(path) as data:
+            if int(data["version"]) != LANDMARKS_VERSION:
+                raise Exception("Landmarks cache {} has an unsupported version".format(path))
+            return cls(data["landmarks"], data["node_ids"], data["dist"], cost_model)
+
+    def lower_bounds(self, source, targets):
+        """Lower bound of the cost from the dense node `source` to each of the dense nodes `targets`."""
+        gap = np.abs(self.dist[:, targets] - self.dist[:, [source]])
+        # both unreachable from a landmark: that landmark tells nothing
+        lower = np.nan_to_num(gap, nan=0.0, posinf=INF).max(axis=0) * (1 - _BOUND_SLACK)
+        return np.maximum(lower - self.decreased, 0.0) if self.decreased else lower
+
+    def upper_bounds(self, source, targets):
+        """Upper bound of the cost from `source` to each of `targets`, through the best landmark."""
+        return (self.dist[:, targets] + self.dist[:, [source]]).min(axis=0) + 2 * self.increased
+
+    def edges_changed(self, src, dst, old_cost, new_cost):
+        """Loosen the bounds by the cost changes of the edges src[k]--dst[k] (see the class docstring)."""
+        change = np.asarray(new_cost, dtype=np.float64) - np.asarray(old_cost, dtype=np.float64)
+        self.decreased += float(-change[change < 0].sum())
+        self.increased += float(change[change > 0].sum())
+
+    def rebuild(self, csr):
+        """Search the rows again from the same landmarks, with the current edge costs."""
+        indptr, indices, cost = csr.adjacency_lists(self.cost_model)
+        for k, landmark in enumerate(self.landmarks.tolist()):
+            self.dist[k], _ = dijkstra_csr(indptr, indices, cost, landmark)
+        self._dist_lists = [row.tolist() for row in self.dist]
+        self.decreased = 0.0
+        self.increased = 0.0
+
+    def heuristic(self, targets):
+        """h(u): lower bound of the cost from the dense node u to the closest of `targets`.
+
+        max over landmarks of the gap between d(l, u) and the nearest d(l, t), found by bisection
+        in the sorted d(l, t) values, which is below min over t of the per target bound.
+        """
+        rows = self._dist_lists
+        sorted_rows = [sorted(row[t] for t in targets) for row in rows]
+        decreased = self.decreased
+
+        def h(u):
+            best = 0.0
+            for row, values in zip(rows, sorted_rows):
+                gap = _gap_to_nearest(values, row[u])
+                if gap > best:
+                    best = gap
+            return max(best * (1 - _BOUND_SLACK) - decreased, 0.0)
+        return h
+
+
+def _gap_to_nearest(values, value):
+    # |value - nearest of the sorted values|, 0 when both are unreachable from the landmark
+    i = bisect_left(values, value)
+    gap = INF
+    for j in (i - 1, i):
+        if 0 <= j < len(values):
+            gap_j = abs(values[j] - value)
+            gap = min(gap, gap_j if gap_j == gap_j else 0.0)
+    return gap
+
+
+def nearest_target_astar(indptr, indices, cost, source, targets, heuristic=None, counters=None, settled_targets=None):
+    """A* over CSR adjacency lists from the dense node `source` to the cheapest of `targets`.
+
+    `targets` maps dense node indices to ranks, equal cost targets are resolved in favour of
+    the lowest rank as in `routing.nearest_target_path`. `heuristic(u)` must be a lower bound
+    of the cost from u to the closest target; without one this is Dijkstra. A bound which is
+    not consistent (a `LandmarkBound` loosened by edge updates) can settle a node too early:
+    the node is then opened again when a cheaper path to it shows up.
+    The number of settled nodes is added to counters["settled"], and every settled target is
+    appended as (target, cost) to `settled_targets` when given.
+
+    Returns (target, cost, path) with dense indices, or (None, None, []).
+    """
+    g = {source: 0.0}
+    pred = {source: -1}
+    h = {}
+    done = set()
+    heap = [(heuristic(source) if heuristic is not None else 0.0, source)]
+    best = None
+    best_cost = None
+    n_settled = 0
+    while heap:
+        f_u, u = heapq.heappop(heap)
+        if u in done:
+            continue
+        if best is not None and f_u > best_cost:
+            break
+        done.add(u)
+        n_settled += 1
+        g_u = g[u]
+        if u in targets:
+            if settled_targets is not None:
+                settled_targets.append((u, g_u))
+            if u == best:
+                best_cost = g_u
+            elif best is None or targets[u] < targets[best]:
+                best = u
+                best_cost = g_u
+        for e in range(indptr[u], indptr[u + 1]):
+            v = indices[e]
+            g_v = g_u + cost[e]
+            if v not in g or g_v < g[v]:
+                g[v] = g_v
+                pred[v] = u
+                done.discard(v)
+                if heuristic is None:
+                    h_v = 0.0
+                else:
+                    h_v = h.get(v)
+                    if h_v is None:
+                        h_v = h[v] = heuristic(v)
+                heapq.heappush(heap, (g_v + h_v, v))
+
+    if counters is not None:
+        counters["settled"] = counters.get("settled", 0) + n_settled
+    if best is None:
+        return None, None, []
+    path = [best]
+    while pred[path[-1]] != -1:
+        path.append(pred[path[-1]])
+    path.reverse()
+    return best, best_cost, path
+
+
+class AStarRouter:
+    """Nearest target searches with a lower bound (`GeometricBound` or `LandmarkBound`) as A* heuristic.
+
+    With `prune`, the candidates whose lower bound from the source exceeds an upper bound of the
+    best cost are dropped before the search, which also tightens the heuristic. Only the landmarks
+    give upper bounds (a first search to get one settles more nodes than it saves), so the
+    geometric bound never prunes. Same interface as `distance_cache.DistanceCache.nearest`.
+
+    The edge costs are those of `cost_model` (see `cost_models`, the imported cost by default)
+    for the load given to `nearest`; the bound must be built with the same model.
+    """
+
+    def __init__(self, csr, bound=None, prune=True, cost_model=None):
+        """Constructor."""
+        if bound is not None and _spec(bound.cost_model) != _spec(cost_model):
+            raise Exception("The A* bound was built with the cost model {}, not {}".format(_spec(bound.cost_model), _spec(cost_model)))
+        self.csr = csr
+        self.bound = bound
+        self.prune = prune
+        self.cost_model = cost_model
+        self.node_ids = csr.node_ids.tolist()
+        self.counters = {"searches": 0, "settled": 0, "pruned": 0}
+
+    def nearest(self, source_id, targets, settled_targets=None, load=0):
+        """Cheapest node of `targets` ({node_id: rank}) from `source_id` for a truck carrying `load`, returns (node_id, cost, path).
+
+        If a `settled_targets` list is given, the targets settled by the search are appended to it as (node_id, cost).
+        """
+        indptr, indices, cost = self.csr.adjacency_lists(self.cost_model, load)
+        node_index = self.csr.node_index
+        source = node_index[source_id]
+        dense_targets = {node_index[node_id]: rank for node_id, rank in targets.items()}
+        self.counters["searches"] += 1
+
+        # the upper bounds are path costs at load 0
+        bound_costs = self.cost_model is None or not self.cost_model.depends_on_load or load == 0
+        if self.bound is not None and self.prune and bound_costs and len(dense_targets) > 1:
+            candidates = np.fromiter(dense_targets, dtype=np.int64, count=len(dense_targets))
+            upper = self.bound.upper_bounds(source, candidates)
+            if upper is not None:
+                keep = self.bound.lower_bounds(source, candidates) <= float(upper.min()) * (1 + _BOUND_SLACK)
+                self.counters["pruned"] += int(len(candidates) - keep.sum())
+                dense_targets = {node: dense_targets[node] for node in candidates[keep].tolist()}
+
+        heuristic = self.bound.heuristic(list(dense_targets)) if self.bound is not None and dense_targets else None
+        settled = [] if settled_targets is not None else None
+        target, target_cost, path = nearest_target_astar(indptr, indices, cost, source, dense_targets, heuristic,
+                                                         self.counters, settled)
+        node_ids = self.node_ids
+        if settled is not None:
+            settled_targets.extend((node_ids[node], node_cost) for node, node_cost in settled)
+        if target is None:
+            return None, None, []
+        return node_ids[target], target_cost, [node_ids[node] for node in path]
+
+
+def _spec(cost_model):
+    return (cost_model if cost_model is not None else LinearCost()).spec
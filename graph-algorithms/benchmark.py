@@ -0,0 +1,247 @@
+"""
+Benchmark suite
+-----------
+
+Times the stages of a route search on road-like graphs generated by ../graph-generator/generate_graph.py
+at increasing sizes, and saves the numbers as JSON so that regressions show up and every
+optimization comes with its figures:
+
+- import: text to networkx (`import_graph_from`), text to flat arrays (`read_graph_arrays`),
+  binary CSR load (`graph_binary`), and switching the edge costs to another cost model (`cost_models`);
+- decision: one `nearest_target_path` search from a warehouse towards every store;
+- route: the whole greedy `goto_warehouse_or_store` route, and with --stop-table the stop table
+  precompute plus the route taken from the table (only up to --stop-table-max-nodes); the precompute
+  is also timed on every number of processes of --stop-table-workers (`parallel_search`), with its speedup,
+  and so are the rate of --edge-updates random edge updates marking the stale rows (`StopTable.repair`)
+  and the repair of one and of every row on its lookup;
+- with --astar, the settled nodes and time per search of Dijkstra and of A* with the geometric
+  and the landmark bounds (`astar.AStarRouter`), for the decisions (towards every store) and for
+  point-to-point searches (towards one random store), plus the landmarks precompute;
+- with --contraction, the contraction hierarchy precompute (`contraction.ContractionHierarchy`, only up
+  to --contraction-max-nodes), its core and shortcut counts, and the time and settled nodes of the
+  same decisions on it (`contraction.CHRouter`), with their speedup over `nearest_target_path`.
+
+Each timing is the best of --repeat runs. The generated graphs are kept in --graphs-dir, so a later
+run times the very same graphs.
+
+# Example to run, and to compare with a previous run:
+
+>>> python benchmark.py --sizes 100 1000 10000 100000 --stop-table --astar
+>>> python benchmark.py --sizes 1000 10000 100000 --contraction
+>>> python benchmark.py --sizes 100 1000 10000 --compare benchmark_results/bench_2019_03_22__18_27.json
+
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import random
+import time
+
+import networkx as nx
+import numpy as np
+
+from astar import AStarRouter, GeometricBound, LandmarkBound
+from contraction import CHRouter, ContractionHierarchy
+from cost_models import LoadCost
+from csr_graph import CSRGraph
+from delivery_state import DeliveryState
+from edge_updates import apply_edge_updates
+from graph import import_graph_from, read_graph_arrays
+from graph_binary import convert_graph
+from greedy_search import goto_warehouse_or_store, paths_cost
+from routing import nearest_target_path
+from stop_table import StopTable
+from utilities import load_graph_generator
+
+# a timing slower than the compared run by more than this factor is reported as a regression
+REGRESSION_FACTOR = 1.2
+
+
+def bench_graph_path(graphs_dir, n_nodes, seed):
+    """Generate (once) the benchmark graph of a size: 1% stores, 0.2% warehouses."""
+    graph_path = os.path.join(graphs_dir, "bench_{}_seed{}.txt".format(n_nodes, seed))
+    if not os.path.exists(graph_path):
+        n_stores = max(3, n_nodes // 100)
+        n_warehouses = max(2, n_nodes // 500)
+        load_graph_generator().generate_graph(graph_path, n_nodes, n_stores, n_warehouses, total_supply=10 * n_stores,
+                                              total_demand=8 * n_stores, seed=seed)
+    return graph_path
+
+
+def best_time(function, repeat):
+    """Best wall time of `repeat` calls, and the result of the last call."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def import_networkx(graph_path):
+    graph = nx.Graph()
+    import_graph_from(graph=graph, path=graph_path)
+    return graph
+
+
+def solve_route(graph, truck_cap_max, load_threshold_factor, stop_table=None):
+    start_node = next(node_id for node_id, node_type in graph.nodes(data="type") if node_type == 2)
+    state = DeliveryState.from_graph(graph, truck_node=start_node, truck_load=0, truck_cap_max=truck_cap_max)
+    list_paths, iteration = goto_warehouse_or_store(graph, state, load_threshold_factor * truck_cap_max, stop_table=stop_table)
+    return paths_cost(graph, list_paths), iteration
+
+
+def bench_astar(csr, queries, bounds, result, kind):
+    """Settled nodes and time per search of every bound over the same (source_id, targets) queries."""
+    for name, bound in bounds.items():
+        router = AStarRouter(csr, bound)
+        elapsed, _ = best_time(lambda: [router.nearest(source, targets) for source, targets in queries], 1)
+        result["astar_{}_{}_s".format(name, kind)] = elapsed / len(queries)
+        result["astar_{}_{}_settled".format(name, kind)] = router.counters["settled"] / len(queries)
+
+
+def bench_repair(graph, stop_table, args, result):
+    """Rate of --edge-updates random time changes through `edge_updates`, then the lazy repair of one and of every stop table row."""
+    csr = CSRGraph.from_networkx(graph, weight="cost")
+    rnd = random.Random(args.seed)
+    updates = [(node_id1, node_id2, None, graph[node_id1][node_id2]["time"] * rnd.uniform(0.2, 3.0))
+               for node_id1, node_id2 in rnd.sample(list(graph.edges()), min(args.edge_updates, graph.number_of_edges()))]
+    elapsed, report = best_time(lambda: apply_edge_updates(graph, updates, csr=csr, stop_table=stop_table), 1)
+    result["stop_table_updates_per_s"] = len(updates) / elapsed
+    result["stop_table_stale_rows"] = report["stop_table_rows"]
+    stores = np.ones(stop_table.n_stops - stop_table.n_warehouses, dtype=bool)
+    result["stop_table_repair_row_s"], _ = best_time(
+        lambda: stop_table.nearest(int(stop_table.stop_ids[0]), stop_table.stores_slice(), stores), 1)
+    result["stop_table_repair_all_s"], _ = best_time(lambda: stop_table.dist, 1)
+
+
+def run_size(graph_path, args):
+    result = {"graph": os.path.basename(graph_path)}
+
+    result["import_networkx_s"], graph = best_time(lambda: import_networkx(graph_path), args.repeat)
+    result["import_arrays_s"], _ = best_time(lambda: read_graph_arrays(graph_path), args.repeat)
+    binary_path = convert_graph(graph_path)
+    result["load_binary_s"], _ = best_time(lambda: CSRGraph.load_binary(binary_path).indices.sum(), args.repeat)
+    # a new load every time, so that no costs are taken from the cache
+    csr = CSRGraph.load_binary(binary_path)
+    loads = itertools.count(1)
+    result["cost_model_switch_s"], _ = best_time(lambda: csr.adjacency_lists(LoadCost(1.0, 0.05, 1.0), next(loads)), args.repeat)
+    result["n_nodes"] = graph.number_of_nodes()
+    result["n_edges"] = graph.number_of_edges()
+
+    state = DeliveryState.from_graph(graph, truck_node=None, truck_load=0, truck_cap_max=0)
+    result["n_stores"] = len(state.stores_ids_list)
+    result["n_warehouses"] = len(state.warehouses_ids_list)
+    sources = random.Random(args.seed).sample(state.warehouses_ids_list, min(args.decisions, len(state.warehouses_ids_list)))
+    decisions_s, _ = best_time(lambda: [nearest_target_path(graph, source, state.active_stores) for source in sources], args.repeat)
+    result["decision_s"] = decisions_s / len(sources)
+
+    result["route_s"], (result["route_cost"], result["route_iterations"]) = best_time(
+        lambda: solve_route(graph, args.truck_cap_max, args.load_threshold_factor), args.repeat)
+
+    if args.astar:
+        csr = CSRGraph.load_binary(binary_path)
+        result["landmarks_build_s"], landmarks = best_time(lambda: LandmarkBound.build(csr, args.landmarks), 1)
+        bounds = {"dijkstra": None, "geometric": GeometricBound(csr), "landmarks": landmarks}
+        rnd = random.Random(args.seed)
+        bench_astar(csr, [(source, state.active_stores) for source in sources], bounds, result, "decision")
+        bench_astar(csr, [(source, {rnd.choice(state.stores_ids_list): 0}) for source in sources], bounds, result, "p2p")
+
+    if args.contraction and result["n_nodes"] <= args.contraction_max_nodes:
+        csr = CSRGraph.load_binary(binary_path)
+        result["ch_build_s"], ch = best_time(lambda: ContractionHierarchy.build(csr), 1)
+        result["ch_core_nodes"] = ch.n_core
+        result["ch_shortcuts"] = ch.n_shortcuts
+        router = CHRouter(ch)
+        elapsed, _ = best_time(lambda: [router.nearest(source, state.active_stores) for source in sources], args.repeat)
+        result["ch_decision_s"] = elapsed / len(sources)
+        result["ch_decision_settled"] = router.counters["settled"] / router.counters["searches"]
+        result["ch_decision_speedup"] = result["decision_s"] / result["ch_decision_s"]
+
+    if args.stop_table and result["n_nodes"] <= args.stop_table_max_nodes:
+        result["stop_table_build_s"], stop_table = best_time(lambda: StopTable.build(graph), 1)
+        for workers in args.stop_table_workers:
+            if workers > 1:
+                elapsed, _ = best_time(lambda: StopTable.build(graph, workers=workers), 1)
+                result["stop_table_build_w{}_s".format(workers)] = elapsed
+                result["stop_table_build_w{}_speedup".format(workers)] = result["stop_table_build_s"] / elapsed
+        result["route_stop_table_s"], _ = best_time(
+            lambda: solve_route(graph, args.truck_cap_max, args.load_threshold_factor, stop_table), args.repeat)
+        bench_repair(graph.copy(), stop_table, args, result)
+    return result
+
+
+def compare(results, previous_path):
+    """Print the ratio of every timing to the same graph's timing in a previous JSON file."""
+    with open(previous_path) as inputfile:
+        previous = {entry["graph"]: entry for entry in json.load(inputfile)["results"]}
+    print("\nCompared with {} (ratio new/old, > {} flagged):".format(previous_path, REGRESSION_FACTOR))
+    for entry in results:
+        old = previous.get(entry["graph"])
+        if old is None:
+            continue
+        for key, value in entry.items():
+            if key.endswith("_s") and old.get(key):
+                ratio = value / old[key]
+                print("{:<28} {:<22} {:>8.2f}{}".format(entry["graph"], key, ratio, "  REGRESSION" if ratio > REGRESSION_FACTOR else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000],
+                        help="Number of nodes of the benchmark graphs (up to 10^6).")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed of the graphs and of the decision sources.")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Runs per timing, the best one is kept.")
+    parser.add_argument('--decisions', type=int, default=20,
+                        help="Number of single decisions timed per graph.")
+    parser.add_argument('--truck_cap_max', type=int, default=20,
+                        help="Truck load max capacity of the whole route.")
+    parser.add_argument('--load-threshold-factor', type=float, default=0.5,
+                        help="Load threshold factor of the whole route.")
+    parser.add_argument('--stop-table', action='store_true',
+                        help="Also time the stop table precompute and the route taken from it.")
+    parser.add_argument('--stop-table-max-nodes', type=int, default=10000,
+                        help="Largest graph for the stop table timings.")
+    parser.add_argument('--stop-table-workers', type=int, nargs='+', default=[1, 2, 4],
+                        help="Numbers of processes the stop table precompute is also timed on.")
+    parser.add_argument('--edge-updates', type=int, default=50,
+                        help="Number of random edge updates of the stop table repair timings.")
+    parser.add_argument('--astar', action='store_true',
+                        help="Also report the settled nodes of Dijkstra and A* (geometric and landmark bounds).")
+    parser.add_argument('--landmarks', type=int, default=8,
+                        help="Number of landmarks of the A* landmark bound.")
+    parser.add_argument('--contraction', action='store_true',
+                        help="Also time the contraction hierarchy precompute and the decisions taken on it.")
+    parser.add_argument('--contraction-max-nodes', type=int, default=100000,
+                        help="Largest graph for the contraction hierarchy timings.")
+    parser.add_argument('--graphs-dir', type=str, default="benchmark_results/graphs",
+                        help="Where the generated graphs are kept.")
+    parser.add_argument('--output', type=str, default="benchmark_results/bench_{:%Y_%m_%d__%H_%M}.json".format(datetime.datetime.now()),
+                        help="The .json results file.")
+    parser.add_argument('--compare', type=str,
+                        help="A previous .json results file to compare with.")
+    args = parser.parse_args()
+
+    os.makedirs(args.graphs_dir, exist_ok=True)
+    results = []
+    for n_nodes in args.sizes:
+        result = run_size(bench_graph_path(args.graphs_dir, n_nodes, args.seed), args)
+        results.append(result)
+        print(json.dumps(result))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as outputfile:
+        json.dump({"date": "{:%Y-%m-%d %H:%M}".format(datetime.datetime.now()),
+                   "python": platform.python_version(), "numpy": np.__version__, "networkx": nx.__version__,
+                   "machine": platform.platform(), "cpus": os.cpu_count(), "args": vars(args), "results": results}, outputfile, indent=1)
+    print("Benchmark results saved to: {}".format(args.output))
+
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,170 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from delivery_state import DeliveryState
+
+CHECKPOINT_VERSION = 1
+
+
+class Checkpointer:
+    """Saves the state of a route search every `every_iterations` decisions or every `every_s` seconds.
+
+    `goto_warehouse_or_store` hands it the search state after every decision (`after_decision`).
+    When a checkpoint is due only a snapshot is taken in the loop: copies of the supply and demand
+    arrays, the truck state, and the lengths of the paths and loads lists, which only grow. A
+    background thread encodes and writes it (see `save_checkpoint`), and a snapshot taken while
+    a write is still running replaces the one waiting, so the loop never waits for the disk.
+    The thread keeps the route encoded so far and only encodes the legs added since the previous
+    write. `prefix_paths` and `prefix_iterations` are the route before the search started (after a resume).
+    """
+
+    def __init__(self, path, meta, every_iterations=100, every_s=30.0, prefix_paths=(), prefix_iterations=0):
+        """Constructor."""
+        self.path = path
+        self.meta = meta
+        self.every_iterations = every_iterations
+        self.every_s = every_s
+        self.prefix_paths = list(prefix_paths)
+        self.prefix_iterations = prefix_iterations
+
+        self.n_saved = 0
+        self.snapshot_s = 0.0
+        self.write_s = 0.0
+        self.size = 0
+        self._last_iteration = 0
+        self._last_time = time.perf_counter()
+        self._pending = None
+        # the route encoded by the previous writes: leg lengths, visit deltas and leg loads, the
+        # number of legs and loads of the search lists they hold, and the last visited node id
+        self._leg_lengths = np.zeros(0, dtype=np.int64)
+        self._visits_delta = np.zeros(0, dtype=np.int64)
+        self._leg_loads = np.zeros(0, dtype=np.int64)
+        self._n_paths = None
+        self._n_loads = 0
+        self._last_visit = 0
+        self._closing = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def after_decision(self, state, list_paths, leg_loads, iteration):
+        if (iteration - self._last_iteration < self.every_iterations
+                and time.perf_counter() - self._last_time < self.every_s):
+            return
+        self.submit(state, list_paths, leg_loads, iteration)
+
+    def submit(self, state, list_paths, leg_loads, iteration):
+        """Snapshot the search state, which the background thread then saves."""
+        start = time.perf_counter()
+        snapshot = {"supplies": np.array(state.warehouses_supplies_list, dtype=np.int64),
+                    "demands": np.array(state.stores_demand_list, dtype=np.int64),
+                    "truck": (state.truck_node, state.truck_load),
+                    "paths": (list_paths, len(list_paths)), "loads": (leg_loads, len(leg_loads)),
+                    "iteration": self.prefix_iterations + iteration, "state": state}
+        with self._lock:
+            self._pending = snapshot
+        self._wake.set()
+        self._last_iteration = iteration
+        self._last_time = time.perf_counter()
+        self.snapshot_s += self._last_time - start
+
+    def close(self):
+        """Wait for the last snapshot to be written and stop the thread."""
+        self._closing = True
+        self._wake.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                snapshot, self._pending = self._pending, None
+            if snapshot is not None:
+                start = time.perf_counter()
+                self._encode(snapshot)
+                state = snapshot["state"]
+                self.size = save_checkpoint(self.path, self.meta, state.warehouses_ids_list, snapshot["supplies"],
+                                            state.stores_ids_list, snapshot["demands"], snapshot["truck"], state.truck_cap_max,
+                                            (state.initial_total_supply, state.initial_total_demand),
+                                            self._leg_lengths, self._visits_delta, self._leg_loads, snapshot["iteration"])
+                self.n_saved += 1
+                self.write_s += time.perf_counter() - start
+            if self._closing and self._pending is None:
+                return
+
+    def _encode(self, snapshot):
+        # append the legs and loads added since the previous write, the prefix on the first one
+        list_paths, n_paths = snapshot["paths"]
+        leg_loads, n_loads = snapshot["loads"]
+        if self._n_paths is None:
+            new_paths = self.prefix_paths + list_paths[:n_paths]
+        else:
+            new_paths = list_paths[self._n_paths:n_paths]
+        lengths, visits_delta, self._last_visit = encode_paths(new_paths, self._last_visit)
+        self._leg_lengths = np.concatenate([self._leg_lengths, lengths])
+        self._visits_delta = np.concatenate([self._visits_delta, visits_delta])
+        self._leg_loads = np.concatenate([self._leg_loads, np.asarray(leg_loads[self._n_loads:n_loads], dtype=np.int64)])
+        self._n_paths = n_paths
+        self._n_loads = n_loads
+
+
+def _smallest_int(values):
+    """`values` as the narrowest signed int array which holds them."""
+    values = np.asarray(values, dtype=np.int64)
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if values.size == 0 or (values.min() >= info.min and values.max() <= info.max):
+            return values.astype(dtype)
+    return values
+
+
+def encode_paths(list_paths, last_visit=0):
+    """(leg lengths, visit deltas, last visited node id) of paths which follow a route ending at `last_visit`.
+
+    The deltas are those between consecutive visited node ids, which are small along the paths
+    of a road graph; encoding the legs of a route in several parts gives the arrays of the whole.
+    """
+    lengths = np.fromiter((len(path) for path in list_paths), dtype=np.int64, count=len(list_paths))
+    visits = np.fromiter((node_id for path in list_paths for node_id in path), dtype=np.int64, count=int(lengths.sum()))
+    return lengths, np.diff(visits, prepend=last_visit), int(visits[-1]) if len(visits) else last_visit
+
+
+def save_checkpoint(path, meta, warehouses_ids, supplies, stores_ids, demands, truck, truck_cap_max, initial_totals,
+                    leg_lengths, visits_delta, leg_loads, iteration):
+    """Write a compressed .npz checkpoint, returns its size in bytes.
+
+    The route is stored as the lengths of its legs and the deltas between consecutive visited
+    node ids (see `encode_paths`), in the narrowest int type. The file is written under a
+    temporary name first, so a run killed while writing keeps the previous checkpoint.
+    """
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(tmp_path, version=CHECKPOINT_VERSION, meta=json.dumps(meta),
+                        warehouses_ids=np.asarray(warehouses_ids, dtype=np.int64), supplies=supplies,
+                        stores_ids=np.asarray(stores_ids, dtype=np.int64), demands=demands,
+                        truck=np.array([truck[0] if truck[0] is not None else -1, truck[1], truck_cap_max], dtype=np.int64),
+                        initial_totals=np.asarray(initial_totals, dtype=np.int64),
+                        leg_lengths=_smallest_int(leg_lengths), visits_delta=_smallest_int(visits_delta),
+                        leg_loads=_smallest_int(leg_loads), iteration=iteration)
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+def load_checkpoint(path):
+    """Read a checkpoint: (meta, `delivery_state.DeliveryState`, list_paths, leg_loads, iteration)."""
+    with np.load(path) as data:
+        if int(data["version"]) != CHECKPOINT_VERSION:
+            raise Exception("Checkpoint {} has an unsupported version".format(path))
+        truck_node, truck_load, truck_cap_max = data["truck"].tolist()
+        state = DeliveryState(data["warehouses_ids"].tolist(), data["supplies"].tolist(), data["stores_ids"].tolist(),
+                              data["demands"].tolist(), truck_node if truck_node >= 0 else None, truck_load, truck_cap_max)
+        state.initial_total_supply, state.initial_total_demand = data["initial_totals"].tolist()
+        visits = np.cumsum(data["visits_delta"].astype(np.int64)).tolist()
+        ends = np.cumsum(data["leg_lengths"].astype(np.int64)).tolist()
+        list_paths = [visits[end - length:end] for end, length in zip(ends, data["leg_lengths"].tolist())]
+        return json.loads(str(data["meta"])), state, list_paths, data["leg_loads"].astype(np.int64).tolist(), int(data["iteration"])
@@ -0,0 +1,431 @@
+import heapq
+import os
+
+import numpy as np
+
+from cost_models import LinearCost
+from routing import INF
+from utilities import file_content_hash
+
+CONTRACTION_VERSION = 2
+
+# a witness search gives up after settling this many nodes, and the shortcut is added
+_WITNESS_SETTLED = 64
+
+
+class ContractionHierarchy:
+    """Contraction hierarchy (CH) of a `csr_graph.CSRGraph`, over the costs of a cost model.
+
+    Preprocessing has two stages:
+
+    1. Every chain of degree 2 junctions (node type 0) becomes one edge between the nodes at its
+       ends; these are the core nodes. Each chain keeps its inner nodes, in order from its first
+       end, and the cost from that end to each of them. A chain which comes back to the core
+       node it starts from gives no edge, its inner nodes are only reached from that node.
+    2. The core nodes are contracted one after the other, the least edge difference first
+       (shortcuts added - edges removed + neighbours already contracted). When a node is
+       contracted, a shortcut joins each pair of its neighbours that has no witness path of at
+       most the same cost avoiding it. The witness searches are bounded, so a few shortcuts are
+       extra. The contraction order is the node rank. Every core node keeps its edges to the
+       nodes of higher rank (the upward graph), and each shortcut keeps the node it skips.
+
+    The least cost between two nodes is the least sum over the nodes both upward searches reach.
+    A bucket of every node holds the cost from it to each stop (warehouse or store) whose
+    upward search reaches it, and its parent in that search. So the nearest stop from any node is one upward search plus a
+    scan of the buckets it settles (see `CHRouter`). Only the chosen leg is unpacked into
+    graph nodes.
+    """
+
+    def __init__(self, node_ids, core_nodes, chain_ptr, chain_nodes, chain_offset, chain_ends, chain_cost,
+                 rank, up_ptr, up_to, up_cost, up_middle, up_chain, stop_nodes, bucket_ptr, bucket_stop, bucket_dist,
+                 bucket_parent, cost_model=None):
+        """Constructor."""
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+        self.core_nodes = np.asarray(core_nodes, dtype=np.int64)
+        self.chain_ptr = np.asarray(chain_ptr, dtype=np.int64)
+        self.chain_nodes = np.asarray(chain_nodes, dtype=np.int64)
+        self.chain_offset = np.asarray(chain_offset, dtype=np.float64)
+        self.chain_ends = np.asarray(chain_ends, dtype=np.int64).reshape(-1, 2)
+        self.chain_cost = np.asarray(chain_cost, dtype=np.float64)
+        self.rank = np.asarray(rank, dtype=np.int64)
+        self.up_ptr = np.asarray(up_ptr, dtype=np.int64)
+        self.up_to = np.asarray(up_to, dtype=np.int64)
+        self.up_cost = np.asarray(up_cost, dtype=np.float64)
+        self.up_middle = np.asarray(up_middle, dtype=np.int64)
+        self.up_chain = np.asarray(up_chain, dtype=np.int64)
+        self.stop_nodes = np.asarray(stop_nodes, dtype=np.int64)
+        self.bucket_ptr = np.asarray(bucket_ptr, dtype=np.int64)
+        self.bucket_stop = np.asarray(bucket_stop, dtype=np.int64)
+        self.bucket_dist = np.asarray(bucket_dist, dtype=np.float64)
+        self.bucket_parent = np.asarray(bucket_parent, dtype=np.int64)
+        self.cost_model = cost_model
+        # set by `from_graph_file` when the hierarchy was read from its cache file
+        self.from_cache = False
+
+        n_nodes = len(self.node_ids)
+        self.node_index = {int(node_id): ii for ii, node_id in enumerate(self.node_ids.tolist())}
+        self.core_of = np.full(n_nodes, -1, dtype=np.int64)
+        self.core_of[self.core_nodes] = np.arange(len(self.core_nodes))
+        # chain and position of every inner node
+        self.inner_chain = np.full(n_nodes, -1, dtype=np.int64)
+        self.inner_chain[self.chain_nodes] = np.repeat(np.arange(len(self.chain_cost)), np.diff(self.chain_ptr))
+        self.inner_pos = np.zeros(n_nodes, dtype=np.int64)
+        self.inner_pos[self.chain_nodes] = np.arange(len(self.chain_nodes)) - np.repeat(self.chain_ptr[:-1], np.diff(self.chain_ptr))
+        self.stop_index = {int(node_id): k for k, node_id in enumerate(self.node_ids[self.stop_nodes].tolist())}
+
+        # the searches run on lists, which Python indexes faster than arrays
+        self._up = (self.up_ptr.tolist(), self.up_to.tolist(), self.up_cost.tolist())
+        self._buckets = (self.bucket_ptr.tolist(), self.bucket_stop.tolist(), self.bucket_dist.tolist(), self.bucket_parent.tolist())
+
+    @property
+    def n_core(self):
+        return len(self.core_nodes)
+
+    @property
+    def n_shortcuts(self):
+        return int((self.up_middle >= 0).sum())
+
+    @classmethod
+    def build(cls, csr, cost_model=None):
+        """Contract the degree 2 junction chains, then the core nodes, and fill the stop buckets."""
+        if cost_model is not None and cost_model.depends_on_load:
+            raise Exception("The contraction hierarchy needs a cost model which does not depend on the load, not {}".format(cost_model.spec))
+        indptr, indices, cost = csr.adjacency_lists(cost_model)
+        inner = ((np.diff(csr.indptr) == 2) & (csr.node_type == 0)).tolist()
+        core_nodes = [node for node in range(csr.n_nodes) if not inner[node]]
+        core_of = {node: ii for ii, node in enumerate(core_nodes)}
+
+        # --- 1. chains of degree 2 junctions, each walked from its lower end
+        adj = [{} for _ in core_nodes]
+        chain_ptr, chain_nodes, chain_offset, chain_ends, chain_cost = [0], [], [], [], []
+
+        def add_edge(u, w, edge_cost, chain):
+            if u != w and (w not in adj[u] or edge_cost < adj[u][w][0]):
+                adj[u][w] = adj[w][u] = (edge_cost, -1, chain)
+
+        for a in core_nodes:
+            for e in range(indptr[a], indptr[a + 1]):
+                prev, node, total = a, indices[e], cost[e]
+                if not inner[node]:
+                    add_edge(core_of[a], core_of[node], total, -1)
+                    continue
+                walk, offsets = [], []
+                while inner[node]:
+                    walk.append(node)
+                    offsets.append(total)
+                    first = indptr[node]
+                    step = first if indices[first] != prev else first + 1
+                    prev, node = node, indices[step]
+                    total += cost[step]
+                # a chain back to its own end (a loop on core node a) is walked once from each side, kept once,
+                # and gives no core edge: a path never goes round the loop, it only leaves an inner node on either side
+                if a < node or (a == node and walk[0] < walk[-1]):
+                    chain_nodes.extend(walk)
+                    chain_offset.extend(offsets)
+                    chain_ptr.append(len(chain_nodes))
+                    chain_ends.append((core_of[a], core_of[node]))
+                    chain_cost.append(total)
+                    add_edge(core_of[a], core_of[node], total, len(chain_cost) - 1)
+
+        # --- 2. contraction of the core nodes, the least edge difference first (lazily updated)
+        n_core = len(core_nodes)
+        deleted = [0] * n_core
+        rank = [0] * n_core
+        up = [None] * n_core
+        heap = []
+        for v in range(n_core):
+            heap.append((_edge_difference(adj, v, _shortcuts(adj, v), deleted), v))
+        heapq.heapify(heap)
+        order = 0
+        while heap:
+            _, v = heapq.heappop(heap)
+            shortcuts = _shortcuts(adj, v)
+            priority = _edge_difference(adj, v, shortcuts, deleted)
+            if heap and priority > heap[0][0]:
+                heapq.heappush(heap, (priority, v))
+                continue
+            rank[v] = order
+            order += 1
+            up[v] = sorted(adj[v].items())
+            for w in adj[v]:
+                del adj[w][v]
+                deleted[w] += 1
+            for u, w, shortcut_cost in shortcuts:
+                if w not in adj[u] or shortcut_cost < adj[u][w][0]:
+                    adj[u][w] = adj[w][u] = (shortcut_cost, v, -1)
+            adj[v] = None
+
+        up_ptr = np.zeros(n_core + 1, dtype=np.int64)
+        np.cumsum([len(edges) for edges in up], out=up_ptr[1:])
+        flat = [(w, info[0], info[1], info[2]) for edges in up for w, info in edges]
+        up_to, up_cost, up_middle, up_chain = (list(column) for column in zip(*flat)) if flat else ([], [], [], [])
+
+        ch = cls(csr.node_ids, core_nodes, chain_ptr, chain_nodes, chain_offset, chain_ends, chain_cost,
+                 rank, up_ptr, up_to, up_cost, up_middle, up_chain, np.flatnonzero(csr.node_type != 0),
+                 np.zeros(n_core + 1, dtype=np.int64), [], [], [], cost_model)
+        ch._fill_buckets()
+        return ch
+
+    def _fill_buckets(self):
+        """One upward search from every stop; the settled nodes get (stop, cost, parent towards the stop) in their bucket.
+
+        Every bucket is sorted by cost, so a query scans it only up to the best cost found so far.
+        """
+        entries = []
+        for k, stop in enumerate(self.stop_nodes.tolist()):
+            dist, parent, _ = self.upward([(int(self.core_of[stop]), 0.0)])
+            entries.extend((v, dist_v, k, parent[v]) for v, dist_v in dist.items())
+        entries.sort()
+        self.bucket_ptr = np.zeros(self.n_core + 1, dtype=np.int64)
+        np.cumsum(np.bincount([entry[0] for entry in entries], minlength=self.n_core), out=self.bucket_ptr[1:])
+        self.bucket_dist = np.array([entry[1] for entry in entries], dtype=np.float64)
+        self.bucket_stop = np.array([entry[2] for entry in entries], dtype=np.int64)
+        self.bucket_parent = np.array([entry[3] for entry in entries], dtype=np.int64)
+        self._buckets = (self.bucket_ptr.tolist(), self.bucket_stop.tolist(), self.bucket_dist.tolist(), self.bucket_parent.tolist())
+
+    def down_path(self, v, k):
+        """Core nodes from `v` down to the k-th stop, along the upward search of the stop (v must be in its buckets)."""
+        bucket_ptr, bucket_stop, _, bucket_parent = self._buckets
+        path = [v]
+        while True:
+            parent = bucket_parent[bucket_stop.index(k, bucket_ptr[path[-1]], bucket_ptr[path[-1] + 1])]
+            if parent == -1:
+                return path
+            path.append(parent)
+
+    def upward(self, seeds, visit=None):
+        """Dijkstra over the upward graph from (core node, cost) seeds: (dist, parent, n_settled), parent -1 at a seed.
+
+        `visit(v, dist_v)` is called on every node expanded and returns a cost bound: the search
+        stops once the least cost left in its heap exceeds it.
+        """
+        up_ptr, up_to, up_cost = self._up
+        dist = {}
+        parent = {}
+        heap = []
+        for v, seed_cost in seeds:
+            if seed_cost < dist.get(v, INF):
+                dist[v] = seed_cost
+                parent[v] = -1
+                heap.append((seed_cost, v))
+        heapq.heapify(heap)
+        done = set()
+        bound = INF
+        while heap:
+            dist_v, v = heapq.heappop(heap)
+            if v in done:
+                continue
+            if dist_v > bound:
+                break
+            done.add(v)
+            # stall on demand: a node reached cheaper from above through one of its edges is not expanded
+            # (the graph is undirected, so the edges into v from above are its upward edges)
+            stalled = False
+            for e in range(up_ptr[v], up_ptr[v + 1]):
+                if dist.get(up_to[e], INF) + up_cost[e] < dist_v:
+                    stalled = True
+                    break
+            if stalled:
+                continue
+            if visit is not None:
+                bound = visit(v, dist_v)
+            for e in range(up_ptr[v], up_ptr[v + 1]):
+                w = up_to[e]
+                dist_w = dist_v + up_cost[e]
+                if dist_w < dist.get(w, INF):
+                    dist[w] = dist_w
+                    parent[w] = v
+                    heapq.heappush(heap, (dist_w, w))
+        return dist, parent, len(done)
+
+    def seeds(self, node):
+        """Upward search seeds of the dense node `node`: (core node, cost, graph nodes walked from `node` to it, excluded)."""
+        core = int(self.core_of[node])
+        if core >= 0:
+            return [(core, 0.0, [])]
+        chain = int(self.inner_chain[node])
+        if chain < 0:
+            # a cycle of degree 2 junctions without any core node, which reaches no other node
+            return []
+        start, end = self.chain_ptr[chain], self.chain_ptr[chain + 1]
+        pos = int(self.inner_pos[node])
+        offset = float(self.chain_offset[start + pos])
+        walk = self.chain_nodes[start:end].tolist()
+        first, last = self.chain_ends[chain].tolist()
+        return [(first, offset, walk[:pos][::-1]), (last, float(self.chain_cost[chain]) - offset, walk[pos + 1:])]
+
+    def unpack(self, u, w):
+        """Dense graph nodes of the upward graph edge between the core nodes u and w, from u (excluded) to w."""
+        nodes = []
+        stack = [(u, w)]
+        while stack:
+            a, b = stack.pop()
+            low, high = (a, b) if self.rank[a] < self.rank[b] else (b, a)
+            edges = range(self.up_ptr[low], self.up_ptr[low + 1])
+            e = edges[int(np.searchsorted(self.up_to[self.up_ptr[low]:self.up_ptr[low + 1]], high))]
+            middle = int(self.up_middle[e])
+            if middle >= 0:
+                stack.append((middle, b))
+                stack.append((a, middle))
+                continue
+            chain = int(self.up_chain[e])
+            if chain >= 0:
+                walk = self.chain_nodes[self.chain_ptr[chain]:self.chain_ptr[chain + 1]].tolist()
+                nodes.extend(walk if self.chain_ends[chain, 0] == a else walk[::-1])
+            nodes.append(int(self.core_nodes[b]))
+        return nodes
+
+    @staticmethod
+    def cache_path_for(graph_path, content_hash, cost_model=None):
+        model_tag = "-{}".format(cost_model.tag()) if cost_model is not None else ""
+        return "{}.ch-v{}{}-{}.npz".format(os.path.splitext(graph_path)[0], CONTRACTION_VERSION, model_tag, content_hash[:16])
+
+    @classmethod
+    def from_graph_file(cls, csr, graph_path, cost_model=None):
+        """Load the hierarchy cached next to the input .txt, or build and cache it (see `stop_table.StopTable`)."""
+        cache_path = cls.cache_path_for(graph_path, file_content_hash(graph_path), cost_model)
+        if os.path.exists(cache_path):
+            ch = cls.load(cache_path, cost_model)
+            ch.from_cache = True
+            return ch
+        ch = cls.build(csr, cost_model)
+        ch.save(cache_path)
+        return ch
+
+    def save(self, path):
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, version=CONTRACTION_VERSION, **{key: getattr(self, key) for key in _SAVED})
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, cost_model=None):
+        with np.load(path) as data:
+            if int(data["version"]) != CONTRACTION_VERSION:
+                raise Exception("Contraction hierarchy cache {} has an unsupported version".format(path))
+            return cls(*(data[key] for key in _SAVED), cost_model=cost_model)
+
+
+_SAVED = ["node_ids", "core_nodes", "chain_ptr", "chain_nodes", "chain_offset", "chain_ends", "chain_cost", "rank",
+          "up_ptr", "up_to", "up_cost", "up_middle", "up_chain", "stop_nodes", "bucket_ptr", "bucket_stop", "bucket_dist",
+          "bucket_parent"]
+
+
+def _shortcuts(adj, v):
+    """(u, w, cost) of the shortcuts the contraction of v needs, from bounded witness searches."""
+    neighbours = list(adj[v].items())
+    shortcuts = []
+    for ii, (u, (cost_u, _, _)) in enumerate(neighbours):
+        targets = {w: cost_u + info[0] for w, info in neighbours[ii + 1:]}
+        if not targets:
+            continue
+        limit = max(targets.values())
+        dist = {u: 0.0}
+        heap = [(0.0, u)]
+        n_settled = 0
+        left = len(targets)
+        while heap and left and n_settled < _WITNESS_SETTLED:
+            dist_x, x = heapq.heappop(heap)
+            if dist_x > dist[x]:
+                continue
+            if dist_x > limit:
+                break
+            n_settled += 1
+            if x in targets:
+                left -= 1
+            for y, info in adj[x].items():
+                dist_y = dist_x + info[0]
+                if y != v and dist_y < dist.get(y, INF):
+                    dist[y] = dist_y
+                    heapq.heappush(heap, (dist_y, y))
+        # a tentative cost is the cost of a path too, so it is a witness as well
+        shortcuts.extend((u, w, path_cost) for w, path_cost in targets.items() if dist.get(w, INF) > path_cost)
+    return shortcuts
+
+
+def _edge_difference(adj, v, shortcuts, deleted):
+    return len(shortcuts) - len(adj[v]) + deleted[v]
+
+
+class CHRouter:
+    """Nearest target searches on a `ContractionHierarchy`, same interface as `astar.AStarRouter.nearest`.
+
+    The targets must be stops (warehouses or stores). The upward search from the source scans
+    the bucket of every node it expands, each up to the best target cost found so far, and stops
+    once its least cost exceeds it, as `routing.nearest_target_path` stops at the first settled
+    target. Only the leg to the chosen target is unpacked into graph nodes: up to the best
+    meeting node along the search, then down along the parents kept in the buckets.
+    """
+
+    def __init__(self, ch, cost_model=None):
+        """Constructor."""
+        if _spec(ch.cost_model) != _spec(cost_model):
+            raise Exception("The contraction hierarchy was built with the cost model {}, not {}".format(_spec(ch.cost_model), _spec(cost_model)))
+        self.ch = ch
+        self.cost_model = cost_model
+        # no A* bound: the searches are exact without one
+        self.bound = None
+        self.node_ids = ch.node_ids.tolist()
+        self.stop_ids = ch.node_ids[ch.stop_nodes].tolist()
+        self.counters = {"searches": 0, "settled": 0}
+
+    def nearest(self, source_id, targets, settled_targets=None, load=0):
+        """Cheapest node of `targets` ({node_id: rank}) from `source_id`, returns (node_id, cost, path).
+
+        Equal costs are resolved in favour of the lowest rank, as `routing.nearest_target_path`
+        does. If a `settled_targets` list is given, every reachable target is appended to it as
+        (node_id, cost).
+        """
+        ch = self.ch
+        self.counters["searches"] += 1
+        source = ch.node_index[source_id]
+        seeds = ch.seeds(source)
+        bucket_ptr, bucket_stop, bucket_dist, _ = ch._buckets
+        stop_ids = self.stop_ids
+        # best (cost, target rank, stop, meeting node), and the least cost to every target when they are traced
+        best = [INF, None, None, None]
+        found = {} if settled_targets is not None else None
+
+        def visit(v, dist_v):
+            for e in range(bucket_ptr[v], bucket_ptr[v + 1]):
+                cost = dist_v + bucket_dist[e]
+                if cost > best[0] and found is None:
+                    break
+                k = bucket_stop[e]
+                target_rank = targets.get(stop_ids[k])
+                if target_rank is None:
+                    continue
+                if found is not None and cost < found.get(k, INF):
+                    found[k] = cost
+                if cost < best[0] or (cost == best[0] and target_rank < best[1]):
+                    best[:] = [cost, target_rank, k, v]
+            return best[0] if found is None else INF
+
+        dist, parent, n_settled = ch.upward([(v, seed_cost) for v, seed_cost, _ in seeds], visit)
+        self.counters["settled"] += n_settled
+        if found is not None:
+            settled_targets.extend((stop_ids[k], cost) for k, cost in found.items())
+        if best[2] is None:
+            return None, None, []
+        return stop_ids[best[2]], best[0], [self.node_ids[node] for node in self._path(source, seeds, parent, best[3], best[2])]
+
+    def _path(self, source, seeds, parent, meet, k):
+        ch = self.ch
+        # core nodes from the seed up to the meeting node, then down to the k-th stop
+        up_path = [meet]
+        while parent[up_path[-1]] != -1:
+            up_path.append(parent[up_path[-1]])
+        up_path.reverse()
+        core_path = up_path + ch.down_path(meet, k)[1:]
+
+        # a source inside a chain first walks the chain to the seed its path starts from
+        nodes = [] if ch.core_of[source] >= 0 else [source]
+        # both seeds of a loop chain are on the same core node, the cheaper one is the one the search kept
+        nodes.extend(min((seed for seed in seeds if seed[0] == core_path[0]), key=lambda seed: seed[1])[2])
+        nodes.append(int(ch.core_nodes[core_path[0]]))
+        for u, w in zip(core_path[:-1], core_path[1:]):
+            nodes.extend(ch.unpack(u, w))
+        return nodes
+
+
+def _spec(cost_model):
+    return (cost_model if cost_model is not None else LinearCost()).spec
@@ -0,0 +1,103 @@
+import hashlib
+
+import numpy as np
+
+
+class LinearCost:
+    """cost = distance_weight * distance + time_weight * time.
+
+    The default weights (1, 1) give the cost the graphs are imported with (`graph.edge_simple_cost`).
+    `edge_costs` works on whole arrays of distances and times, one NumPy operation per model.
+    """
+
+    depends_on_load = False
+
+    def __init__(self, distance_weight=1.0, time_weight=1.0):
+        """Constructor."""
+        self.distance_weight = float(distance_weight)
+        self.time_weight = float(time_weight)
+        _check_weights(self.params())
+
+    def params(self):
+        return {"distance_weight": self.distance_weight, "time_weight": self.time_weight}
+
+    @property
+    def spec(self):
+        """The model as `name:param=value,...`, as read by `cost_model_from_spec`, and the key of the caches."""
+        return "{}:{}".format(_MODEL_NAMES[type(self)], ",".join("{}={!r}".format(key, value) for key, value in self.params().items()))
+
+    def tag(self):
+        """Short hash of `spec`, for cache file names."""
+        return hashlib.sha1(self.spec.encode("ascii")).hexdigest()[:8]
+
+    def edge_costs(self, distance, time, load=0):
+        """Cost of edges from arrays of their distance and time; `load` is ignored."""
+        return self.distance_weight * np.asarray(distance, dtype=np.float64) + self.time_weight * np.asarray(time, dtype=np.float64)
+
+
+class FuelTollCost(LinearCost):
+    """Money cost: fuel (price * consumption per unit of distance) and tolls per unit of distance, plus the driver's time."""
+
+    def __init__(self, fuel_price=1.0, consumption=1.0, toll=0.0, time_value=1.0):
+        """Constructor."""
+        self.fuel_price = float(fuel_price)
+        self.consumption = float(consumption)
+        self.toll = float(toll)
+        self.time_value = float(time_value)
+        super().__init__(self.fuel_price * self.consumption + self.toll, self.time_value)
+
+    def params(self):
+        return {"fuel_price": self.fuel_price, "consumption": self.consumption, "toll": self.toll, "time_value": self.time_value}
+
+
+class LoadCost(LinearCost):
+    """cost = (distance_weight + load_weight * load) * distance + time_weight * time: a heavier truck costs more per unit of distance.
+
+    The cost of every edge is affine in the load, so the costs for any load come from the
+    distance and time arrays in one operation and the costs at load 0 are the lowest ones
+    (a lower bound built on them holds for every load).
+    """
+
+    depends_on_load = True
+
+    def __init__(self, distance_weight=1.0, load_weight=0.0, time_weight=1.0):
+        """Constructor."""
+        self.load_weight = float(load_weight)
+        super().__init__(distance_weight, time_weight)
+
+    def params(self):
+        return {"distance_weight": self.distance_weight, "load_weight": self.load_weight, "time_weight": self.time_weight}
+
+    def edge_costs(self, distance, time, load=0):
+        """Cost of edges for a truck carrying `load`, a number or an array aligned with the edges."""
+        per_distance = self.distance_weight + self.load_weight * np.asarray(load, dtype=np.float64)
+        return per_distance * np.asarray(distance, dtype=np.float64) + self.time_weight * np.asarray(time, dtype=np.float64)
+
+
+_MODEL_NAMES = {LinearCost: "linear", FuelTollCost: "fuel", LoadCost: "load"}
+COST_MODELS = {name: model for model, name in _MODEL_NAMES.items()}
+
+
+def _check_weights(params):
+    # the searches need non negative costs
+    for key, value in params.items():
+        if not value >= 0:
+            raise Exception("Cost model parameter {} must be >= 0, not {}".format(key, value))
+
+
+def cost_model_from_spec(spec):
+    """Model from a `name[:param=value,...]` string, e.g. `linear:time_weight=2` or `load:load_weight=0.05`.
+
+    The names are those of `COST_MODELS` and the parameters those of the model constructor.
+    """
+    name, _, params = spec.partition(":")
+    if name not in COST_MODELS:
+        raise Exception("Unknown cost model {}, expected one of {}".format(name, ", ".join(COST_MODELS)))
+    kwargs = {}
+    for param in filter(None, params.split(",")):
+        key, _, value = param.partition("=")
+        kwargs[key.strip()] = float(value)
+    try:
+        return COST_MODELS[name](**kwargs)
+    except TypeError:
+        raise Exception("Cost model {} takes the parameters {}".format(name, ", ".join(COST_MODELS[name]().params())))
@@ -0,0 +1,346 @@
+import os
+from collections import OrderedDict
+
+import networkx as nx
+import numpy as np
+
+from graph import edge_simple_cost
+
+# --- Binary layout: header, then every array at a 64 bytes aligned offset, in _BINARY_ARRAYS order
+_BINARY_MAGIC = b"GTPCSR03"
+_BINARY_ALIGN = 64
+# magic, n_nodes, n_entries, bytes of the utf-8 node labels, source .txt sha1 (hex, zero padded)
+_BINARY_HEADER = np.dtype([("magic", "S8"), ("n_nodes", "<u8"), ("n_entries", "<u8"), ("n_label_bytes", "<u8"),
+                           ("source_hash", "S40")])
+# (attribute, dtype, length as a function of n_nodes, n_entries and n_label_bytes)
+_BINARY_ARRAYS = [
+    ("node_ids", "<i8", lambda n, m, b: n),
+    ("node_type", "i1", lambda n, m, b: n),
+    ("supply", "<i8", lambda n, m, b: n),
+    ("demand", "<i8", lambda n, m, b: n),
+    ("indptr", "<i8", lambda n, m, b: n + 1),
+    ("indices", "<i4", lambda n, m, b: m),
+    ("cost", "<f8", lambda n, m, b: m),
+    ("distance", "<f8", lambda n, m, b: m),
+    ("time", "<f8", lambda n, m, b: m),
+    ("x", "<f8", lambda n, m, b: n),
+    ("y", "<f8", lambda n, m, b: n),
+    ("edge_rank", "<i8", lambda n, m, b: m),
+    ("node_line", "i1", lambda n, m, b: n),
+    ("label_ptr", "<i8", lambda n, m, b: n + 1),
+    ("labels", "u1", lambda n, m, b: b),
+]
+
+
+# cost arrays of other cost models (and loads) kept by `edge_costs`, the least recently used dropped first
+_MAX_COST_ARRAYS = 16
+
+
+def _aligned(offset):
+    return (offset + _BINARY_ALIGN - 1) // _BINARY_ALIGN * _BINARY_ALIGN
+
+
+def _encode_labels(labels):
+    """(node_line, label_ptr, labels) arrays of a list of node labels, None for a node without a node line."""
+    encoded = [label.encode("utf-8") if label is not None else b"" for label in labels]
+    label_ptr = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(label) for label in encoded], out=label_ptr[1:])
+    node_line = np.array([label is not None for label in labels], dtype=np.int8)
+    return node_line, label_ptr, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+class CSRGraph:
+    """Compressed sparse row (CSR) view of an undirected graph.
+
+    Nodes are remapped to dense indices 0..N-1 following the graph node order. The
+    neighbors of the node with index i are indices[indptr[i]:indptr[i+1]] and every
+    undirected edge is stored once per direction, with its cost, distance and time. Node
+    coordinates x/y are NaN when the graph file has none.
+
+    `cost` holds the cost the graph was imported with; the costs of other `cost_models` models
+    are derived from the distance and time arrays on demand and kept, so the searches can switch
+    models without reading the graph file again.
+
+    What `to_networkx` needs to give back the graph `graph.import_graph_from` builds is kept too:
+    `edge_rank`, the rank of every entry's edge in the order the edges were first added, and the
+    utf-8 node labels, labels[label_ptr[i]:label_ptr[i+1]], with node_line[i] = 0 for the nodes
+    only referenced by edges (which get no attributes).
+    """
+
+    def __init__(self, node_ids, indptr, indices, cost, node_type, supply, demand, distance=None, time=None, x=None, y=None,
+                 edge_rank=None, node_line=None, label_ptr=None, labels=None):
+        """Constructor. Arrays already of the right dtype (e.g. memory-mapped ones) are kept without a copy."""
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.cost = np.asarray(cost, dtype=np.float64)
+        self.node_type = np.asarray(node_type, dtype=np.int8)
+        self.supply = np.asarray(supply, dtype=np.int64)
+        self.demand = np.asarray(demand, dtype=np.int64)
+        # graphs imported before edges kept distance/time only have the cost
+        self.distance = np.asarray(distance if distance is not None else cost, dtype=np.float64)
+        self.time = np.asarray(time if time is not None else np.zeros(len(self.cost)), dtype=np.float64)
+        self.x = np.asarray(x if x is not None else np.full(len(self.node_ids), np.nan), dtype=np.float64)
+        self.y = np.asarray(y if y is not None else np.full(len(self.node_ids), np.nan), dtype=np.float64)
+        # without them, the edges are added in entry order and every node has an empty label
+        self.edge_rank = np.asarray(edge_rank if edge_rank is not None else np.arange(len(self.indices)), dtype=np.int64)
+        self.node_line = np.asarray(node_line if node_line is not None else np.ones(len(self.node_ids)), dtype=np.int8)
+        self.label_ptr = np.asarray(label_ptr if label_ptr is not None else np.zeros(len(self.node_ids) + 1), dtype=np.int64)
+        self.labels = np.asarray(labels if labels is not None else np.zeros(0), dtype=np.uint8)
+
+        self.node_index = {int(node_id): ii for ii, node_id in enumerate(self.node_ids.tolist())}
+        self._lists = None
+        # (cost model spec, load) -> (costs array, costs list), see edge_costs
+        self._costs = OrderedDict()
+        # hits and misses of that cache
+        self.cost_cache_counters = {"hits": 0, "misses": 0}
+        # sorted lookup arrays of `node_positions` and `edge_entries`, built on first use
+        self._id_order = None
+        self._edge_keys = None
+        self._edge_order = None
+
+    @classmethod
+    def from_networkx(cls, graph, weight="cost"):
+        """Build the CSR arrays from a networkx graph imported by `graph.import_graph_from`."""
+        node_ids = list(graph.nodes())
+        node_index = {node_id: ii for ii, node_id in enumerate(node_ids)}
+
+        indptr = [0]
+        indices = []
+        cost = []
+        distance = []
+        time = []
+        for node_id in node_ids:
+            for neighbor_id, edge_attr in graph[node_id].items():
+                indices.append(node_index[neighbor_id])
+                cost.append(edge_attr[weight])
+                distance.append(edge_attr.get("distance", edge_attr[weight]))
+                time.append(edge_attr.get("time", 0.0))
+            indptr.append(len(indices))
+
+        nodes_attr = graph.nodes
+        node_type = [nodes_attr[node_id].get("type", -1) for node_id in node_ids]
+        supply = [nodes_attr[node_id].get("supply", 0) for node_id in node_ids]
+        demand = [nodes_attr[node_id].get("demand", 0) for node_id in node_ids]
+        x = [nodes_attr[node_id].get("x", np.nan) for node_id in node_ids]
+        y = [nodes_attr[node_id].get("y", np.nan) for node_id in node_ids]
+        labels = [nodes_attr[node_id].get("label", "") if nodes_attr[node_id] else None for node_id in node_ids]
+
+        return cls(node_ids, indptr, indices, cost, node_type, supply, demand, distance, time, x, y,
+                   None, *_encode_labels(labels))
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Build the CSR arrays from the flat `graph.GraphArrays` of `graph.read_graph_arrays`.
+
+        As in `import_graph_from`, an edge repeated in the file (in either direction) keeps
+        the values of its last line and the place of its first one: the neighbors of every node
+        are in the order their edges first appear, the order of the networkx adjacency.
+        """
+        n_nodes = len(arrays.node_ids)
+        node_dense = np.full(int(arrays.node_ids.max()) + 1 if n_nodes else 0, -1, dtype=np.int64)
+        node_dense[arrays.node_ids] = np.arange(n_nodes)
+        src = node_dense[arrays.edge_src]
+        dst = node_dense[arrays.edge_dst]
+
+        # the last line of every undirected edge, ranked by its first line
+        low = np.minimum(src, dst)
+        high = np.maximum(src, dst)
+        keys = low * n_nodes + high
+        _, first = np.unique(keys, return_index=True)
+        _, last_from_end = np.unique(keys[::-1], return_index=True)
+        keep = len(keys) - 1 - last_from_end
+
+        # both directions, a self loop only once
+        loop = low[keep] == high[keep]
+        both_src = np.concatenate([low[keep], high[keep][~loop]])
+        both_dst = np.concatenate([high[keep], low[keep][~loop]])
+        rank = np.concatenate([first, first[~loop]])
+        order = np.lexsort((rank, both_src))
+        distance = np.concatenate([arrays.edge_distance[keep], arrays.edge_distance[keep][~loop]])[order]
+        time = np.concatenate([arrays.edge_time[keep], arrays.edge_time[keep][~loop]])[order]
+
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(both_src, minlength=n_nodes), out=indptr[1:])
+
+        return cls(arrays.node_ids, indptr, both_dst[order], edge_simple_cost(distance, time),
+                   arrays.node_type, arrays.supply, arrays.demand, distance, time, arrays.node_x, arrays.node_y,
+                   rank[order], *_encode_labels(arrays.node_label))
+
+    def to_networkx(self):
+        """Rebuild the networkx graph `graph.import_graph_from` would give for the same file.
+
+        For a graph built by `from_arrays` (or loaded from its binary file) the nodes, their
+        attributes and the edges come back in the same order, so the graph writes out the same.
+        """
+        graph = nx.Graph()
+        node_ids = self.node_ids.tolist()
+        label_ptr = self.label_ptr.tolist()
+        labels = self.labels.tobytes()
+        graph.add_nodes_from((node_id, {"label": labels[label_ptr[ii]:label_ptr[ii + 1]].decode("utf-8"),
+                                        "type": node_type, "supply": supply, "demand": demand} if node_line else {})
+                             for ii, (node_id, node_line, node_type, supply, demand)
+                             in enumerate(zip(node_ids, self.node_line.tolist(), self.node_type.tolist(),
+                                              self.supply.tolist(), self.demand.tolist())))
+        located = np.flatnonzero(np.isfinite(self.x) & np.isfinite(self.y) & (self.node_line != 0))
+        for ii, x, y in zip(located.tolist(), self.x[located].tolist(), self.y[located].tolist()):
+            graph.nodes[node_ids[ii]]["x"] = x
+            graph.nodes[node_ids[ii]]["y"] = y
+
+        # every undirected edge once, in the order its edge was first added
+        src = np.repeat(np.arange(self.n_nodes), np.diff(self.indptr))
+        upper = np.flatnonzero(src <= self.indices)
+        upper = upper[np.argsort(self.edge_rank[upper], kind="stable")]
+        graph.add_edges_from((node_ids[u], node_ids[v], {"label": "cost: {}".format(cost), "cost": cost, "distance": distance, "time": time})
+                             for u, v, cost, distance, time
+                             in zip(src[upper].tolist(), self.indices[upper].tolist(), self.cost[upper].tolist(),
+                                    self.distance[upper].tolist(), self.time[upper].tolist()))
+        return graph
+
+    @property
+    def n_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def has_coordinates(self):
+        return self.n_nodes > 0 and bool(np.isfinite(self.x).all() and np.isfinite(self.y).all())
+
+    def adjacency_lists(self, cost_model=None, load=0):
+        """Return (indptr, indices, cost) as plain python lists, which the pure python searches iterate much faster than numpy arrays.
+
+        The costs are those of `cost_model` for a truck carrying `load` (see `edge_costs`), the stored `cost` by default.
+        """
+        if self._lists is None:
+            self._lists = (self.indptr.tolist(), self.indices.tolist(), self.cost.tolist())
+        if cost_model is None:
+            return self._lists
+        return self._lists[0], self._lists[1], self._model_costs(cost_model, load)[1]
+
+    def edge_costs(self, cost_model=None, load=0):
+        """Cost of every entry under `cost_model` (a `cost_models` model) for a truck carrying `load`, the stored `cost` by default.
+
+        The array is computed from the distance and time arrays in one operation, then kept for
+        the next calls with the same model (and load, for a model which depends on it).
+        """
+        if cost_model is None:
+            return self.cost
+        return self._model_costs(cost_model, load)[0]
+
+    def _model_costs(self, cost_model, load):
+        key = (cost_model.spec, load if cost_model.depends_on_load else 0)
+        costs = self._costs.get(key)
+        if costs is None:
+            self.cost_cache_counters["misses"] += 1
+            costs_array = cost_model.edge_costs(self.distance, self.time, load)
+            costs = self._costs[key] = (costs_array, costs_array.tolist())
+            if len(self._costs) > _MAX_COST_ARRAYS:
+                self._costs.popitem(last=False)
+        else:
+            self.cost_cache_counters["hits"] += 1
+            self._costs.move_to_end(key)
+        return costs
+
+    def node_positions(self, node_ids):
+        """Dense indices of an array of node ids, found by binary search instead of one `node_index` lookup per id."""
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        if self._id_order is None:
+            self._id_order = np.argsort(self.node_ids, kind="stable")
+        sorted_ids = self.node_ids[self._id_order]
+        found = np.minimum(np.searchsorted(sorted_ids, node_ids), max(self.n_nodes - 1, 0))
+        if self.n_nodes == 0 or not np.array_equal(sorted_ids[found], node_ids):
+            raise Exception("Node id not in the graph.")
+        return self._id_order[found]
+
+    def edge_entries(self, src, dst):
+        """Entries (positions in indices, cost, distance and time) of the edges src[k]--dst[k], given dense indices.
+
+        The (row, column) key of every entry is sorted once, then all the edges are found by one binary search.
+        """
+        if self._edge_keys is None:
+            rows = np.repeat(np.arange(self.n_nodes, dtype=np.int64), np.diff(self.indptr))
+            keys = rows * self.n_nodes + self.indices
+            self._edge_order = np.argsort(keys, kind="stable")
+            self._edge_keys = keys[self._edge_order]
+        query = np.asarray(src, dtype=np.int64) * self.n_nodes + np.asarray(dst, dtype=np.int64)
+        if len(query) == 0:
+            return np.zeros(0, dtype=np.int64)
+        found = np.minimum(np.searchsorted(self._edge_keys, query), max(len(self._edge_keys) - 1, 0))
+        if len(self._edge_keys) == 0 or not np.array_equal(self._edge_keys[found], query):
+            raise Exception("Edge not in the graph.")
+        return self._edge_order[found]
+
+    def update_edges(self, src, dst, distance, time):
+        """Set the distance, time and cost (`edge_simple_cost`) of the edges src[k]--dst[k], given dense indices, in both directions.
+
+        Read-only (memory-mapped) arrays are copied first, so the binary file is never written, and
+        the lists of `adjacency_lists` are patched in place; the costs of other cost models are dropped
+        and derived again on their next use. Returns the entries of both directions.
+        """
+        entries = np.concatenate([self.edge_entries(src, dst), self.edge_entries(dst, src)])
+        for name in ("cost", "distance", "time"):
+            if not getattr(self, name).flags.writeable:
+                setattr(self, name, np.array(getattr(self, name)))
+        self.distance[entries] = np.concatenate([distance, distance])
+        self.time[entries] = np.concatenate([time, time])
+        self.cost[entries] = edge_simple_cost(self.distance[entries], self.time[entries])
+        if self._lists is not None:
+            cost_list = self._lists[2]
+            for entry, cost in zip(entries.tolist(), self.cost[entries].tolist()):
+                cost_list[entry] = cost
+        self._costs.clear()
+        return entries
+
+    def save_binary(self, path, source_hash=""):
+        """Write the arrays to one raw little-endian file which `load_binary` memory-maps."""
+        header = np.zeros(1, dtype=_BINARY_HEADER)
+        header["magic"] = _BINARY_MAGIC
+        header["n_nodes"] = self.n_nodes
+        header["n_entries"] = len(self.indices)
+        header["n_label_bytes"] = len(self.labels)
+        header["source_hash"] = source_hash.encode("ascii")
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as outputfile:
+            outputfile.write(header.tobytes())
+            for name, dtype, _ in _BINARY_ARRAYS:
+                outputfile.write(b"\0" * (_aligned(outputfile.tell()) - outputfile.tell()))
+                outputfile.write(np.ascontiguousarray(getattr(self, name), dtype=dtype).tobytes())
+        # readers never see a partially written file
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def read_binary_hash(path):
+        """sha1 of the .txt the binary file was converted from ("" if unknown, or written by an older layout)."""
+        header = np.fromfile(path, dtype=_BINARY_HEADER, count=1)
+        if len(header) != 1 or not header["magic"][0].startswith(_BINARY_MAGIC[:6]):
+            raise Exception("{} is not a binary graph file".format(path))
+        if header["magic"][0] != _BINARY_MAGIC:
+            return ""
+        return header["source_hash"][0].decode("ascii")
+
+    @classmethod
+    def load_binary(cls, path, mmap=True):
+        """Load a file written by `save_binary`.
+
+        With `mmap` the arrays are read-only views on a np.memmap of the file, so every
+        process loading the same file shares one physical copy through the page cache.
+        """
+        raw = np.memmap(path, dtype=np.uint8, mode="r") if mmap else np.fromfile(path, dtype=np.uint8)
+        header = raw[:_BINARY_HEADER.itemsize].view(_BINARY_HEADER)[0]
+        if header["magic"] != _BINARY_MAGIC:
+            raise Exception("{} is not a binary graph file".format(path))
+        n_nodes = int(header["n_nodes"])
+        n_entries = int(header["n_entries"])
+        n_label_bytes = int(header["n_label_bytes"])
+
+        arrays = {}
+        offset = _BINARY_HEADER.itemsize
+        for name, dtype, length in _BINARY_ARRAYS:
+            offset = _aligned(offset)
+            n_bytes = length(n_nodes, n_entries, n_label_bytes) * np.dtype(dtype).itemsize
+            arrays[name] = raw[offset:offset + n_bytes].view(dtype)
+            offset += n_bytes
+
+        return cls(arrays["node_ids"], arrays["indptr"], arrays["indices"], arrays["cost"],
+                   arrays["node_type"], arrays["supply"], arrays["demand"], arrays["distance"], arrays["time"],
+                   arrays["x"], arrays["y"], arrays["edge_rank"], arrays["node_line"], arrays["label_ptr"], arrays["labels"])
@@ -0,0 +1,98 @@
+import numpy as np
+
+from graph import get_stores, get_warehouses
+
+
+class DeliveryState:
+    """Remaining warehouse supplies, store demands and truck state of a route search.
+
+    Warehouses and stores are indexed once, in the order of `get_warehouses`/`get_stores`
+    (the rank of a warehouse or store is its position there). Totals, the still active
+    warehouses and stores, and their masks are kept up to date in O(1) on every load or
+    unload, so a decision never rescans the graph nodes.
+    """
+
+    def __init__(self, warehouses_ids_list, warehouses_supplies_list, stores_ids_list, stores_demand_list,
+                 truck_node, truck_load, truck_cap_max):
+        """Constructor."""
+        self.warehouses_ids_list = list(warehouses_ids_list)
+        self.warehouses_supplies_list = list(warehouses_supplies_list)
+        self.stores_ids_list = list(stores_ids_list)
+        self.stores_demand_list = list(stores_demand_list)
+
+        self.warehouse_rank = {node_id: ii for ii, node_id in enumerate(self.warehouses_ids_list)}
+        self.store_rank = {node_id: ii for ii, node_id in enumerate(self.stores_ids_list)}
+
+        # total demand and supplies, at the start and remaining
+        self.initial_total_supply = sum(self.warehouses_supplies_list)
+        self.initial_total_demand = sum(self.stores_demand_list)
+        self.total_supply = self.initial_total_supply
+        self.total_demand = self.initial_total_demand
+
+        # {node_id: rank} of the warehouses with supplies and the stores with demand left,
+        # which is the targets mapping `routing.nearest_target_path` expects
+        self.active_warehouses = {node_id: ii for ii, node_id in enumerate(self.warehouses_ids_list) if self.warehouses_supplies_list[ii] > 0}
+        self.active_stores = {node_id: ii for ii, node_id in enumerate(self.stores_ids_list) if self.stores_demand_list[ii] > 0}
+        # the same as masks aligned with the ranks, for `stop_table.StopTable.nearest`
+        self.active_warehouses_mask = np.array([supply > 0 for supply in self.warehouses_supplies_list], dtype=bool)
+        self.active_stores_mask = np.array([demand > 0 for demand in self.stores_demand_list], dtype=bool)
+
+        self.truck_node = truck_node
+        self.truck_load = truck_load
+        self.truck_cap_max = truck_cap_max
+
+    @classmethod
+    def from_graph(cls, graph, truck_node, truck_load, truck_cap_max):
+        warehouses_ids_list, warehouses_supplies_list = get_warehouses(graph)
+        stores_ids_list, stores_demand_list = get_stores(graph)
+        return cls(warehouses_ids_list, warehouses_supplies_list, stores_ids_list, stores_demand_list,
+                   truck_node, truck_load, truck_cap_max)
+
+    def is_done(self):
+        """True once every demand is met, or the truck and the warehouses have nothing left to deliver."""
+        return self.total_demand == 0 or (self.truck_load + self.total_supply) == 0
+
+    def supply_of(self, warehouse_id):
+        return self.warehouses_supplies_list[self.warehouse_rank[warehouse_id]]
+
+    def demand_of(self, store_id):
+        return self.stores_demand_list[self.store_rank[store_id]]
+
+    def load_at(self, warehouse_id):
+        """Move the truck to a warehouse and load as much as its capacity allows, returns the loaded amount."""
+        rank = self.warehouse_rank[warehouse_id]
+        n_available_supplies = self.warehouses_supplies_list[rank]
+        # extra truck capacity, it will remain supplies; otherwise take all the warehouse supplies
+        loaded = min(n_available_supplies, self.truck_cap_max - self.truck_load)
+
+        self.warehouses_supplies_list[rank] -= loaded
+        self.total_supply -= loaded
+        self.truck_load += loaded
+        self.truck_node = warehouse_id
+        if self.warehouses_supplies_list[rank] <= 0:
+            self.active_warehouses.pop(warehouse_id, None)
+            self.active_warehouses_mask[rank] = False
+        return loaded
+
+    def unload_at(self, store_id):
+        """Move the truck to a store and supply as much of its demand as the load allows, returns the supplied amount."""
+        rank = self.store_rank[store_id]
+        n_available_demand = self.stores_demand_list[rank]
+        # the entire demand if the truck has enough, otherwise the whole truck load
+        supplied = min(n_available_demand, self.truck_load)
+
+        self.stores_demand_list[rank] -= supplied
+        self.total_demand -= supplied
+        self.truck_load -= supplied
+        self.truck_node = store_id
+        if self.stores_demand_list[rank] <= 0:
+            self.active_stores.pop(store_id, None)
+            self.active_stores_mask[rank] = False
+        return supplied
+
+    def write_to(self, graph):
+        """Store the remaining supplies and demands on the graph nodes."""
+        for warehouse_id, supply in zip(self.warehouses_ids_list, self.warehouses_supplies_list):
+            graph.nodes[warehouse_id]["supply"] = supply
+        for store_id, demand in zip(self.stores_ids_list, self.stores_demand_list):
+            graph.nodes[store_id]["demand"] = demand
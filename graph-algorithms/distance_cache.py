@@ -0,0 +1,141 @@
+import heapq
+from collections import OrderedDict
+
+from routing import INF
+
+
+class _ResumableSearch:
+    """Dijkstra from one source which settles nodes only as far as the queries need."""
+
+    def __init__(self, source):
+        self.dist = {source: 0.0}
+        self.pred = {source: -1}
+        self.settled = []
+        self.heap = [(0.0, source)]
+        self.done = set()
+
+    def expand(self, indptr, indices, cost):
+        """Settle the next node, returns False once the whole component is settled."""
+        heap = self.heap
+        dist = self.dist
+        while heap:
+            dist_u, u = heapq.heappop(heap)
+            if u in self.done:
+                continue
+            self.done.add(u)
+            self.settled.append(u)
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                dist_v = dist_u + cost[e]
+                if v not in dist or dist_v < dist[v]:
+                    dist[v] = dist_v
+                    self.pred[v] = u
+                    heapq.heappush(heap, (dist_v, v))
+            return True
+        return False
+
+    def affected_by(self, u, v, old_cost, new_cost):
+        """True if the new cost of the edge u--v makes a settled distance or predecessor wrong."""
+        for a, b in ((u, v), (v, u)):
+            if a not in self.done:
+                # not expanded yet: the edge is read with its new cost when it is
+                continue
+            if new_cost > old_cost and self.pred.get(b) == a:
+                return True
+            if new_cost < old_cost and self.dist[a] + new_cost < self.dist.get(b, INF):
+                return True
+        return False
+
+
+class DistanceCache:
+    """Shortest path searches of the source nodes already queried, shared by every search over one graph.
+
+    The search from a source is kept and resumed: a later query from the same node (by the
+    same or another truck) first scans the nodes already settled, in order of cost, and only
+    settles more nodes when none of them is an eligible target. The kept searches hold at most
+    `max_nodes` reached nodes in all, about 150 bytes each, the least recently used search
+    dropped first; the search of the current query is always kept, however far it went.
+    """
+
+    def __init__(self, csr, max_nodes=1 << 21):
+        """Constructor."""
+        self.csr = csr
+        self.max_nodes = max_nodes
+        self.rows = OrderedDict()
+        # nodes reached by the kept searches
+        self.n_nodes = 0
+        self.node_ids = csr.node_ids.tolist()
+        self.hits = 0
+        self.misses = 0
+
+    def _search(self, source_id):
+        search = self.rows.get(source_id)
+        if search is not None:
+            self.hits += 1
+            self.rows.move_to_end(source_id)
+            return search
+        self.misses += 1
+        search = _ResumableSearch(self.csr.node_index[source_id])
+        self.rows[source_id] = search
+        self.n_nodes += len(search.dist)
+        return search
+
+    def _grown(self, search, n_before):
+        # count the nodes a query reached, then drop the oldest searches over the budget
+        self.n_nodes += len(search.dist) - n_before
+        while self.n_nodes > self.max_nodes and len(self.rows) > 1:
+            _, dropped = self.rows.popitem(last=False)
+            self.n_nodes -= len(dropped.dist)
+
+    def nearest(self, source_id, targets):
+        """Cheapest node of `targets` ({node_id: rank}, as `routing.nearest_target_path`) from `source_id`.
+
+        Targets reached with the same cost are resolved in favour of the lowest rank.
+        Returns a tuple (node_id, cost, path), or (None, None, []) if none is reachable.
+        """
+        search = self._search(source_id)
+        n_before = len(search.dist)
+        indptr, indices, cost = self.csr.adjacency_lists()
+        node_ids = self.node_ids
+
+        best = None
+        best_id = None
+        best_cost = None
+        ii = 0
+        while True:
+            if ii == len(search.settled):
+                if not search.expand(indptr, indices, cost):
+                    break
+                continue
+            u = search.settled[ii]
+            dist_u = search.dist[u]
+            if best is not None and dist_u > best_cost:
+                break
+            node_id = node_ids[u]
+            if node_id in targets and (best is None or targets[node_id] < targets[best_id]):
+                best = u
+                best_id = node_id
+                best_cost = dist_u
+            ii += 1
+
+        self._grown(search, n_before)
+        if best is None:
+            return None, None, []
+        path = [best]
+        while search.pred[path[-1]] != -1:
+            path.append(search.pred[path[-1]])
+        path.reverse()
+        return best_id, best_cost, [node_ids[u] for u in path]
+
+    def invalidate_edges(self, src, dst, old_cost, new_cost):
+        """Drop the kept searches which the cost change of the edges src[k]--dst[k] (dense indices) makes wrong.
+
+        The CSR adjacency lists must already hold the new costs (see `csr_graph.CSRGraph.update_edges`);
+        the other searches stay valid and go on with the new costs. Returns the number of searches dropped.
+        """
+        changes = [(u, v, old, new) for u, v, old, new in zip(src, dst, old_cost, new_cost) if old != new]
+        dropped = [source_id for source_id, search in self.rows.items()
+                   if any(search.affected_by(u, v, old, new) for u, v, old, new in changes)]
+        for source_id in dropped:
+            self.n_nodes -= len(self.rows.pop(source_id).dist)
+        return len(dropped)
@@ -0,0 +1,82 @@
+import numpy as np
+
+from graph import edge_simple_cost
+
+
+def read_edge_updates(path):
+    """Read edge updates from a text file, one `node_id1,node_id2,distance,time` per line.
+
+    An empty distance or time keeps the current value, e.g. `12,40,,95` only changes the time.
+    Blank lines and lines starting with # are skipped.
+    """
+    updates = []
+    with open(path) as inputfile:
+        for line in inputfile:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = [field.strip() for field in line.split(",")]
+            if len(fields) != 4:
+                raise Exception("Edge update lines are node_id1,node_id2,distance,time: {}".format(line))
+            updates.append((int(fields[0]), int(fields[1]),
+                            float(fields[2]) if fields[2] else None, float(fields[3]) if fields[3] else None))
+    return updates
+
+
+def apply_edge_updates(graph, updates, csr=None, stop_table=None, cache=None, bound=None):
+    """Set new distance/time values on a set of edges and repair what was computed with the old costs.
+
+    `updates` holds (node_id1, node_id2, distance, time) tuples, None keeping the current value;
+    for an edge updated twice the last values win. The cost of every updated edge is computed
+    again with `edge_simple_cost`, in the networkx `graph` and in `csr` (a `csr_graph.CSRGraph`)
+    when given. Then only what the changes can alter is refreshed:
+
+    - `stop_table` (`stop_table.StopTable`): the rows whose shortest path tree changes are searched again;
+    - `cache` (`distance_cache.DistanceCache`): the kept searches made wrong are dropped;
+    - `bound` (`astar.GeometricBound`/`astar.LandmarkBound`): loosened so that it stays a lower bound.
+
+    Each of them is repaired with the costs of its own cost model (see `cost_models`).
+
+    The truck state is not touched, so a search started afterwards re-plans from where the truck
+    is. Returns a dict with the number of edges updated and of stop table rows/searches refreshed.
+    """
+    # the last update of every undirected edge, with its distance and time before this batch
+    changes = {}
+    for node_id1, node_id2, distance, time in updates:
+        if not graph.has_edge(node_id1, node_id2):
+            raise Exception("No edge between the nodes {} and {}".format(node_id1, node_id2))
+        key = (node_id1, node_id2) if (node_id2, node_id1) not in changes else (node_id2, node_id1)
+        edge_attr = graph[node_id1][node_id2]
+        before = changes[key][2:] if key in changes else (edge_attr["distance"], edge_attr["time"])
+        changes[key] = (distance if distance is not None else edge_attr["distance"],
+                        time if time is not None else edge_attr["time"]) + before
+        edge_attr["distance"], edge_attr["time"] = changes[key][:2]
+        edge_attr["cost"] = edge_simple_cost(edge_attr["distance"], edge_attr["time"])
+        edge_attr["label"] = "cost: {}".format(edge_attr["cost"])
+
+    node_ids1 = [node_id1 for node_id1, _ in changes]
+    node_ids2 = [node_id2 for _, node_id2 in changes]
+    new_distance, new_time, old_distance, old_time = np.array(list(changes.values()), dtype=np.float64).reshape(-1, 4).T
+    report = {"edges": len(changes), "stop_table_rows": 0, "cache_searches": 0}
+    if csr is None:
+        if stop_table is not None or cache is not None or bound is not None:
+            raise Exception("The stop table, distance cache and bounds are repaired from a CSR graph.")
+        return report
+
+    def costs(cost_model):
+        # old and new edge costs in the model of a repaired structure, at load 0 for the bounds
+        if cost_model is None:
+            return edge_simple_cost(old_distance, old_time), edge_simple_cost(new_distance, new_time)
+        return cost_model.edge_costs(old_distance, old_time), cost_model.edge_costs(new_distance, new_time)
+
+    src = csr.node_positions(node_ids1)
+    dst = csr.node_positions(node_ids2)
+    csr.update_edges(src, dst, new_distance, new_time)
+    if stop_table is not None:
+        report["stop_table_rows"] = stop_table.repair(csr, src, dst, *costs(stop_table.cost_model))
+    if cache is not None:
+        old_cost, new_cost = costs(None)
+        report["cache_searches"] = cache.invalidate_edges(src.tolist(), dst.tolist(), old_cost.tolist(), new_cost.tolist())
+    if bound is not None:
+        bound.edges_changed(src, dst, *costs(bound.cost_model))
+    return report
@@ -0,0 +1,174 @@
+import time
+from collections import OrderedDict
+
+from routing import INF
+
+# the time and node limits are checked every this many expanded states
+_CHECK_EVERY = 1024
+
+
+def solve_exact(visit_costs, state, upper_bound=INF, table_size=1 << 20, max_expanded=None, time_limit_s=None):
+    """Least cost route of a `delivery_state.DeliveryState`, by depth-first branch and bound over the route states.
+
+    A state is (truck node, truck load, remaining supplies, remaining demands); from it the truck
+    goes to any warehouse with supplies (and loads as much as its capacity allows) or to any
+    store with demand (and unloads as much as it can), the moves `goto_warehouse_or_store` picks
+    from, until the state is done. The leg costs are those of `visit_costs` (a
+    `local_search.VisitCosts` over the stops and the start node).
+
+    States are packed into one int (mixed radix digits of node, load, supplies and demands),
+    updated in O(1) by every move, and the search runs on an explicit stack, so the route
+    length is not bounded by the recursion limit. The transposition table keeps the least cost
+    each state was reached with, up to `table_size` states (the least recently used are
+    evicted), and a state reached again at no lower cost is skipped. A branch is cut when its cost plus a lower
+    bound of the rest (the farthest node the route must still visit) reaches the best cost
+    found, starting from `upper_bound` (e.g. the greedy route cost).
+
+    Returns a dict: cost and visits of the best route found (None if none beats `upper_bound`),
+    whether it is proven optimal (the search ended within `max_expanded` states and
+    `time_limit_s`), and the expanded/cut/skipped state counts, table evictions and time.
+    """
+    start = time.perf_counter()
+    warehouses = list(state.warehouses_ids_list)
+    stores = list(state.stores_ids_list)
+    n_warehouses = len(warehouses)
+    stops = warehouses + stores
+    index = [visit_costs.index[node_id] for node_id in stops]
+    dist = visit_costs.dist.tolist()
+    cap = max(state.truck_cap_max, state.truck_load)
+    supplies = list(state.warehouses_supplies_list)
+    demands = list(state.stores_demand_list)
+
+    # mixed radix digits: node (a visit_costs index), load, then every supply and demand
+    n_nodes = len(visit_costs.node_ids)
+    load_radix = n_nodes
+    stock_radix = []
+    radix = load_radix * (cap + 1)
+    for amount in supplies + demands:
+        stock_radix.append(radix)
+        radix *= max(amount, 0) + 1
+    node = visit_costs.index[state.truck_node]
+    load = state.truck_load
+    key = node + load * load_radix + sum(max(amount, 0) * r for amount, r in zip(supplies + demands, stock_radix))
+
+    # load + supply - demand never changes: with enough goods every store must be served,
+    # otherwise every warehouse must be emptied
+    serve_all_stores = state.truck_load + state.total_supply >= state.total_demand
+    counts = {"expanded": 0, "cut": 0, "skipped": 0, "evicted": 0}
+    table = OrderedDict()
+    best = {"cost": upper_bound, "visits": None}
+    visits = []
+    totals = [state.total_supply, state.total_demand]
+    stopped = [False]
+
+    def lower_bound(node, load):
+        row = dist[node]
+        must = 0.0
+        if serve_all_stores:
+            for k in range(n_warehouses, len(stops)):
+                if demands[k - n_warehouses] > 0 and row[index[k]] > must:
+                    must = row[index[k]]
+        else:
+            nearest_store = INF
+            for k in range(len(stops)):
+                if k < n_warehouses:
+                    if supplies[k] > 0 and row[index[k]] > must:
+                        must = row[index[k]]
+                elif demands[k - n_warehouses] > 0 and row[index[k]] < nearest_store:
+                    nearest_store = row[index[k]]
+            if load + totals[0] > 0:
+                must = max(must, nearest_store)
+        return must
+
+    def enter(node, load, cost):
+        # the moves of a newly reached state, nearest first, or None when the state ends the route
+        # or the limits are reached
+        counts["expanded"] += 1
+        if totals[1] == 0 or load + totals[0] == 0:
+            if cost < best["cost"]:
+                best["cost"] = cost
+                best["visits"] = list(visits)
+            return None
+        if counts["expanded"] % _CHECK_EVERY == 0 and (
+                (max_expanded is not None and counts["expanded"] >= max_expanded)
+                or (time_limit_s is not None and time.perf_counter() - start >= time_limit_s)):
+            stopped[0] = True
+        if stopped[0]:
+            return None
+
+        row = dist[node]
+        moves = []
+        if load < cap:
+            for k in range(n_warehouses):
+                if supplies[k] > 0 and row[index[k]] < INF:
+                    moves.append((row[index[k]], k, min(supplies[k], cap - load)))
+        if load > 0:
+            for k in range(n_warehouses, len(stops)):
+                if demands[k - n_warehouses] > 0 and row[index[k]] < INF:
+                    moves.append((row[index[k]], k, -min(demands[k - n_warehouses], load)))
+        # nearest first, so that good routes are found early and cut more
+        moves.sort()
+        return iter(moves)
+
+    def move(k, moved):
+        # take (moved > 0) or deliver (moved < 0) the goods of stop k, or undo it with -moved
+        if k < n_warehouses:
+            supplies[k] -= moved
+            totals[0] -= moved
+        else:
+            demands[k - n_warehouses] += moved
+            totals[1] += moved
+
+    # depth-first on an explicit stack, as a route makes one level per visit (a small capacity and
+    # a large demand would exceed the recursion limit): a frame is [node, load, cost, key, moves
+    # left, move its child state was reached with]
+    table[key] = 0.0
+    moves = enter(node, load, 0.0)
+    stack = [[node, load, 0.0, key, moves, None]] if moves is not None else []
+    while stack:
+        frame = stack[-1]
+        node, load, cost, key, moves, done = frame
+        if done is not None:
+            # back from the child state
+            frame[5] = None
+            visits.pop()
+            move(done[0], -done[1])
+            if stopped[0]:
+                break
+        leg_cost, k, moved = next(moves, (INF, None, None))
+        next_cost = cost + leg_cost
+        if next_cost >= best["cost"]:
+            stack.pop()
+            continue
+        next_node = index[k]
+        next_load = load + moved
+        move(k, moved)
+        if k < n_warehouses:
+            next_key = key + (next_node - node) + moved * load_radix - moved * stock_radix[k]
+        else:
+            next_key = key + (next_node - node) + moved * load_radix + moved * stock_radix[k]
+
+        if next_cost + lower_bound(next_node, next_load) >= best["cost"]:
+            counts["cut"] += 1
+        elif table.get(next_key, INF) <= next_cost:
+            counts["skipped"] += 1
+        else:
+            table[next_key] = next_cost
+            table.move_to_end(next_key)
+            if len(table) > table_size:
+                table.popitem(last=False)
+                counts["evicted"] += 1
+            visits.append((stops[k], moved))
+            next_moves = enter(next_node, next_load, next_cost)
+            if next_moves is not None:
+                frame[5] = (k, moved)
+                stack.append([next_node, next_load, next_cost, next_key, next_moves, None])
+                continue
+            visits.pop()
+        move(k, -moved)
+        if stopped[0]:
+            break
+
+    elapsed = time.perf_counter() - start
+    return {"cost": best["cost"] if best["visits"] is not None else None, "visits": best["visits"],
+            "optimal": not stopped[0], "time": elapsed, "table_size": len(table), **counts}
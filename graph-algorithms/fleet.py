@@ -0,0 +1,83 @@
+import heapq
+
+from delivery_state import DeliveryState
+
+
+class FleetTruck:
+    """One truck of a fleet: its parameters, its current node/load/arrival time and its route."""
+
+    def __init__(self, truck_id, start_node, cap_max, initial_load=0, load_threshold_factor=0.5):
+        """Constructor."""
+        self.truck_id = truck_id
+        self.start_node = start_node
+        self.cap_max = cap_max
+        self.initial_load = initial_load
+        self.load_threshold = load_threshold_factor * cap_max
+
+        self.node = start_node
+        self.load = initial_load
+        self.ready_time = 0.0
+        self.list_paths = []
+        self.cost = 0
+        # set once the truck can't reach anything useful any more
+        self.retired = False
+
+
+def path_time(graph, path):
+    """Travel time along a path, from the edges `time`."""
+    return sum(graph[path[i]][path[i + 1]]["time"] for i in range(len(path) - 1))
+
+
+def run_fleet(graph, trucks, cache, state=None):
+    """Event-driven greedy planning of a fleet sharing the warehouses supplies and stores demand.
+
+    The truck with the earliest arrival time takes the next decision, with the same rule as
+    `greedy_search.goto_warehouse_or_store` and its own capacity and threshold. Supplies and
+    demand are booked when the decision is taken, so no two trucks count on the same goods.
+    Every search goes through the shared `distance_cache.DistanceCache`, so trucks deciding
+    from the same node resume one search instead of starting over. A truck which finds no
+    warehouse to load at delivers its load instead; it retires once it is empty with nothing
+    left to load, or when no store it can reach needs goods.
+
+    Returns the number of decisions taken; the routes are stored on the trucks.
+    """
+    if state is None:
+        state = DeliveryState.from_graph(graph, truck_node=None, truck_load=0, truck_cap_max=0)
+
+    events = [(truck.ready_time, ii) for ii, truck in enumerate(trucks) if not truck.retired]
+    heapq.heapify(events)
+    fleet_load = sum(truck.load for truck in trucks)
+
+    n_decisions = 0
+    while events and state.total_demand != 0 and (fleet_load + state.total_supply) != 0:
+        ready_time, ii = heapq.heappop(events)
+        truck = trucks[ii]
+        n_decisions += 1
+
+        # the shared state carries the truck taking the decision
+        state.truck_node = truck.node
+        state.truck_load = truck.load
+        state.truck_cap_max = truck.cap_max
+        target_id, moved = None, 0
+        if truck.load < truck.load_threshold:
+            target_id, target_cost, path_to_go = cache.nearest(truck.node, state.active_warehouses)
+            moved = state.load_at(target_id) if target_id is not None else 0
+        # no warehouse left to load at (or a threshold above the capacity): a loaded truck delivers what it carries
+        if moved == 0 and truck.load > 0:
+            target_id, target_cost, path_to_go = cache.nearest(truck.node, state.active_stores)
+            moved = state.unload_at(target_id) if target_id is not None else 0
+
+        # an empty truck with nothing to load, or a loaded one which reaches no store needing goods
+        if target_id is None or moved == 0:
+            truck.retired = True
+            continue
+
+        fleet_load += state.truck_load - truck.load
+        truck.node = state.truck_node
+        truck.load = state.truck_load
+        truck.list_paths.append(path_to_go)
+        truck.cost += target_cost
+        truck.ready_time = ready_time + path_time(graph, path_to_go)
+        heapq.heappush(events, (truck.ready_time, ii))
+
+    return n_decisions
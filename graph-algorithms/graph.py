@@ -1,74 +1,186 @@
 import networkx as nx 
+import numpy as np
 import re
+from collections import namedtuple
+
+# "0" [label="0 W", type=2, supply=50, demand=0] or with the node coordinates: [..., demand=0, x=12.5, y=803.25]
+_NODE_LINE = re.compile(r'"(\d+)" \[label=("[^"]*"), type=(-?\d+), supply=(-?\d+), demand=(-?\d+)(?:, x=([^,\]\s]+), y=([^,\]\s]+))?')
+# "0"--"8"[label=" d = 435.738\n t = 112", distance=435.738, time=112]
+_EDGE_LINE = re.compile(r'"(\d+)"--"(\d+)"\[label="[^"]*", distance=([^,\]\s]+), time=([^,\]\s]+)')
+# fallbacks for lines whose attributes are missing or in another order
+_ANY_NODE_LINE = re.compile(r'"(\d*)" ?(?:\[(.*)\])?')
+_ANY_EDGE_LINE = re.compile(r'"(\d*)"--"(\d*)"\s*(?:\[(.*)\])?')
+# key=value or key="quoted value" inside the brackets
+_ATTRIBUTE = re.compile(r'(\w+)=("[^"]*"|[^,\s\]]+)')
+
+GraphArrays = namedtuple("GraphArrays", ["node_ids", "node_type", "supply", "demand", "node_x", "node_y", "node_label",
+                                         "edge_src", "edge_dst", "edge_distance", "edge_time", "edge_cost"])
+
+
+def _parse_dot(inputfile):
+    """Single pass over the generator's .dot lines.
+
+    Returns the nodes as {node_id: (label, type, supply, demand, x, y)}, in order of first mention
+    (a node may be referenced by an edge before its own line, its value is then None until
+    that line; x and y are None when the file has no coordinates), and the list of edges as (node_id1, node_id2, distance, time) in file order.
+    """
+    nodes = {}
+    edges = []
+    match_edge = _EDGE_LINE.match
+    match_node = _NODE_LINE.match
+    for line in inputfile:
+        if not line.startswith('"'):
+            continue
+
+        # --- An edge
+        regex_edge = match_edge(line)
+        if regex_edge is None and "--" in line:
+            # None for a node line whose label holds "--", which goes on to the node branch
+            regex_edge = _ANY_EDGE_LINE.match(line)
+        if regex_edge is not None and regex_edge.re is _ANY_EDGE_LINE:
+            if regex_edge.group(3) is None:
+                raise Exception("Error while converting Edge params")
+            params = dict(_ATTRIBUTE.findall(regex_edge.group(3)))
+            node_id1 = int(regex_edge.group(1))
+            node_id2 = int(regex_edge.group(2))
+            edges.append((node_id1, node_id2, float(params.get("distance", -1)), float(params.get("time", -1))))
+        elif regex_edge is not None:
+            node_id1 = int(regex_edge.group(1))
+            node_id2 = int(regex_edge.group(2))
+            edges.append((node_id1, node_id2, float(regex_edge.group(3)), float(regex_edge.group(4))))
+        if regex_edge is not None:
+            if node_id1 not in nodes:
+                nodes[node_id1] = None
+            if node_id2 not in nodes:
+                nodes[node_id2] = None
+            continue
+
+        # --- A node
+        regex_node = match_node(line)
+        if regex_node is not None:
+            x, y = regex_node.group(6, 7)
+            nodes[int(regex_node.group(1))] = (regex_node.group(2), int(regex_node.group(3)),
+                                               int(regex_node.group(4)), int(regex_node.group(5)),
+                                               float(x) if x is not None else None, float(y) if y is not None else None)
+            continue
+        regex_node = _ANY_NODE_LINE.match(line)
+        if regex_node is not None:
+            if regex_node.group(2) is None:
+                raise Exception("Error while converting Node params")
+            params = dict(_ATTRIBUTE.findall(regex_node.group(2)))
+            nodes[int(regex_node.group(1))] = (params.get("label"), int(params.get("type", -1)),
+                                               int(params.get("supply", -1)), int(params.get("demand", -1)),
+                                               float(params["x"]) if "x" in params else None,
+                                               float(params["y"]) if "y" in params else None)
+
+    return nodes, edges
+
 
 def import_graph_from(graph, path=None):
+    """Fill a networkx graph from a .txt file in the generator's .dot format.
 
+    Nodes get label, type, supply and demand, and x/y when the file has node coordinates;
+    edges get distance, time and cost = edge_simple_cost(distance, time).
+    """
     with open(path) as inputfile:
-        print("Reading .dot >>>>>>>>>>>>>")
-        for line in inputfile:
-            print(line)
-            
-            # --- A node
-            regex_node = re.findall("^\"[0-9]*\"\ ", line)
-            if regex_node:
-                # Get node id
-                node_id = int(regex_node[0].replace("\"", " ").strip())
-                # Get node parameters
-                regex_para_node = re.findall(r"\[.*\]", line)
-                if regex_para_node:
-                    # "0" [label="0WAREHOUSE", type=2, supply=6, demand=0]
-                    str_params = regex_para_node[0].replace("["," ").replace("]", " ").strip().split(",")
-    
-                    node_label = ""
-                    node_type = -1
-                    node_demand = -1
-                    node_supply = -1
-                    for param in str_params:
-                        param_key_value = param.strip().split("=")
-                        if param_key_value[0] == "label":
-                            node_label = param_key_value[1] + ": "
-                        elif param_key_value[0] == "type":
-                            node_type = int(param_key_value[1])
-                        elif param_key_value[0] == "supply":
-                            node_supply = int(param_key_value[1])
-                        elif param_key_value[0] == "demand":
-                            node_demand = int(param_key_value[1])
-
-                    graph.add_node(node_id, label = node_label, type = node_type, supply = node_supply, demand=node_demand)
-                else:
-                    raise Exception("Error while converting Node params")
-
-            # --- An edge
-            regex_edge = re.findall("^\"[0-9]*\"--\"[0-9]*", line)
-            if regex_edge:
-                # Get edge ids
-                ids = regex_edge[0].replace("\"", " ").strip().split(" -- ")
-                node_id1 = int(ids[0])
-                node_id2 = int(ids[1])
-                # Get edge parameters
-                regex_para_edge = re.findall(r"\[.*\]", line)
-                if regex_para_edge:
-                    # "0"--"8"[label=" d = 435.738\n t = 112", distance=435.738, time=112]
-                    str_params = regex_para_edge[0].replace("["," ").replace("]"," ").strip().split(",")
-                    edge_label = ""
-                    edge_dist = -1
-                    edge_time = -1
-                
-                    for param in str_params:
-                        
-                        param_key_value = param.strip().split("=")
-                        if param_key_value[0] == "label":
-                            edge_label = param_key_value[1] + param_key_value[2] + param_key_value[3]
-                        elif param_key_value[0] == "distance":
-                            edge_dist = float(param_key_value[1])
-                        elif param_key_value[0] == "time":
-                            edge_time = float(param_key_value[1])
-
-                        edge_label = "cost: {}".format(edge_simple_cost(edge_dist,edge_time))
-                        graph.add_edge(node_id1, node_id2, label=edge_label, cost= edge_simple_cost(edge_dist,edge_time) )
-                else:
-                    raise Exception("Error while converting Edge params")
-    
+        nodes, edges = _parse_dot(inputfile)
+
+    nodes_to_add = []
+    for node_id, params in nodes.items():
+        if params is None:
+            # only referenced by edges, same as a bare graph.add_edge endpoint
+            nodes_to_add.append((node_id, {}))
+            continue
+        node_label, node_type, node_supply, node_demand, node_x, node_y = params
+        node_attr = {"label": _node_label(node_label), "type": node_type, "supply": node_supply, "demand": node_demand}
+        if node_x is not None and node_y is not None:
+            node_attr["x"] = node_x
+            node_attr["y"] = node_y
+        nodes_to_add.append((node_id, node_attr))
+
+    edges_to_add = []
+    for node_id1, node_id2, edge_dist, edge_time in edges:
+        edge_cost = edge_simple_cost(edge_dist, edge_time)
+        edges_to_add.append((node_id1, node_id2, {"label": "cost: {}".format(edge_cost), "cost": edge_cost,
+                                                  "distance": edge_dist, "time": edge_time}))
+
+    # one bulk insert keeps the node order of first mention, and for a repeated edge the last line wins
+    graph.add_nodes_from(nodes_to_add)
+    graph.add_edges_from(edges_to_add)
+
+
+def _node_label(label):
+    """The networkx label of a node line, from the quoted label of the file (None when the line has none)."""
+    return label + ": " if label is not None else ""
+
+
+def read_graph_arrays(path):
+    """Read a .txt file in the generator's .dot format into flat numpy arrays, without building a networkx graph.
+
+    Node arrays follow the order of first mention, as `import_graph_from` does. Edge
+    arrays hold one entry per edge line, repeated undirected edges included. Nodes without
+    coordinates get NaN in node_x/node_y. node_label holds the label `import_graph_from` gives
+    every node, None for the nodes only referenced by edges.
+    """
+    with open(path) as inputfile:
+        nodes, edges = _parse_dot(inputfile)
+
+    node_ids = np.fromiter(nodes.keys(), dtype=np.int64, count=len(nodes))
+    node_type = np.full(len(nodes), -1, dtype=np.int8)
+    supply = np.full(len(nodes), -1, dtype=np.int64)
+    demand = np.full(len(nodes), -1, dtype=np.int64)
+    node_x = np.full(len(nodes), np.nan)
+    node_y = np.full(len(nodes), np.nan)
+    node_label = [None] * len(nodes)
+    for ii, params in enumerate(nodes.values()):
+        if params is not None:
+            label, node_type[ii], supply[ii], demand[ii], x, y = params
+            node_label[ii] = _node_label(label)
+            if x is not None and y is not None:
+                node_x[ii] = x
+                node_y[ii] = y
+
+    edges_array = np.array(edges, dtype=np.float64).reshape(-1, 4)
+    edge_distance = edges_array[:, 2].copy()
+    edge_time = edges_array[:, 3].copy()
+    return GraphArrays(node_ids=node_ids, node_type=node_type, supply=supply, demand=demand, node_x=node_x, node_y=node_y,
+                       node_label=node_label, edge_src=edges_array[:, 0].astype(np.int64), edge_dst=edges_array[:, 1].astype(np.int64),
+                       edge_distance=edge_distance, edge_time=edge_time,
+                       edge_cost=edge_simple_cost(edge_distance, edge_time))
+
+
+def _format_number(value):
+    # integral values as the generator writes them (time=112), others with full precision
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def export_graph_to(graph, path):
+    """Write a networkx graph to a .txt file in the generator's .dot format, which `import_graph_from` reads back.
+
+    Every undirected edge is written once, after the line of its first end node.
+    """
+    type_letters = {0: "J", 1: "S", 2: "W"}
+    with open(path, "w") as outputfile:
+        outputfile.write("graph G {\n")
+        written = set()
+        for node_id, node_attr in graph.nodes(data=True):
+            node_type = node_attr.get("type", -1)
+            coordinates = ""
+            if "x" in node_attr and "y" in node_attr:
+                coordinates = ", x={}, y={}".format(_format_number(node_attr["x"]), _format_number(node_attr["y"]))
+            outputfile.write("\"{0}\" [label=\"{0} {1}\", type={2}, supply={3}, demand={4}{5}]\n".format(
+                node_id, type_letters.get(node_type, ""), node_type, node_attr.get("supply", 0), node_attr.get("demand", 0), coordinates))
+            written.add(node_id)
+            for neighbor_id, edge_attr in graph[node_id].items():
+                if neighbor_id in written and neighbor_id != node_id:
+                    continue
+                distance = _format_number(edge_attr["distance"])
+                time = _format_number(edge_attr["time"])
+                outputfile.write("\"{}\"--\"{}\"[label=\" d = {}\\n t = {}\", distance={}, time={}]\n".format(
+                    node_id, neighbor_id, distance, time, distance, time))
+        outputfile.write("}")
+
+
 # print the graph nodes or edges
 def print_graph(graph, nodes_dict, out_nodes=True, out_edges=True):
     if out_nodes:
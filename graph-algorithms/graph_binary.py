@@ -0,0 +1,99 @@
+"""
+Binary graph cache
+-----------
+
+Converts a generator .txt graph to a compact binary CSR file (see `csr_graph.CSRGraph.save_binary`)
+and loads it back through np.memmap, so repeated runs and worker processes skip the text parsing
+and share one physical copy of the arrays.
+
+The binary file is written next to the .txt as `<graph>.csr` and records the sha1 of the .txt it
+comes from; a stale file is converted again.
+
+# Example to report cold-start times:
+
+>>> python graph_binary.py --input_dot_graph graph1 graph2 graph3 --synthetic-nodes 100000
+
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+from csr_graph import CSRGraph
+from graph import read_graph_arrays
+from utilities import file_content_hash, load_graph_generator
+
+
+def binary_path_for(graph_path):
+    return os.path.splitext(graph_path)[0] + ".csr"
+
+
+def convert_graph(graph_path, binary_path=None):
+    """Parse the .txt graph once and write its binary CSR file, returns the binary file path."""
+    if binary_path is None:
+        binary_path = binary_path_for(graph_path)
+    csr = CSRGraph.from_arrays(read_graph_arrays(graph_path))
+    csr.save_binary(binary_path, source_hash=file_content_hash(graph_path))
+    return binary_path
+
+
+def load_graph_binary(graph_path, mmap=True):
+    """Memory-map the binary CSR file of a .txt graph, converting it first if missing or stale."""
+    binary_path = binary_path_for(graph_path)
+    if not os.path.exists(binary_path) or CSRGraph.read_binary_hash(binary_path) != file_content_hash(graph_path):
+        convert_graph(graph_path, binary_path)
+    return CSRGraph.load_binary(binary_path, mmap=mmap)
+
+
+_LOAD_SNIPPET = """
+import sys, time
+sys.path.insert(0, {here!r})
+import networkx as nx
+from csr_graph import CSRGraph
+from graph import import_graph_from
+kind, path = {kind!r}, {path!r}
+start = time.perf_counter()
+if kind == "text":
+    import_graph_from(nx.Graph(), path)
+elif kind == "binary":
+    csr = CSRGraph.load_binary(path)
+    csr.indices.sum()
+else:
+    CSRGraph.load_binary(path).to_networkx()
+print(time.perf_counter() - start)
+"""
+
+
+def cold_start_time(kind, path):
+    """Load time in a fresh interpreter: 'text' (import_graph_from), 'binary' (memmap) or 'binary_nx' (memmap then networkx)."""
+    snippet = _LOAD_SNIPPET.format(here=os.path.dirname(os.path.abspath(__file__)), kind=kind, path=path)
+    output = subprocess.run([sys.executable, "-c", snippet], check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input_dot_graph', type=str, nargs='*', default=[],
+                        help="Names of the .txt graphs in ../graph-generator to convert and time.")
+    parser.add_argument('--synthetic-nodes', type=int, default=0,
+                        help="Also time a synthetic graph with this number of nodes (0 to skip).")
+    args = parser.parse_args()
+
+    graph_paths = ["../graph-generator/{}.txt".format(name) for name in args.input_dot_graph]
+    tmp_dir = tempfile.TemporaryDirectory()
+    if args.synthetic_nodes > 0:
+        synthetic_path = os.path.join(tmp_dir.name, "synthetic_{}.txt".format(args.synthetic_nodes))
+        load_graph_generator().generate_graph(synthetic_path, args.synthetic_nodes, n_stores=args.synthetic_nodes // 100,
+                                              n_warehouses=args.synthetic_nodes // 500, total_supply=args.synthetic_nodes // 10,
+                                              total_demand=args.synthetic_nodes // 12)
+        graph_paths.append(synthetic_path)
+
+    print("{:<40} {:>12} {:>12} {:>12} {:>12}".format("graph", "text (s)", "binary (s)", "binary+nx (s)", "size (kB)"))
+    for graph_path in graph_paths:
+        binary_path = convert_graph(graph_path)
+        print("{:<40} {:>12.4f} {:>12.4f} {:>12.4f} {:>12.1f}".format(
+            os.path.basename(graph_path), cold_start_time("text", graph_path), cold_start_time("binary", binary_path),
+            cold_start_time("binary_nx", binary_path), os.path.getsize(binary_path) / 1024.0))
+    tmp_dir.cleanup()
@@ -0,0 +1,187 @@
+import numpy as np
+
+from routing import nearest_target_path
+from tracing import CANDIDATE, DECISION, NO_TRACE
+from utilities import NO_METRICS
+
+
+def goto_warehouse_or_store(graph, state, load_threshold, stop_table=None, tracer=NO_TRACE, router=None, max_iterations=None, leg_loads=None,
+                            checkpointer=None, metrics=NO_METRICS):
+    """Greedy search which repeatedly sends the truck either to a warehouse or to a store.
+
+    If the truck load is bellow `load_threshold` the truck goes to the warehouse with the least
+    path cost which still has supplies, otherwise to the store with the least path cost which
+    still has demand. `state` (a `delivery_state.DeliveryState`) is updated in place and the
+    graph is left untouched, so one imported graph can serve many searches. Decisions and
+    candidates are written to `tracer` (a `tracing.Tracer`) at its DECISION/CANDIDATE levels.
+    The searches off the stop table go through `router` (e.g. an `astar.AStarRouter`) when given,
+    with the truck load, for cost models where a heavier truck costs more (`cost_models.LoadCost`).
+    If a `leg_loads` list is given, the truck load along every returned path is appended to it.
+    With `max_iterations` the search stops early; calling it again with the same `state` goes on
+    from where the truck is (e.g. after `edge_updates.apply_edge_updates`, or from a checkpoint).
+    A `checkpoint.Checkpointer` is handed the state after every decision, to save it periodically.
+    `metrics` (a `utilities.Metrics`) times the decisions and the state updates, and counts the
+    decisions, stop table lookups, shortest path searches, settled nodes and candidate targets.
+
+    Returns the list of paths (lists of node ids) the truck follows and the number of iterations.
+    """
+    list_paths = []
+    trace_decisions = tracer.enabled(DECISION)
+    trace_candidates = tracer.enabled(CANDIDATE)
+    settled_before = router.counters["settled"] if router is not None else 0
+
+    iteration = 0
+    while not state.is_done() and (max_iterations is None or iteration < max_iterations):
+        path_to_go = []
+        truck_curr_node = state.truck_node
+        truck_curr_load = state.truck_load
+        settled_targets = [] if trace_candidates else None
+
+        iteration +=1
+        use_stop_table = stop_table is not None and truck_curr_node in stop_table.stop_index
+
+        # go to the costless warehouse
+        if truck_curr_load < load_threshold:
+            decision = "warehouse"
+            metrics.count("candidates", len(state.active_warehouses))
+            # one search from the truck node towards every warehouse which still has supplies
+            with metrics.timer("decision"):
+                if use_stop_table:
+                    target_id, target_cost, path_to_go = stop_table.nearest(truck_curr_node, stop_table.warehouses_slice(), state.active_warehouses_mask)
+                    if trace_candidates:
+                        settled_targets = stop_table.candidate_costs(truck_curr_node, stop_table.warehouses_slice(), state.active_warehouses_mask)
+                elif router is not None:
+                    target_id, target_cost, path_to_go = router.nearest(truck_curr_node, state.active_warehouses, settled_targets=settled_targets, load=truck_curr_load)
+                else:
+                    target_id, target_cost, path_to_go = nearest_target_path(graph, truck_curr_node, state.active_warehouses, weight="cost",
+                                                                             settled_targets=settled_targets, metrics=metrics)
+            # update supply of the warehouse and the truck load
+            with metrics.timer("state_update"):
+                moved = state.load_at(target_id) if target_id is not None else 0
+
+        # go to the costless store
+        else:
+            decision = "store"
+            metrics.count("candidates", len(state.active_stores))
+            # one search from the truck node towards every store which still has demand
+            with metrics.timer("decision"):
+                if use_stop_table:
+                    target_id, target_cost, path_to_go = stop_table.nearest(truck_curr_node, stop_table.stores_slice(), state.active_stores_mask)
+                    if trace_candidates:
+                        settled_targets = stop_table.candidate_costs(truck_curr_node, stop_table.stores_slice(), state.active_stores_mask)
+                elif router is not None:
+                    target_id, target_cost, path_to_go = router.nearest(truck_curr_node, state.active_stores, settled_targets=settled_targets, load=truck_curr_load)
+                else:
+                    target_id, target_cost, path_to_go = nearest_target_path(graph, truck_curr_node, state.active_stores, weight="cost",
+                                                                             settled_targets=settled_targets, metrics=metrics)
+            # update demand of the store and the truck load
+            with metrics.timer("state_update"):
+                moved = state.unload_at(target_id) if target_id is not None else 0
+        metrics.count("decisions")
+        metrics.count("stop_table_lookups" if use_stop_table else "shortest_path_searches")
+
+        if trace_candidates:
+            tracer.emit(CANDIDATE, "candidates", iteration=iteration, node=truck_curr_node, decision=decision, candidates=settled_targets)
+        if trace_decisions:
+            tracer.emit(DECISION, "decision", iteration=iteration, node=truck_curr_node, load=truck_curr_load,
+                        threshold=load_threshold, decision=decision, target=target_id, cost=target_cost, moved=moved,
+                        truck_load=state.truck_load, total_demand=state.total_demand, total_supply=state.total_supply,
+                        path=path_to_go)
+
+        # if a path from current node to a next one was found
+        if path_to_go:
+            list_paths.append(path_to_go)
+            if leg_loads is not None:
+                leg_loads.append(truck_curr_load)
+        else:
+            raise Exception("Can't reach node!!")
+        if checkpointer is not None:
+            checkpointer.after_decision(state, list_paths, leg_loads, iteration)
+
+    if router is not None:
+        metrics.count("settled_nodes", router.counters["settled"] - settled_before)
+    return list_paths, iteration
+
+
+def goto_warehouse_or_store_batch(stop_table, states, load_thresholds, path_cache=None):
+    """The greedy search of several trucks on the same graph, one decision of every truck per iteration.
+
+    Takes the decisions `goto_warehouse_or_store` takes with `stop_table`, for all the routes
+    which are not done at once: the costs from their truck nodes to every stop are gathered into
+    one matrix (`stop_table.StopTable.costs_from`, which also serves a start node off the table),
+    masked with the warehouses or stores each truck can go to and reduced with one argmin per row.
+    Every state is updated in place, as `goto_warehouse_or_store` does. A `path_cache` dict keeps
+    the paths rebuilt from the table by (source, target), e.g. across the batches of a server.
+
+    Returns one (list_paths, iteration, leg_loads, error) per state, where error is None, the
+    message of a route which could not reach any target, or the exception a route raised; such
+    a route stops there and the others go on.
+    """
+    results = [([], 0, [], None) for _ in states]
+    n_warehouses = stop_table.n_warehouses
+    running = [b for b, state in enumerate(states) if not state.is_done()]
+    while running:
+        try:
+            costs = stop_table.costs_from([states[b].truck_node for b in running])
+        except Exception:
+            # the rows one at a time, to stop only the routes whose lookup fails
+            rows = []
+            for b in running:
+                try:
+                    rows.append(stop_table.costs_from([states[b].truck_node])[0])
+                except Exception as error:
+                    results[b] = results[b][:3] + (error,)
+            running = [b for b in running if results[b][3] is None]
+            if not running:
+                break
+            costs = np.array(rows)
+        mask = np.zeros(costs.shape, dtype=bool)
+        to_warehouse = np.array([states[b].truck_load < load_thresholds[b] for b in running], dtype=bool)
+        for row, b in enumerate(running):
+            if to_warehouse[row]:
+                mask[row, :n_warehouses] = states[b].active_warehouses_mask
+            else:
+                mask[row, n_warehouses:] = states[b].active_stores_mask
+        masked = np.where(mask, costs, np.inf)
+        best = np.argmin(masked, axis=1)
+        reachable = np.isfinite(masked[np.arange(len(running)), best])
+
+        still_running = []
+        for row, b in enumerate(running):
+            state = states[b]
+            list_paths, iteration, leg_loads, _ = results[b]
+            if not reachable[row]:
+                results[b] = (list_paths, iteration + 1, leg_loads, "Can't reach node!!")
+                continue
+            target_id = int(stop_table.stop_ids[best[row]])
+            try:
+                if path_cache is None:
+                    path = stop_table.path_from(state.truck_node, target_id)
+                else:
+                    path = path_cache.get((state.truck_node, target_id))
+                    if path is None:
+                        path = path_cache[(state.truck_node, target_id)] = stop_table.path_from(state.truck_node, target_id)
+                truck_load = state.truck_load
+                if to_warehouse[row]:
+                    state.load_at(target_id)
+                else:
+                    state.unload_at(target_id)
+            except Exception as error:
+                results[b] = (list_paths, iteration + 1, leg_loads, error)
+                continue
+            list_paths.append(path)
+            leg_loads.append(truck_load)
+            results[b] = (list_paths, iteration + 1, leg_loads, None)
+            if not state.is_done():
+                still_running.append(b)
+        running = still_running
+    return results
+
+
+def paths_cost(graph, list_paths, weight="cost"):
+    """Overall cost of the truck's path: sum of the edge costs of every path."""
+    over_cost = 0
+    for path in list_paths:
+        for i in range(0, len(path) - 1):
+            over_cost += graph[path[i]][path[i + 1]][weight]
+    return over_cost
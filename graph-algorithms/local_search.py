@@ -0,0 +1,262 @@
+import time
+
+import numpy as np
+
+from routing import dijkstra_csr
+
+MOVES = ("2-opt", "or-opt", "swap")
+# longest run of consecutive visits an Or-opt move relocates
+_OR_OPT_MAX = 3
+# farthest apart two positions of a move can be, by default
+_WINDOW = 100
+# about this many moves are evaluated at once, between two looks at the clock
+_BLOCK_ENTRIES = 1 << 16
+
+
+class VisitCosts:
+    """Least path costs between the distinct nodes a route visits (its stops and start node), and their paths.
+
+    `dist[a, b]` is the cost from `node_ids[a]` to `node_ids[b]`, which `improve_visits` looks
+    up for every move instead of searching the graph.
+    """
+
+    def __init__(self, node_ids, dist, path):
+        """Constructor."""
+        self.node_ids = list(node_ids)
+        self.index = {node_id: k for k, node_id in enumerate(self.node_ids)}
+        self.dist = np.asarray(dist, dtype=np.float64)
+        self._path = path
+
+    @classmethod
+    def from_stop_table(cls, stop_table, node_ids):
+        """Costs from a `stop_table.StopTable`; a node which is not a stop (e.g. the start) is read from the stop rows."""
+        node_ids = list(node_ids)
+        rows = np.array([stop_table.stop_index.get(node_id, -1) for node_id in node_ids], dtype=np.int64)
+        dense = np.array([stop_table.node_index[node_id] for node_id in node_ids], dtype=np.int64)
+        if (rows < 0).sum() > 1:
+            raise Exception("Only one visited node can be off the stop table.")
+        # cost from a to b, or from b to a when a is not a stop (the graph is undirected)
+        forward = stop_table.node_dist[np.maximum(rows, 0)][:, dense]
+        dist = np.where((rows >= 0)[:, None], forward, forward.T)
+        np.fill_diagonal(dist, 0.0)
+
+        def path(source_id, target_id):
+            if source_id == target_id:
+                return [source_id]
+            if source_id in stop_table.stop_index:
+                return stop_table.path(source_id, target_id)
+            return stop_table.path(target_id, source_id)[::-1]
+        return cls(node_ids, dist, path)
+
+    @classmethod
+    def search(cls, csr, node_ids, cost_model=None):
+        """Costs from one Dijkstra per distinct node over a `csr_graph.CSRGraph`."""
+        node_ids = list(node_ids)
+        indptr, indices, cost = csr.adjacency_lists(cost_model)
+        dense = [csr.node_index[node_id] for node_id in node_ids]
+        dist = np.empty((len(node_ids), len(node_ids)), dtype=np.float64)
+        preds = {}
+        for k, source in enumerate(dense):
+            dist_k, preds[node_ids[k]] = dijkstra_csr(indptr, indices, cost, source)
+            dist[k] = np.asarray(dist_k)[dense]
+        csr_ids = csr.node_ids.tolist()
+
+        def path(source_id, target_id):
+            pred = preds[source_id]
+            node = csr.node_index[target_id]
+            path = [node]
+            while pred[path[-1]] != -1:
+                path.append(pred[path[-1]])
+            return [csr_ids[node] for node in reversed(path)]
+        return cls(node_ids, dist, path)
+
+    def path(self, source_id, target_id):
+        return self._path(source_id, target_id)
+
+    def cost(self, start_id, visits):
+        """Cost of a visit sequence from `start_id`."""
+        stops = [self.index[start_id]] + [self.index[node_id] for node_id in visits]
+        return float(self.dist[stops[:-1], stops[1:]].sum())
+
+    def paths(self, start_id, visits):
+        """Legs of a visit sequence from `start_id`, as `goto_warehouse_or_store` returns them."""
+        stops = [start_id] + list(visits)
+        return [self.path(source_id, target_id) for source_id, target_id in zip(stops[:-1], stops[1:])]
+
+
+def visits_from_paths(list_paths, leg_loads, final_load):
+    """Visited node and moved amount (+ loaded, - unloaded) of every leg of a greedy route."""
+    loads = list(leg_loads) + [final_load]
+    return [path[-1] for path in list_paths], [after - before for before, after in zip(loads[:-1], loads[1:])]
+
+
+def improve_visits(costs, start_id, visits, moved, start_load, truck_cap_max, budget_s, max_moves=None, window=_WINDOW):
+    """Local search over the order of the visits of a route, under a wall clock budget.
+
+    Every visit keeps its node and moved amount, so the same goods go from the same warehouses
+    to the same stores, and a move is only taken if the truck load stays within [0, truck_cap_max]
+    all along. The moves are 2-opt (reverse a run of visits), Or-opt (move a run of up to 3 visits
+    elsewhere) and swap (exchange two visits), between positions at most `window` apart; their
+    deltas are looked up in `costs` (a `VisitCosts`), in O(1) per move, a block of rows of the
+    neighbourhood at once. The best improving move is applied until none is left, the budget is
+    spent or `max_moves` moves were made; when the budget runs out within a neighbourhood, the
+    best move of the rows evaluated so far is applied.
+
+    Returns (visits, moved, history, counts): history is the list of (elapsed seconds, cost)
+    from the start cost on, and counts the number of applied moves of each kind.
+    """
+    start = time.perf_counter()
+    deadline = start + budget_s
+    seq = np.array([costs.index[start_id]] + [costs.index[node_id] for node_id in visits], dtype=np.int64)
+    amounts = np.array([0] + list(moved), dtype=np.int64)
+    loads = start_load + np.cumsum(amounts)
+    # the current route is feasible by definition, even from an initial load above the capacity
+    cap = max(truck_cap_max, int(loads.max()))
+
+    # the open route ends at a virtual node reached at no cost from anywhere
+    dist = np.zeros((len(costs.node_ids) + 1, len(costs.node_ids) + 1), dtype=np.float64)
+    dist[:-1, :-1] = costs.dist
+    end = len(costs.node_ids)
+
+    cost = float(dist[seq[:-1], seq[1:]].sum())
+    history = [(0.0, cost)]
+    counts = {move: 0 for move in MOVES}
+    n_moves = 0
+    while len(seq) > 2 and (max_moves is None or n_moves < max_moves) and time.perf_counter() < deadline:
+        move = _best_move(dist, np.append(seq, end), np.append(loads, loads[-1]), cap, window, deadline)
+        if move is None or move[0] >= -1e-12 * max(cost, 1.0):
+            break
+        delta, kind, first, second, length = move
+        order = _apply(len(seq), kind, first, second, length)
+        seq = seq[order]
+        amounts = amounts[order]
+        loads = start_load + np.cumsum(amounts)
+        cost = float(dist[seq[:-1], seq[1:]].sum())
+        counts[kind] += 1
+        n_moves += 1
+        history.append((time.perf_counter() - start, cost))
+
+    return [costs.node_ids[k] for k in seq[1:].tolist()], amounts[1:].tolist(), history, counts
+
+
+class _RangeExtrema:
+    """Least and greatest of loads[a..b] for arrays of a <= b, from a sparse table of O(n log n) entries."""
+
+    def __init__(self, loads):
+        """Constructor."""
+        self.lo = [loads]
+        self.hi = [loads]
+        span = 1
+        while 2 * span <= len(loads):
+            self.lo.append(np.minimum(self.lo[-1][:-span], self.lo[-1][span:]))
+            self.hi.append(np.maximum(self.hi[-1][:-span], self.hi[-1][span:]))
+            span *= 2
+
+    def query(self, a, b):
+        """(lo, hi) of every range a[k]..b[k]; the entries where a > b hold any value."""
+        a = np.minimum(a, b)
+        level = np.log2(b - a + 1).astype(np.int64)
+        lo = np.empty(a.shape, dtype=np.int64)
+        hi = np.empty(a.shape, dtype=np.int64)
+        for k in np.unique(level).tolist():
+            at = level == k
+            first, last = a[at], b[at] - (1 << k) + 1
+            lo[at] = np.minimum(self.lo[k][first], self.lo[k][last])
+            hi[at] = np.maximum(self.hi[k][first], self.hi[k][last])
+        return lo, hi
+
+
+def _best_move(dist, v, loads, cap, window=_WINDOW, deadline=None):
+    # v: positions 0 (start, fixed) .. m (last visit), m + 1 (virtual end); loads: after each position.
+    # w(a, b) is the cost from position a to position b. Every neighbourhood is evaluated by blocks
+    # of rows i (the first moved position) against the positions at most `window` away, so that a
+    # long route never needs an m x m matrix; past the `deadline` the best move so far is returned
+    m = len(v) - 2
+    width = max(1, min(window, m))
+    rows_per_block = max(1, _BLOCK_ENTRIES // (2 * width + _OR_OPT_MAX))
+    extrema = _RangeExtrema(loads)
+    amounts = np.diff(loads, prepend=loads[0])
+    hop = dist[v[:-1], v[1:]]
+    # 2-opt: the reversed hops cost their other direction, which may differ by rounding
+    asym = np.concatenate([[0.0], np.cumsum(dist[v[1:], v[:-1]] - hop)])
+    best = None
+
+    def w(a, b):
+        return dist[v[a], v[b]]
+
+    def blocks(n_rows):
+        for first in range(1, n_rows + 1, rows_per_block):
+            if deadline is not None and best is not None and time.perf_counter() > deadline:
+                return
+            yield np.arange(first, min(first + rows_per_block, n_rows + 1))[:, None]
+
+    offsets = np.arange(1, width + 1)[None, :]
+    # 2-opt: reverse positions i..j; inside, the load after position i + t becomes loads[i-1] + loads[j] - loads[j-1-t]
+    for i in blocks(m):
+        j = np.minimum(i + offsets, m)
+        delta = w(i - 1, j) + w(i, j + 1) - hop[i - 1] - hop[j] + asym[j] - asym[i]
+        lo, hi = extrema.query(i - 1, j - 1)
+        ends = loads[i - 1] + loads[j]
+        feasible = (i + offsets <= m) & (ends - hi >= 0) & (ends - lo <= cap)
+        best = _keep_best(best, delta, feasible, "2-opt", lambda a, b, i=i, j=j: (int(i[a, 0]), int(j[a, b]), 0))
+
+    # swap positions i < j: the loads after positions i..j-1 shift by amount[j] - amount[i]
+    for i in blocks(m):
+        j = np.minimum(i + offsets, m)
+        shift = amounts[j] - amounts[i]
+        apart = (w(i - 1, j) + w(j, i + 1) + w(j - 1, i) + w(i, j + 1)
+                 - (hop[i - 1] + hop[i]) - (hop[j - 1] + hop[j]))
+        adjacent = w(i - 1, j) + w(j, i) + w(i, j + 1) - hop[i - 1] - w(i, j) - hop[j]
+        delta = np.where(j == i + 1, adjacent, apart)
+        lo, hi = extrema.query(i, j - 1)
+        feasible = (i + offsets <= m) & (lo + shift >= 0) & (hi + shift <= cap)
+        best = _keep_best(best, delta, feasible, "swap", lambda a, b, i=i, j=j: (int(i[a, 0]), int(j[a, b]), 0))
+
+    # Or-opt: move positions i..e (e = i + length - 1) after position p, outside of i-1..e, by increasing p.
+    # Forward (p > e) the loads after e+1..p drop by the moved amount, backward (p < i-1) those after p+1..i-1 rise by it
+    for length in range(1, min(_OR_OPT_MAX, m) + 1):
+        for i in blocks(m - length + 1):
+            e = i + length - 1
+            p = np.concatenate([i - 1 - offsets[:, ::-1], e + offsets], axis=1)
+            forward = p > e
+            valid = (p >= 0) & (p <= m)
+            p = np.clip(p, 0, m)
+            moved = loads[e] - loads[i - 1]
+            seg_lo, seg_hi = extrema.query(i, e)
+            delta = (w(i - 1, e + 1) - hop[i - 1] - hop[e]) + w(p, i) + w(e, p + 1) - hop[p]
+            lo, hi = extrema.query(np.where(forward, e + 1, p + 1), np.where(forward, p, i - 1))
+            between_lo = np.where(forward, lo - moved, lo + moved)
+            between_hi = np.where(forward, hi - moved, hi + moved)
+            base = np.where(forward, loads[p] - moved, loads[p])
+            feasible = (valid & (between_lo >= 0) & (between_hi <= cap)
+                        & (base + seg_lo - loads[i - 1] >= 0) & (base + seg_hi - loads[i - 1] <= cap))
+            best = _keep_best(best, delta, feasible, "or-opt",
+                              lambda a, b, i=i, p=p, length=length: (int(i[a, 0]), int(p[a, b]), length))
+    return best
+
+
+def _keep_best(best, delta, feasible, kind, positions):
+    if not feasible.any():
+        return best
+    masked = np.where(feasible, delta, np.inf)
+    flat = int(np.argmin(masked))
+    if best is not None and masked.flat[flat] >= best[0]:
+        return best
+    a, b = np.unravel_index(flat, masked.shape)
+    return (float(masked.flat[flat]), kind) + positions(int(a), int(b))
+
+
+def _apply(n, kind, first, second, length):
+    """New order of the positions 0..n-1 after a move."""
+    order = np.arange(n)
+    if kind == "2-opt":
+        order[first:second + 1] = order[first:second + 1][::-1]
+    elif kind == "swap":
+        order[first], order[second] = second, first
+    else:
+        segment = order[first:first + length]
+        rest = np.concatenate([order[:first], order[first + length:]])
+        # `second` is the position the run goes after, counted before it was taken out
+        at = second + 1 if second < first else second + 1 - length
+        order = np.concatenate([rest[:at], segment, rest[at:]])
+    return order
@@ -0,0 +1,126 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from routing import dijkstra_csr
+
+# every worker gets about this many chunks of sources, so that a slow chunk does not hold the others back
+_CHUNKS_PER_WORKER = 4
+# most rows of one chunk: the workers write a chunk into a shared slot, which the parent copies out
+_ROWS_PER_TASK = 4
+# slots per worker, so that a worker never waits for the parent to empty its last slot
+_SLOTS_PER_WORKER = 2
+
+# the arrays a worker process attached to, set by `_attach_worker`
+_worker = {}
+
+
+class SharedArray:
+    """A NumPy array in a `multiprocessing.shared_memory` block, which other processes attach to by `handle`."""
+
+    def __init__(self, shape, dtype, name=None):
+        """Constructor: a new block, or the existing block `name`."""
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        nbytes = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=nbytes if name is None else 0)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    @classmethod
+    def copy_of(cls, values):
+        values = np.asarray(values)
+        shared = cls(values.shape, values.dtype)
+        shared.array[...] = values
+        return shared
+
+    @classmethod
+    def attach(cls, handle):
+        return cls(handle[1], handle[2], name=handle[0])
+
+    @property
+    def handle(self):
+        return self.shm.name, self.shape, self.dtype.str
+
+    def close(self, unlink=False):
+        self.array = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def multi_source_dijkstra(csr, source_ids, cost_model=None, workers=1):
+    """Full Dijkstra rows from many sources of a `csr_graph.CSRGraph`, the sources split over a process pool.
+
+    The adjacency arrays are put once in shared memory, which every worker attaches to and turns
+    into the adjacency lists `routing.dijkstra_csr` searches, instead of receiving a pickled graph
+    with every chunk; only the row numbers go through the pool. A worker writes the rows of a chunk
+    of sources into one of a few shared slots, which this process copies into the result matrices,
+    so the shared results stay a small fraction of the matrices. With `workers=1` the rows are
+    searched in this process. The costs are those of `cost_model` (see `cost_models`, the graph
+    costs by default); `benchmark.py --stop-table-workers` measures the speedup of the pool.
+
+    Returns (dist, pred): dist[k] is the cost from `source_ids[k]` to every dense node (INF when
+    unreachable) and pred[k] its shortest path tree (-1 at the root), as `routing.dijkstra_csr` does.
+    """
+    sources = np.array([csr.node_index[source_id] for source_id in source_ids], dtype=np.int64)
+    workers = min(workers or os.cpu_count(), max(len(sources), 1))
+    dist = np.empty((len(sources), csr.n_nodes), dtype=np.float64)
+    pred = np.empty((len(sources), csr.n_nodes), dtype=np.int32)
+    if workers <= 1:
+        indptr, indices, cost = csr.adjacency_lists(cost_model)
+        for k, source in enumerate(sources.tolist()):
+            dist[k], pred[k] = dijkstra_csr(indptr, indices, cost, source)
+        return dist, pred
+
+    n_chunks = max(workers * _CHUNKS_PER_WORKER, -(-len(sources) // _ROWS_PER_TASK))
+    chunks = [chunk for chunk in np.array_split(np.arange(len(sources)), n_chunks) if len(chunk)]
+    n_slots = workers * _SLOTS_PER_WORKER
+    rows_per_slot = max(len(chunk) for chunk in chunks)
+    shared = {"indptr": SharedArray.copy_of(csr.indptr),
+              "indices": SharedArray.copy_of(csr.indices),
+              "cost": SharedArray.copy_of(csr.edge_costs(cost_model)),
+              "sources": SharedArray.copy_of(sources),
+              "dist": SharedArray((n_slots, rows_per_slot, csr.n_nodes), np.float64),
+              "pred": SharedArray((n_slots, rows_per_slot, csr.n_nodes), np.int32)}
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_worker,
+                                 initargs=({key: value.handle for key, value in shared.items()},)) as executor:
+            pending = iter(chunks)
+            free_slots = list(range(n_slots))
+            running = set()
+            while True:
+                while free_slots:
+                    rows = next(pending, None)
+                    if rows is None:
+                        break
+                    running.add(executor.submit(_search_rows, free_slots.pop(), rows))
+                if not running:
+                    break
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    slot, rows = future.result()
+                    dist[rows] = shared["dist"].array[slot, :len(rows)]
+                    pred[rows] = shared["pred"].array[slot, :len(rows)]
+                    free_slots.append(slot)
+        return dist, pred
+    finally:
+        for value in shared.values():
+            value.close(unlink=True)
+
+
+def _attach_worker(handles):
+    for key, handle in handles.items():
+        _worker[key] = SharedArray.attach(handle)
+    # once per worker: the searches run on lists, which Python indexes faster than arrays
+    _worker["lists"] = [_worker[key].array.tolist() for key in ("indptr", "indices", "cost")]
+    _worker["sources"] = _worker["sources"].array.tolist()
+
+
+def _search_rows(slot, rows):
+    indptr, indices, cost = _worker["lists"]
+    dist, pred = _worker["dist"].array[slot], _worker["pred"].array[slot]
+    for k, row in enumerate(rows.tolist()):
+        dist[k], pred[k] = dijkstra_csr(indptr, indices, cost, _worker["sources"][row])
+    return slot, rows
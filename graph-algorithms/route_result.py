@@ -0,0 +1,156 @@
+import json
+from itertools import chain
+
+import numpy as np
+
+from csr_graph import CSRGraph
+
+
+class RouteResult:
+    """Route of a truck: its visit sequence as one array of node ids, split in legs (one path per decision).
+
+    Leg k is visits[leg_ptr[k]:leg_ptr[k+1]]; consecutive legs share their end/start node, as the
+    paths returned by `greedy_search.goto_warehouse_or_store` do. The cost, distance and time of
+    every hop are gathered by `evaluate` (in one lookup from the edge arrays of a `csr_graph.CSRGraph`)
+    and the exports stream the route instead of building a labelled copy of the graph.
+    """
+
+    def __init__(self, visits, leg_ptr):
+        """Constructor."""
+        self.visits = np.asarray(visits, dtype=np.int64)
+        self.leg_ptr = np.asarray(leg_ptr, dtype=np.int64)
+
+        # set by evaluate: per hop values and their totals
+        self.hop_cost = None
+        self.hop_distance = None
+        self.hop_time = None
+        self.cost = None
+        self.distance = None
+        self.time = None
+
+    @classmethod
+    def from_paths(cls, list_paths):
+        lengths = np.fromiter((len(path) for path in list_paths), dtype=np.int64, count=len(list_paths))
+        leg_ptr = np.zeros(len(list_paths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=leg_ptr[1:])
+        visits = np.fromiter(chain.from_iterable(list_paths), dtype=np.int64, count=int(leg_ptr[-1]))
+        return cls(visits, leg_ptr)
+
+    @property
+    def n_legs(self):
+        return len(self.leg_ptr) - 1
+
+    def legs(self):
+        """Iterate over the legs as views on `visits`."""
+        for k in range(self.n_legs):
+            yield self.visits[self.leg_ptr[k]:self.leg_ptr[k + 1]]
+
+    def to_paths(self):
+        return [leg.tolist() for leg in self.legs()]
+
+    def hop_mask(self):
+        """True for every visit followed by a hop of the same leg, i.e. all but the last visit of each leg."""
+        mask = np.ones(len(self.visits), dtype=bool)
+        ends = self.leg_ptr[1:][self.leg_ptr[1:] > self.leg_ptr[:-1]] - 1
+        mask[ends] = False
+        return mask
+
+    def evaluate(self, graph, cost_model=None, leg_loads=None):
+        """Gather the cost, distance and time of every hop and sum them up.
+
+        With a `csr_graph.CSRGraph` all the hops are looked up at once in its edge arrays; a networkx
+        graph (which has no edge arrays) is read in one pass over the hops. With a `cost_models`
+        model the hop costs are computed from the hop distances and times instead, for the truck
+        load of every leg (`leg_loads`, as collected by `goto_warehouse_or_store`).
+        """
+        hops = np.flatnonzero(self.hop_mask())
+        if isinstance(graph, CSRGraph):
+            positions = graph.node_positions(self.visits)
+            entries = graph.edge_entries(positions[hops], positions[hops + 1])
+            self.hop_cost = graph.cost[entries]
+            self.hop_distance = graph.distance[entries]
+            self.hop_time = graph.time[entries]
+        else:
+            edges = map(graph.get_edge_data, self.visits[hops].tolist(), self.visits[hops + 1].tolist())
+            values = np.array([(edge["cost"], edge["distance"], edge["time"]) for edge in edges], dtype=np.float64).reshape(-1, 3)
+            self.hop_cost, self.hop_distance, self.hop_time = values[:, 0], values[:, 1], values[:, 2]
+        if cost_model is not None:
+            hop_load = np.repeat(np.asarray(leg_loads if leg_loads is not None else np.zeros(self.n_legs), dtype=np.float64),
+                                 np.maximum(np.diff(self.leg_ptr) - 1, 0))
+            self.hop_cost = cost_model.edge_costs(self.hop_distance, self.hop_time, hop_load)
+        # running sums add the hops one after the other, the same rounding as `greedy_search.paths_cost`
+        self.cost = _running_total(self.hop_cost)
+        self.distance = _running_total(self.hop_distance)
+        self.time = _running_total(self.hop_time)
+        return self
+
+    def extend(self, other):
+        """Append the legs of another route, e.g. the re-plan after edge updates; both evaluated or neither."""
+        self.leg_ptr = np.concatenate([self.leg_ptr, other.leg_ptr[1:] + len(self.visits)])
+        self.visits = np.concatenate([self.visits, other.visits])
+        if self.hop_cost is not None and other.hop_cost is not None:
+            self.hop_cost = np.concatenate([self.hop_cost, other.hop_cost])
+            self.hop_distance = np.concatenate([self.hop_distance, other.hop_distance])
+            self.hop_time = np.concatenate([self.hop_time, other.hop_time])
+            self.cost = _running_total(self.hop_cost)
+            self.distance = _running_total(self.hop_distance)
+            self.time = _running_total(self.hop_time)
+        return self
+
+    def write_text(self, outputfile):
+        """Write the overall cost and one leg per line, as `[id, id, ...]`."""
+        outputfile.write("Truck path overall cost: " + str(self.cost) + "\n")
+        for leg in self.legs():
+            outputfile.write("[" + ", ".join(map(str, leg.tolist())) + "]\n")
+
+    def write_json(self, path, **fields):
+        """Write the totals, the extra `fields` and the legs to a .json file, one leg at a time."""
+        with open(path, "w") as outputfile:
+            outputfile.write("{")
+            for key, value in fields.items():
+                outputfile.write("{}: {}, ".format(json.dumps(key), json.dumps(value)))
+            outputfile.write("\"cost\": {}, \"distance\": {}, \"time\": {}, \"n_legs\": {}, \"legs\": [".format(
+                json.dumps(self.cost), json.dumps(self.distance), json.dumps(self.time), self.n_legs))
+            for k, leg in enumerate(self.legs()):
+                outputfile.write(("{}" if k == 0 else ", {}").format(json.dumps(leg.tolist())))
+            outputfile.write("]}\n")
+
+    def write_dot(self, graph, path):
+        """Write `graph` as a .dot file where every node label ends with its positions in the visit sequence.
+
+        The file is streamed node by node then edge by edge, in the layout of networkx's write_dot,
+        and the graph itself is left untouched.
+        """
+        # positions of every visited node, in visit order
+        order = np.argsort(self.visits, kind="stable")
+        visited, first = np.unique(self.visits[order], return_index=True)
+        groups = np.split(order, first[1:])
+        positions = {node_id: "".join("{}, ".format(pos) for pos in group.tolist())
+                     for node_id, group in zip(visited.tolist(), groups)}
+
+        with open(path, "w") as outputfile:
+            outputfile.write("strict graph {\n")
+            for node_id, node_attr in graph.nodes(data=True):
+                attributes = dict(node_attr)
+                attributes["label"] = attributes.get("label", "") + positions.get(node_id, "")
+                outputfile.write("{} [{}];\n".format(_dot_id(node_id), _dot_attributes(attributes)))
+            for u, v, edge_attr in graph.edges(data=True):
+                outputfile.write("{} -- {} [{}];\n".format(_dot_id(u), _dot_id(v), _dot_attributes(edge_attr)))
+            outputfile.write("}\n")
+
+
+def _running_total(values):
+    return float(np.cumsum(values)[-1]) if len(values) else 0
+
+
+def _dot_id(value):
+    return str(value) if isinstance(value, (int, np.integer)) else _dot_quote(str(value))
+
+
+def _dot_quote(text):
+    return "\"" + text.replace("\"", "\\\"") + "\""
+
+
+def _dot_attributes(attributes):
+    return ", ".join("{}={}".format(key, _dot_quote(value) if isinstance(value, str) else value)
+                     for key, value in attributes.items())
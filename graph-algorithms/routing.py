@@ -0,0 +1,87 @@
+import heapq
+from itertools import count
+
+from utilities import NO_METRICS
+
+INF = float("inf")
+
+
+def nearest_target_path(graph, source, targets, weight="cost", settled_targets=None, metrics=NO_METRICS):
+    """One-to-many Dijkstra from `source` which stops once the cheapest target is settled.
+
+    `targets` maps every eligible node id to its rank (e.g. its position in the
+    warehouses or stores list). Targets reached with the same cost are resolved in
+    favour of the lowest rank, as the former one-search-per-candidate loop did.
+
+    Returns a tuple (target_id, cost, path), or (None, None, []) when no target
+    can be reached from `source`. If a `settled_targets` list is given, every target
+    settled by the search is appended to it as (target_id, cost). The settled nodes are
+    counted in `metrics` (a `utilities.Metrics`).
+    """
+    tie = count()
+    seen = {source: 0}
+    pred = {source: None}
+    settled = set()
+    heap = [(0, next(tie), source)]
+
+    best_id = None
+    best_cost = None
+    while heap:
+        dist_u, _, u = heapq.heappop(heap)
+        if u in settled:
+            continue
+        # everything left in the heap is strictly more expensive than the best target
+        if best_id is not None and dist_u > best_cost:
+            break
+        settled.add(u)
+
+        if u in targets:
+            if settled_targets is not None:
+                settled_targets.append((u, dist_u))
+            if best_id is None or targets[u] < targets[best_id]:
+                best_id = u
+                best_cost = dist_u
+
+        for v, edge_attr in graph[u].items():
+            dist_v = dist_u + edge_attr[weight]
+            if v not in seen or dist_v < seen[v]:
+                seen[v] = dist_v
+                pred[v] = u
+                heapq.heappush(heap, (dist_v, next(tie), v))
+
+    metrics.count("settled_nodes", len(settled))
+    if best_id is None:
+        return None, None, []
+
+    path = [best_id]
+    while pred[path[-1]] is not None:
+        path.append(pred[path[-1]])
+    path.reverse()
+    return best_id, best_cost, path
+
+
+def dijkstra_csr(indptr, indices, weights, source):
+    """Full single-source Dijkstra over CSR adjacency lists (see `csr_graph.CSRGraph`).
+
+    Returns two lists indexed by dense node index: the cost from `source` (INF when
+    unreachable) and the predecessor on the shortest path tree (-1 for the source and
+    unreachable nodes).
+    """
+    n_nodes = len(indptr) - 1
+    dist = [INF] * n_nodes
+    pred = [-1] * n_nodes
+    dist[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        dist_u, u = heapq.heappop(heap)
+        if dist_u > dist[u]:
+            continue
+        for e in range(indptr[u], indptr[u + 1]):
+            v = indices[e]
+            dist_v = dist_u + weights[e]
+            if dist_v < dist[v]:
+                dist[v] = dist_v
+                pred[v] = u
+                heapq.heappush(heap, (dist_v, v))
+    return dist, pred
+
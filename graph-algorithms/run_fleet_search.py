@@ -0,0 +1,103 @@
+"""
+Description
+-----------
+
+Routes a fleet of trucks which share the warehouses supplies and the stores demand (see fleet.py).
+
+Each truck is given as 'start_node:cap_max[:initial_load[:load_threshold_factor]]'; the truck with
+the earliest arrival time (from the edges `time`) takes the next decision.
+
+# Example to run:
+
+>>> python run_fleet_search.py --name fleet --input_dot_graph graph2 --truck 0:25 5:25:10 12:15:0:0.3
+
+# Example to report the decisions per second as the fleet grows:
+
+>>> python run_fleet_search.py --input_dot_graph graph2 --truck_cap_max 10 --bench 1 10 100 300
+
+"""
+
+import argparse
+import datetime
+import random
+import time
+
+import networkx as nx
+
+from csr_graph import CSRGraph
+from distance_cache import DistanceCache
+from fleet import FleetTruck, run_fleet
+from graph import import_graph_from
+from graph_binary import load_graph_binary
+
+
+def parse_truck(truck_id, text, default_threshold_factor):
+    fields = text.split(":")
+    if len(fields) < 2 or len(fields) > 4:
+        raise Exception("A truck is 'start_node:cap_max[:initial_load[:load_threshold_factor]]', got '{}'".format(text))
+    initial_load = int(fields[2]) if len(fields) > 2 else 0
+    threshold_factor = float(fields[3]) if len(fields) > 3 else default_threshold_factor
+    return FleetTruck(truck_id, int(fields[0]), int(fields[1]), initial_load, threshold_factor)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--name', type=str, default="fleet",
+                        help="A name for the experiment.")
+    parser.add_argument('--input_dot_graph', type=str,
+                        help="The .txt file in dot format containig the graph.")
+    parser.add_argument('--truck', type=str, nargs='*', default=[],
+                        help="Trucks as 'start_node:cap_max[:initial_load[:load_threshold_factor]]'.")
+    parser.add_argument('--truck_cap_max', type=int, default=10,
+                        help="Truck load max capacity of the --bench trucks.")
+    parser.add_argument('--load-threshold-factor', type=float, default=0.5,
+                        help="Default load threshold factor of the trucks.")
+    parser.add_argument('--binary-graph', action='store_true',
+                        help="Load the graph from its memory-mapped binary file.")
+    parser.add_argument('--bench', type=int, nargs='*', default=[],
+                        help="Fleet sizes to benchmark, with random start nodes.")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed of the --bench start nodes.")
+    args = parser.parse_args()
+
+    input_dot_graph_path = "../graph-generator/{}.txt".format(args.input_dot_graph)
+    if args.binary_graph:
+        csr = load_graph_binary(input_dot_graph_path)
+        graph = csr.to_networkx()
+    else:
+        graph = nx.Graph()
+        import_graph_from(graph=graph, path=input_dot_graph_path)
+        csr = CSRGraph.from_networkx(graph)
+
+    if args.bench:
+        rnd = random.Random(args.seed)
+        node_ids = list(graph.nodes())
+        print("{:>10} {:>10} {:>12} {:>14} {:>10} {:>10}".format("trucks", "decisions", "time (s)", "decisions/s", "hits", "misses"))
+        for fleet_size in args.bench:
+            trucks = [FleetTruck(ii, rnd.choice(node_ids), args.truck_cap_max, 0, args.load_threshold_factor) for ii in range(fleet_size)]
+            cache = DistanceCache(csr)
+            start = time.perf_counter()
+            n_decisions = run_fleet(graph, trucks, cache)
+            elapsed = time.perf_counter() - start
+            print("{:>10} {:>10} {:>12.4f} {:>14.1f} {:>10} {:>10}".format(
+                fleet_size, n_decisions, elapsed, n_decisions / elapsed, cache.hits, cache.misses))
+    else:
+        trucks = [parse_truck(ii, text, args.load_threshold_factor) for ii, text in enumerate(args.truck)]
+        cache = DistanceCache(csr)
+        start = time.perf_counter()
+        n_decisions = run_fleet(graph, trucks, cache)
+        exp_total_time = time.perf_counter() - start
+
+        save_folder = "{:%Y_%m_%d__%H_%M}_{}.txt".format(datetime.datetime.now(), args.name)
+        with open(save_folder, "w+") as save_path_found:
+            save_path_found.write("Fleet of {} trucks, {} decisions in {} s\n".format(len(trucks), n_decisions, exp_total_time))
+            for truck in trucks:
+                save_path_found.write("\nTruck {}: started node: {}  initial load: {}  max capacity: {}  threshold: {}\n".format(
+                    truck.truck_id, truck.start_node, truck.initial_load, truck.cap_max, truck.load_threshold))
+                save_path_found.write("Truck path overall cost: {}  arrival time: {}{}\n".format(
+                    truck.cost, truck.ready_time, "  (stopped early, nothing left to reach)" if truck.retired else ""))
+                for path in truck.list_paths:
+                    save_path_found.write(str(path) + "\n")
+            save_path_found.write("\nFleet overall cost: {}\n".format(sum(truck.cost for truck in trucks)))
+        print("Fleet overall cost: {}".format(sum(truck.cost for truck in trucks)))
+        print("Path saved to text file: ", save_folder)
@@ -0,0 +1,123 @@
+"""
+Description
+-----------
+
+Batch runner for parameter grid searches of the greedy `goto_warehouse_or_store` algorithm.
+
+Every combination of graphs x truck capacities x load threshold factors x truck start nodes is
+solved on a process pool. Each graph is converted once to its binary CSR file (see
+graph_binary.py) and, with --stop-table, its warehouse/store cost table is built once; every
+worker process then loads them a single time in its initializer instead of receiving a pickled
+graph with each task. The stop table matrices are memory-mapped from their cache file, so the
+workers share one physical copy of them. The graph is read from its memory-mapped binary file,
+but every worker builds its own networkx graph from it, which the greedy search walks.
+
+One CSV row is written per run, with the overall cost, the number of iterations and the wall time.
+
+# Example to run:
+
+>>> python run_grid_search.py --input_dot_graph graph2 graph3 --truck_cap_max 10 15 20 25 --load-threshold-factor 0.2 0.5 0.7 --truck-start-node 0 --stop-table
+
+"""
+
+import argparse
+import csv
+import datetime
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from delivery_state import DeliveryState
+from graph_binary import convert_graph, load_graph_binary
+from greedy_search import goto_warehouse_or_store, paths_cost
+from stop_table import StopTable
+
+CSV_FIELDS = ["graph", "truck_cap_max", "load_threshold_factor", "truck_start_node", "truck_initial_load",
+              "overall_cost", "iterations", "remaining_demand", "remaining_supply", "wall_time", "error"]
+
+# graph name -> (networkx graph, memory-mapped stop table or None), filled once per worker process
+_worker_graphs = {}
+
+
+def graph_path_for(graph_name):
+    return "../graph-generator/{}.txt".format(graph_name)
+
+
+def prepare_graphs(graph_names, use_stop_table, workers=1):
+    """Convert every graph to its binary file and build its stop table cache (on `workers` processes), once, before the workers start."""
+    for graph_name in graph_names:
+        graph_path = graph_path_for(graph_name)
+        convert_graph(graph_path)
+        if use_stop_table:
+            StopTable.from_graph_file(load_graph_binary(graph_path).to_networkx(), graph_path, workers=workers)
+
+
+def _init_worker(graph_names, use_stop_table):
+    for graph_name in graph_names:
+        graph_path = graph_path_for(graph_name)
+        graph = load_graph_binary(graph_path).to_networkx()
+        stop_table = StopTable.from_graph_file(graph, graph_path, mmap=True) if use_stop_table else None
+        _worker_graphs[graph_name] = (graph, stop_table)
+
+
+def solve(run):
+    """Solve one grid point (graph_name, truck_cap_max, load_threshold_factor, truck_start_node, truck_initial_load) and return its CSV row."""
+    graph_name, truck_cap_max, load_threshold_factor, truck_start_node, truck_initial_load = run
+    graph, stop_table = _worker_graphs[graph_name]
+    row = {"graph": graph_name, "truck_cap_max": truck_cap_max, "load_threshold_factor": load_threshold_factor,
+           "truck_start_node": truck_start_node, "truck_initial_load": truck_initial_load,
+           "overall_cost": "", "iterations": "", "error": ""}
+
+    start = time.perf_counter()
+    state = DeliveryState.from_graph(graph, truck_node=truck_start_node, truck_load=truck_initial_load, truck_cap_max=truck_cap_max)
+    try:
+        list_paths, iteration = goto_warehouse_or_store(graph, state, load_threshold_factor * truck_cap_max, stop_table=stop_table)
+        row["overall_cost"] = paths_cost(graph, list_paths)
+        row["iterations"] = iteration
+    except Exception as error:
+        # e.g. "Can't reach node!!" when the threshold asks for supplies that are gone
+        row["error"] = str(error)
+    row["wall_time"] = time.perf_counter() - start
+    row["remaining_demand"] = state.total_demand
+    row["remaining_supply"] = state.total_supply
+    return row
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input_dot_graph', type=str, nargs='+',
+                        help="Names of the .txt graphs in ../graph-generator.")
+    parser.add_argument('--truck_cap_max', type=int, nargs='+', default=[1],
+                        help="Truck load max capacities.")
+    parser.add_argument('--load-threshold-factor', type=float, nargs='+', default=[0.5],
+                        help="Load threshold factors.")
+    parser.add_argument('--truck-start-node', type=int, nargs='+', default=[0],
+                        help="Truck start nodes.")
+    parser.add_argument('--truck-initial-load', type=int, default=0,
+                        help="Truck initial load.")
+    parser.add_argument('--stop-table', action='store_true',
+                        help="Take the decisions from the cached warehouse/store cost table.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="Number of worker processes of the runs.")
+    parser.add_argument('--stop-table-workers', type=int, default=1,
+                        help="Number of processes the stop tables are built on (see benchmark.py --stop-table-workers for the speedup).")
+    parser.add_argument('--output', type=str, default="{:%Y_%m_%d__%H_%M}_grid_search.csv".format(datetime.datetime.now()),
+                        help="The .csv summary file.")
+    args = parser.parse_args()
+
+    runs = list(itertools.product(args.input_dot_graph, args.truck_cap_max, args.load_threshold_factor,
+                                  args.truck_start_node, [args.truck_initial_load]))
+
+    start = time.perf_counter()
+    prepare_graphs(args.input_dot_graph, args.stop_table, args.stop_table_workers)
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(args.input_dot_graph, args.stop_table)) as executor:
+        rows = list(executor.map(solve, runs, chunksize=max(1, len(runs) // (4 * args.workers))))
+
+    with open(args.output, "w", newline="") as outputfile:
+        writer = csv.DictWriter(outputfile, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print("{} runs in {:.3f} s, summary saved to: {}".format(len(runs), time.perf_counter() - start, args.output))
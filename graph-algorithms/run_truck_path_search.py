@@ -22,24 +22,71 @@ This decision is based on a threshold(load-threshold-factor) for the current tru
 
 On the other hand, if the current truck load is bellow the threshold, the decision is to go to the warehouse with the path with the least cost and which still have goods to supply.
 
+4. With '--trace-level' (summary, decision or candidate) the algorithm steps are written as JSON Lines to '<date>_alg_log.jsonl', one event per line; '--log-alg' is the same as '--trace-level decision'. No log file is written when the trace is off.
+
+5. With '--edge-updates' (a file of 'node_id1,node_id2,distance,time' lines) the edge costs change after '--updates-after' decisions; the stop table and A* bounds are repaired and the rest of the route is planned from the truck state.
+
+6. '--cost-model' replaces the edge cost distance + time, e.g. 'linear:distance_weight=1,time_weight=0.5', 'fuel:fuel_price=1.6,consumption=0.35,toll=0.05,time_value=0.2' or 'load:distance_weight=1,load_weight=0.05,time_weight=1', where a heavier truck costs more per unit of distance. The costs are derived from the edge distance/time arrays, and the overall cost of the route is given in the model.
+
+
+7. With '--improve-ms' the order of the visits is then improved by a local search (2-opt, Or-opt and swap moves which keep the truck load feasible) within that wall clock budget, and the cost over time is reported.
+
+
+8. '--name exact' also searches the least cost route (branch and bound over the truck node, load and remaining supplies/demands, for small graphs), starting from the greedy route cost, and reports the optimality gap of the greedy route and the states expanded per second. The saved route is then the exact one.
+
+
+9. With '--checkpoint FILE' the search state (remaining supplies and demands, truck state and the route so far, delta encoded) is saved to FILE every '--checkpoint-every' decisions or '--checkpoint-seconds' seconds, by a background thread. '--resume FILE' goes on from it with the problem parameters it holds, loading the graph from its binary file when there is one.
+
+
+10. With '--contraction' the searches off the stop table run on a contraction hierarchy: the chains of degree 2 junctions are collapsed and the other nodes contracted once (cached next to the input .txt), then each decision is one upward search from the truck node, which scans the stop buckets it reaches and stops past the best target cost found.
+
+
+11. Every run ends with its metrics: the time of the import, precompute, search, decisions, state updates and export, and the counts of decisions, stop table lookups, shortest path searches, settled nodes, candidate targets and cache hits/misses, printed as one JSON line and saved to '<date>_<name>_metrics.json'. '--profile FILE' also saves the cProfile stats of the run to FILE and prints the slowest functions.
+
 
 # Example to run:
 
 >>> python run_truck_path_search.py --name goto_warehouse_or_store --input_dot_graph graph --truck_cap_max 6 --truck-start-node 0 --truck-initial-load 0 --load-threshold-factor 0.5 --log-alg
+>>> python run_truck_path_search.py --name exact --input_dot_graph graph2 --truck_cap_max 10 --truck-start-node 0 --load-threshold-factor 0.5 --stop-table
+>>> python run_truck_path_search.py --name ch --input_dot_graph graph2 --truck_cap_max 10 --truck-start-node 0 --contraction
+>>> python run_truck_path_search.py --name long --input_dot_graph graph2 --truck_cap_max 10 --truck-start-node 0 --checkpoint long.ckpt.npz --checkpoint-every 20
+>>> python run_truck_path_search.py --resume long.ckpt.npz
+>>> python run_truck_path_search.py --name prof --input_dot_graph graph2 --truck_cap_max 10 --truck-start-node 0 --profile prof.pstats
 
 """
 
 import networkx as nx
-from graph import import_graph_from, get_stores, get_warehouses
-from utilities import TicTac
-
-import copy 
+from astar import AStarRouter, GeometricBound, LandmarkBound
+from checkpoint import Checkpointer, load_checkpoint
+from cost_models import cost_model_from_spec
+from csr_graph import CSRGraph
+from delivery_state import DeliveryState
+from edge_updates import apply_edge_updates, read_edge_updates
+from contraction import CHRouter, ContractionHierarchy
+from exact_search import solve_exact
+from graph import import_graph_from
+from graph_binary import binary_path_for, load_graph_binary
+from local_search import VisitCosts, improve_visits, visits_from_paths
+from greedy_search import goto_warehouse_or_store
+from route_result import RouteResult
+from stop_table import StopTable
+from tracing import DECISION, OFF, SUMMARY, TRACE_LEVELS, Tracer
+from utilities import Metrics, file_content_hash
 
 import datetime
 import argparse
+import cProfile
+import json
+import os
+import pstats
+from itertools import accumulate
 
 INF = 9999999999999999999
 
+# the arguments which define the problem, saved in the checkpoints and taken back by --resume
+CHECKPOINT_ARGS = ["name", "input_dot_graph", "truck_cap_max", "truck_start_node", "truck_initial_load", "load_threshold_factor",
+                   "stop_table", "heuristic", "landmarks", "cost_model", "contraction"]
+
 # # Execution arguments
 parser = argparse.ArgumentParser()
 parser.add_argument('--name', type=str,
@@ -63,11 +110,59 @@ parser.add_argument('--truck-initial-load', type=int, default=0,
 parser.add_argument('--load-threshold-factor', type=float, default=0.5,
                     help="For the greedy algorithm which decides to either go to a warehouse or a store, the load threshold factor.")  
 
+parser.add_argument('--binary-graph', action='store_true',
+                    help="Load the graph from its memory-mapped binary file (<graph>.csr next to the .txt, converted on first use) instead of parsing the text.")
+parser.add_argument('--stop-table', action='store_true',
+                    help="Precompute the warehouse/store path costs once (cached next to the input .txt) and take each decision from that table.")
+parser.add_argument('--workers', type=int, default=1,
+                    help="Number of processes building the --stop-table when it is not cached yet.")
+parser.add_argument('--heuristic', type=str, choices=["none", "geometric", "landmarks"], default="none",
+                    help="A* lower bound of the searches: none (Dijkstra), geometric (node coordinates, from graphs generated with x/y) or landmarks (ALT, cached next to the input .txt).")
+parser.add_argument('--landmarks', type=int, default=8,
+                    help="Number of landmarks of --heuristic landmarks.")
+parser.add_argument('--contraction', action='store_true',
+                    help="Take the searches off the stop table on a contraction hierarchy (cached next to the input .txt) instead of Dijkstra/A*.")
+parser.add_argument('--edge-updates', type=str,
+                    help="File of edge updates (node_id1,node_id2,distance,time per line) applied during the search, then the route is re-planned from the truck state.")
+parser.add_argument('--updates-after', type=int, default=0,
+                    help="Number of decisions taken before the --edge-updates are applied.")
+parser.add_argument('--cost-model', type=str,
+                    help="Edge cost model name[:param=value,...] (linear, fuel or load, see cost_models.py) instead of distance + time.")
+parser.add_argument('--improve-ms', type=float, default=0,
+                    help="Wall clock budget (ms) of the local search which reorders the visits of the greedy route, 0 to skip it.")
+parser.add_argument('--exact-time-limit', type=float, default=60,
+                    help="With --name exact, the time limit (s) of the exact search; past it the best route found is not proven optimal.")
+parser.add_argument('--exact-table-size', type=int, default=1 << 20,
+                    help="With --name exact, the number of states kept by the transposition table.")
+parser.add_argument('--checkpoint', type=str,
+                    help="Save the search state to this .npz file every --checkpoint-every decisions or --checkpoint-seconds seconds.")
+parser.add_argument('--checkpoint-every', type=int, default=100,
+                    help="Number of decisions between two checkpoints.")
+parser.add_argument('--checkpoint-seconds', type=float, default=30,
+                    help="Seconds between two checkpoints.")
+parser.add_argument('--resume', type=str,
+                    help="Go on from this checkpoint (and keep saving to it unless --checkpoint is given); the problem arguments are taken from it.")
+parser.add_argument('--json', action='store_true',
+                    help="Also save the route, its cost, distance and time totals to a .json file next to the .txt result.")
+parser.add_argument('--profile', type=str,
+                    help="Profile the run with cProfile, save the stats to this file (see pstats) and print the slowest functions.")
+parser.add_argument('--profile-top', type=int, default=20,
+                    help="Number of functions printed by --profile, by cumulative time.")
+
 # --- Logger parameters
 parser.add_argument('--log-alg', action='store_true',
-                    help="Print or not algorithm steps.")    
+                    help="Print or not algorithm steps (same as --trace-level decision).")    
+parser.add_argument('--trace-level', type=str, choices=sorted(TRACE_LEVELS, key=TRACE_LEVELS.get), default="off",
+                    help="Algorithm trace written to <date>_alg_log.jsonl: off, summary, decision or candidate.")
 
 args = parser.parse_args()
+
+# --- Resume: the problem is the one of the checkpoint
+resumed = None
+if args.resume:
+    resumed = load_checkpoint(args.resume)
+    for key in CHECKPOINT_ARGS:
+        setattr(args, key, resumed[0]["args"].get(key, getattr(args, key)))
 _exp_name = args.name
 _truck_cap_max = args.truck_cap_max
 _load_threshold_factor = args.load_threshold_factor
@@ -75,229 +170,280 @@ _truck_initial_load = args.truck_initial_load
 _truck_start_node = args.truck_start_node
 _input_dot_graph = args.input_dot_graph
 _load_threshold = _load_threshold_factor* _truck_cap_max
-_log_alg = args.log_alg
+_trace_level = max(TRACE_LEVELS[args.trace_level], DECISION if args.log_alg else OFF)
+_stop_table = args.stop_table
+_binary_graph = args.binary_graph
+_heuristic = args.heuristic
+_n_landmarks = args.landmarks
+_contraction = args.contraction
+_export_json = args.json
+_edge_updates = args.edge_updates
+_updates_after = args.updates_after
+_improve_ms = args.improve_ms
+_exact = _exp_name == "exact"
+_cost_model = cost_model_from_spec(args.cost_model) if args.cost_model else None
+_checkpoint = args.checkpoint or args.resume
+if _checkpoint and _edge_updates:
+    raise Exception("--checkpoint and --resume do not take --edge-updates.")
+if _contraction and (_heuristic != "none" or _edge_updates):
+    raise Exception("--contraction does not take --heuristic nor --edge-updates.")
 
 # EXPERIMENT SETUP
-timers = TicTac()
+# named timers and counters of the run, saved as JSON at the end
+timers = Metrics()
+profiler = None
+if args.profile:
+    profiler = cProfile.Profile()
+    profiler.enable()
 # Start global timer
 timers.tic()
 
-# networkx graph object
-graph = nx.Graph()
-
 # --- Import graph from text file created by the generator
-import_graph_from(graph=graph, path="../graph-generator/{}.txt".format(_input_dot_graph))
-
-# Logging the algorithm 
-save_path_algo = open("{:%Y_%m_%d__%H_%M}_alg_log.txt".format(datetime.datetime.now()),"w+")
+_input_dot_graph_path = "../graph-generator/{}.txt".format(_input_dot_graph)
+_graph_hash = file_content_hash(_input_dot_graph_path) if _checkpoint else None
+if resumed is not None:
+    if resumed[0]["graph_hash"] != _graph_hash:
+        raise Exception("The graph {} changed since the checkpoint {}".format(_input_dot_graph_path, args.resume))
+    # no text parsing when the binary graph is there, which gives the same graph and .dot output
+    _binary_graph = _binary_graph or os.path.exists(binary_path_for(_input_dot_graph_path))
+with timers.timer("import"):
+    if _binary_graph:
+        csr_graph = load_graph_binary(_input_dot_graph_path)
+        graph = csr_graph.to_networkx()
+    else:
+        # networkx graph object
+        graph = nx.Graph()
+        import_graph_from(graph=graph, path=_input_dot_graph_path)
+        csr_graph = None
+
+# warehouses and stores are indexed once, the state is then updated in O(1) per visit
+if resumed is not None:
+    _, state, resumed_paths, resumed_loads, resumed_iteration = resumed
+else:
+    state = DeliveryState.from_graph(graph, truck_node=_truck_start_node, truck_load=_truck_initial_load, truck_cap_max=_truck_cap_max)
+
+# --- Warehouse/store path costs, loaded from the cache when this graph was already solved
+stop_table = None
+if _stop_table:
+    with timers.timer("precompute"):
+        stop_table = StopTable.from_graph_file(graph, _input_dot_graph_path, _cost_model, args.workers)
+    timers.count("stop_table_cache_hits" if stop_table.from_cache else "stop_table_cache_misses")
+
+# --- A* searches, with lower bounds from the node coordinates or from landmarks, and the searches of a cost model
+router = None
+with timers.timer("precompute"):
+    if _contraction:
+        if csr_graph is None:
+            csr_graph = CSRGraph.from_networkx(graph)
+        ch = ContractionHierarchy.from_graph_file(csr_graph, _input_dot_graph_path, _cost_model)
+        timers.count("contraction_cache_hits" if ch.from_cache else "contraction_cache_misses")
+        router = CHRouter(ch, _cost_model)
+        print("Contraction hierarchy: {} core nodes of {}, {} upward edges ({} shortcuts)".format(
+            ch.n_core, len(ch.node_ids), len(ch.up_to), ch.n_shortcuts))
+    elif _heuristic != "none" or _cost_model is not None:
+        if csr_graph is None:
+            csr_graph = CSRGraph.from_networkx(graph)
+        bound = None
+        if _heuristic == "geometric":
+            bound = GeometricBound(csr_graph, _cost_model)
+        elif _heuristic == "landmarks":
+            bound = LandmarkBound.from_graph_file(csr_graph, _input_dot_graph_path, _n_landmarks, _cost_model)
+            timers.count("landmarks_cache_hits" if bound.from_cache else "landmarks_cache_misses")
+        router = AStarRouter(csr_graph, bound, cost_model=_cost_model)
+
+# Logging the algorithm, no file at all when the trace is off
+tracer = Tracer("{:%Y_%m_%d__%H_%M}_alg_log.jsonl".format(datetime.datetime.now()), level=_trace_level)
+tracer.emit(SUMMARY, "start", graph=_input_dot_graph, truck_start_node=_truck_start_node, truck_initial_load=_truck_initial_load,
+            truck_cap_max=_truck_cap_max, load_threshold_factor=_load_threshold_factor,
+            total_demand=state.total_demand, total_supply=state.total_supply,
+            cost_model=_cost_model.spec if _cost_model is not None else None)
 
 # START
-truck_curr_node = _truck_start_node
-truck_curr_load = _truck_initial_load
-
-list_paths = []
-_, store_demand_list = get_stores(graph)
-_, warehouse_supply_list = get_warehouses(graph)
-# total demand and supplies
-tot_dem = sum(store_demand_list)
-tot_sup = sum(warehouse_supply_list)
-
-iteration = 0
-while sum(store_demand_list) != 0 and (truck_curr_load + sum(warehouse_supply_list)) != 0:
-    path_to_go = []
-    
-    iteration +=1
-    if _log_alg:
-        save_path_algo.write("\n----------- Iteration {}: Truck at node {}\nCurrent STATUS:\nTotal Demand: {}/{}  Demand list: {}\nTotal Supply: {}/{}  Supply list: {}\nTruck Current Load: {}/{}\n\n".format(iteration, truck_curr_node, sum(store_demand_list), tot_dem, store_demand_list, sum(warehouse_supply_list), tot_sup, warehouse_supply_list, truck_curr_load, _truck_cap_max))
-    
-    # go to the costless warehouse
-    if truck_curr_load < _load_threshold:
-        if _log_alg:
-            save_path_algo.write("\n----- A) Decision: GOTO A WAREHOUSE, as the load {} is bellow the threshold {}:\n".format(truck_curr_load, _load_threshold))
-        
-        warehouses_ids_list, warehouse_supply_list = get_warehouses(graph)
-        
-        if _log_alg:
-            save_path_algo.write("\n----- B) Searching the warehouse with the least path cost >>>\nSupplies list:{}\n".format(warehouse_supply_list))
-        
-        costless_warehouse_id = None
-        costless_warehouse_cost = INF
-        for ii in range(len(warehouses_ids_list)):
-            warehouse_id = warehouses_ids_list[ii]
-            warehouse_supply = warehouse_supply_list[ii]
-            # print(warehouse_id, " ", warehouse_supply)
-            
-            if warehouse_supply > 0:
-        
-                curr_path = nx.shortest_path(graph,source=truck_curr_node,target=warehouse_id, weight="cost")
-                curr_path_length = nx.shortest_path_length(graph,source=truck_curr_node,target=warehouse_id, weight="cost")
-                if _log_alg: # log or not
-                    save_path_algo.write("--- current W id: {}\n".format(warehouse_id))
-                    save_path_algo.write("--- path to current W: {}\n".format(curr_path))
-                    save_path_algo.write("--- path cost: {}\n\n".format(curr_path_length))
-                if curr_path_length < costless_warehouse_cost:
-                    costless_warehouse_cost = curr_path_length
-                    costless_warehouse_id = warehouse_id
-                    path_to_go = curr_path
-                # save_path_algo.write("--- GOTO: costless warehouse to go: {}\n".format(costless_warehouse_id))
-        if _log_alg:
-            save_path_algo.write("******Final Decision:\nGOTO warehouse {}\n".format(costless_warehouse_id))
-        # update supply of the store
-        if not costless_warehouse_id == None:
-            n_available_supplies = graph.nodes[costless_warehouse_id]["supply"]
-            # print("n_available_supplies: ", n_available_supplies)
-            # extra truck capacity, it will remain supplies
-            if (n_available_supplies + truck_curr_load) > _truck_cap_max:
-                truck_load_available = _truck_cap_max - truck_curr_load
-                # update warehouse supplies
-                graph.nodes[costless_warehouse_id]["supply"] -= truck_load_available
-                if _log_alg:
-                    save_path_algo.write("GET {} supplies from this warehouse\n\n".format(truck_load_available)) 
-                # truck at full capacity
-                truck_curr_load = _truck_cap_max
-            elif (n_available_supplies + truck_curr_load) <= _truck_cap_max:
-                remaining_supplies = _truck_cap_max - (n_available_supplies + truck_curr_load)
-                # update warehouse supplies
-                graph.nodes[costless_warehouse_id]["supply"] = 0
-                if _log_alg:
-                    save_path_algo.write("GET all supplies from this warehouse\n\n")
-                # load truck with all the warehouse supplies 
-                truck_curr_load = n_available_supplies + truck_curr_load
-            else:
-                raise Exception("Should not get into here.")
-            
-            truck_curr_node = costless_warehouse_id
-            
-            
-    # go to the costless store
-    elif truck_curr_load >= _load_threshold:
-        if _log_alg:
-            save_path_algo.write("\n----- A) Decision: GOTO A STORE, as the load {} is above the threshold {}:\n".format(truck_curr_load, _load_threshold))
-        
-        store_ids_list, store_demand_list = get_stores(graph)
-
-        if _log_alg:
-            save_path_algo.write("\n----- B) Searching the store with least path cost >>>\nDemand list:{}\n".format(store_demand_list))
-
-        costless_store_id = None
-        costless_store_cost = INF
-        for ii in range(len(store_ids_list)):
-            store_id = store_ids_list[ii]
-            store_demand = store_demand_list[ii]
-            # save_path_algo.write(store_id, " ", store_demand)
-            
-            # the store demand should be > 0
-            if store_demand > 0:
-
-                curr_path = nx.shortest_path(graph,source=truck_curr_node,target=store_id, weight="cost")
-                curr_path_length = nx.shortest_path_length(graph,source=truck_curr_node,target=store_id, weight="cost")
-                if _log_alg: # log or not
-                    save_path_algo.write("--- current S id: {}\n".format(store_id))
-                    save_path_algo.write("--- path to current S: {}\n".format(curr_path))
-                    save_path_algo.write("--- path cost: {}\n\n".format(curr_path_length))
-                if curr_path_length < costless_store_cost:
-                    costless_store_cost = curr_path_length
-                    costless_store_id = store_id
-                    path_to_go = curr_path
-                    
-                # save_path_algo.write("--- GOTO: costless store to go: {}\n".format(costless_store_id))
-
-        if _log_alg:
-            save_path_algo.write("******Final Decision:\nGOTO store {}\n".format(costless_store_id))
-        # update demand of the store
-        if not costless_store_id == None:
-            n_available_demand = graph.nodes[costless_store_id]["demand"]
-
-            # truck has more than enough supplies for the store
-            if truck_curr_load >= n_available_demand:
-                # update store demand
-                graph.nodes[costless_store_id]["demand"] = 0
-                if _log_alg:
-                    save_path_algo.write("SUPPLY the entire demand from this store\n\n") 
-                # truck at full capacity
-                truck_curr_load -= n_available_demand
-            
-            # supply the maximum the truck has
-            elif truck_curr_load < n_available_demand:
-                # update store demand
-                graph.nodes[costless_store_id]["demand"] -= truck_curr_load
-                if _log_alg:
-                    save_path_algo.write("SUPPLY the store with the current truck load of {}\n\n".format(truck_curr_load)) 
-                # load truck with all the warehouse supplies 
-                truck_curr_load = 0
-            else:
-                raise Exception("Should not get into here.")
-            
-            truck_curr_node = costless_store_id
-
-    # if a path from current node to a next one was found
-    if path_to_go:
-        list_paths.append(path_to_go)
+# truck load along every path, for the route cost of a load dependent cost model
+leg_loads = []
+checkpointer = None
+if _checkpoint:
+    checkpointer = Checkpointer(_checkpoint, {"args": {key: getattr(args, key) for key in CHECKPOINT_ARGS}, "graph_hash": _graph_hash},
+                                args.checkpoint_every, args.checkpoint_seconds)
+if resumed is not None:
+    leg_loads = resumed_loads
+    checkpointer.prefix_paths, checkpointer.prefix_iterations = resumed_paths, resumed_iteration
+    print("Resumed from {} after {} decisions".format(args.resume, resumed_iteration))
+with timers.timer("search"):
+    list_paths, iteration = goto_warehouse_or_store(graph, state, _load_threshold, stop_table=stop_table, tracer=tracer, router=router,
+                                                     max_iterations=_updates_after if _edge_updates else None, leg_loads=leg_loads,
+                                                     checkpointer=checkpointer, metrics=timers)
+if checkpointer is not None:
+    # the last checkpoint holds the whole route
+    checkpointer.submit(state, list_paths, leg_loads, iteration)
+    checkpointer.close()
+    print("Checkpoints: {} saved to {} ({} bytes), {:.2f} ms of snapshots in the search loop, {:.2f} ms of writes in the background".format(
+        checkpointer.n_saved, _checkpoint, checkpointer.size, checkpointer.snapshot_s * 1e3, checkpointer.write_s * 1e3))
+if resumed is not None:
+    list_paths = resumed_paths + list_paths
+    iteration += resumed_iteration
+print("Computing the truck's path overall cost...")
+# route totals, from the binary graph edge arrays when it was loaded
+with timers.timer("evaluate"):
+    route = RouteResult.from_paths(list_paths).evaluate(csr_graph if csr_graph is not None else graph, _cost_model, leg_loads)
+
+# --- Edge updates: new costs, repaired caches, then the rest of the route from the truck state
+if _edge_updates:
+    if csr_graph is None and stop_table is not None:
+        csr_graph = CSRGraph.from_networkx(graph)
+    updates_report = apply_edge_updates(graph, read_edge_updates(_edge_updates), csr=csr_graph, stop_table=stop_table,
+                                        bound=router.bound if router is not None else None)
+    print("Edge updates after {} decisions: {}".format(iteration, updates_report))
+    tracer.emit(SUMMARY, "edge_updates", iteration=iteration, **updates_report)
+    more_loads = []
+    with timers.timer("search"):
+        more_paths, more_iterations = goto_warehouse_or_store(graph, state, _load_threshold, stop_table=stop_table, tracer=tracer, router=router,
+                                                              leg_loads=more_loads, metrics=timers)
+    route.extend(RouteResult.from_paths(more_paths).evaluate(csr_graph if csr_graph is not None else graph, _cost_model, more_loads))
+    list_paths += more_paths
+    leg_loads += more_loads
+    iteration += more_iterations
+
+# --- Local search over the order of the visits; after edge updates the truck already drove the first legs
+improve_history = None
+if _improve_ms > 0:
+    if _cost_model is not None and _cost_model.depends_on_load:
+        raise Exception("--improve-ms needs a cost model which does not depend on the load.")
+    n_fixed = len(list_paths) - len(more_paths) if _edge_updates else 0
+    improve_start = list_paths[n_fixed - 1][-1] if n_fixed else _truck_start_node
+    improve_load = leg_loads[n_fixed] if n_fixed < len(leg_loads) else state.truck_load
+    visits, moved = visits_from_paths(list_paths[n_fixed:], leg_loads[n_fixed:], state.truck_load)
+    timers.tic()
+    visited_ids = list(dict.fromkeys([improve_start] + visits))
+    if stop_table is not None and sum(node_id not in stop_table.stop_index for node_id in visited_ids) <= 1:
+        visit_costs = VisitCosts.from_stop_table(stop_table, visited_ids)
     else:
-        raise Exception("Can't reach node!!")
-    
-    # get stores demand list to check if there is still demand
-    _, store_demand_list = get_stores(graph)
-    # get warehouses supply list to check if there is still suplies left
-    _, warehouse_supply_list = get_warehouses(graph)
-
-save_path_algo.write("\n\n------------ Final State of global demand and supply:\n")
-_, store_demand_list = get_stores(graph)
-_, warehouse_supply_list = get_warehouses(graph)
-
-save_path_algo.write("Remainging demand: {}\n".format(sum(store_demand_list)))
-save_path_algo.write("Remainging supplies: {}\n".format(sum(warehouse_supply_list)))
-save_path_algo.write("\n\n------------ Final State of global demand and supply\n")
+        if csr_graph is None:
+            csr_graph = CSRGraph.from_networkx(graph)
+        visit_costs = VisitCosts.search(csr_graph, visited_ids, _cost_model)
+    costs_time = timers.tac()
+    with timers.timer("improve"):
+        visits, moved, improve_history, moves = improve_visits(visit_costs, improve_start, visits, moved, improve_load,
+                                                               _truck_cap_max, _improve_ms / 1000.0)
+    list_paths = list_paths[:n_fixed] + visit_costs.paths(improve_start, visits)
+    leg_loads = leg_loads[:n_fixed] + list(accumulate([improve_load] + moved[:-1]))
+    route = RouteResult.from_paths(list_paths).evaluate(csr_graph if csr_graph is not None else graph, _cost_model, leg_loads)
+    print("Local search: cost {} -> {} in {:.1f} ms ({} moves: {}), visit costs in {:.1f} ms".format(
+        improve_history[0][1], improve_history[-1][1], 1000 * improve_history[-1][0], len(improve_history) - 1,
+        ", ".join("{} {}".format(move, count) for move, count in moves.items()), 1000 * costs_time))
+    # about ten points of the cost over time, the last one included
+    points = improve_history[::max(1, len(improve_history) // 10)]
+    if points[-1] is not improve_history[-1]:
+        points.append(improve_history[-1])
+    print("Cost over time: " + ", ".join("{:.1f} ms: {:.2f}".format(1000 * elapsed, cost) for elapsed, cost in points))
+    if tracer.enabled(SUMMARY):
+        tracer.emit(SUMMARY, "improve", budget_ms=_improve_ms, visit_costs_time=costs_time, moves=moves,
+                    history=[[elapsed, cost] for elapsed, cost in improve_history])
+
+# --- Exact mode: the least cost route from the same start, the greedy route cost being the first upper bound
+exact = None
+if _exact:
+    if _edge_updates or _improve_ms > 0:
+        raise Exception("--name exact does not take --edge-updates nor --improve-ms.")
+    if _cost_model is not None and _cost_model.depends_on_load:
+        raise Exception("--name exact needs a cost model which does not depend on the load.")
+    exact_state = DeliveryState.from_graph(graph, truck_node=_truck_start_node, truck_load=_truck_initial_load, truck_cap_max=_truck_cap_max)
+    visited_ids = list(dict.fromkeys([_truck_start_node] + exact_state.warehouses_ids_list + exact_state.stores_ids_list))
+    if stop_table is not None:
+        visit_costs = VisitCosts.from_stop_table(stop_table, visited_ids)
+    else:
+        if csr_graph is None:
+            csr_graph = CSRGraph.from_networkx(graph)
+        visit_costs = VisitCosts.search(csr_graph, visited_ids, _cost_model)
+    greedy_cost = visit_costs.cost(_truck_start_node, visits_from_paths(list_paths, leg_loads, state.truck_load)[0])
+    with timers.timer("exact"):
+        exact = solve_exact(visit_costs, exact_state, upper_bound=greedy_cost, table_size=args.exact_table_size,
+                            time_limit_s=args.exact_time_limit)
+    exact_cost = exact["cost"] if exact["cost"] is not None else greedy_cost
+    if exact["visits"] is not None:
+        # replay the exact route on the state, which also checks every loaded/unloaded amount
+        leg_loads = []
+        for node_id, moved in exact["visits"]:
+            leg_loads.append(exact_state.truck_load)
+            done = exact_state.load_at(node_id) if node_id in exact_state.warehouse_rank else -exact_state.unload_at(node_id)
+            if done != moved:
+                raise Exception("The exact route moves {} goods at node {}, not {}".format(done, node_id, moved))
+        state = exact_state
+        list_paths = visit_costs.paths(_truck_start_node, [node_id for node_id, _ in exact["visits"]])
+        iteration = len(list_paths)
+        route = RouteResult.from_paths(list_paths).evaluate(csr_graph if csr_graph is not None else graph, _cost_model, leg_loads)
+    exact["greedy_cost"] = greedy_cost
+    exact["gap"] = (greedy_cost - exact_cost) / exact_cost if exact_cost > 0 else 0.0
+    print("Exact search: {} cost {} (greedy {}, gap {:.2%}), {} states expanded in {:.2f} s ({:.0f} states/s), "
+          "{} cut, {} skipped by the transposition table, {} evicted".format(
+              "optimal" if exact["optimal"] else "best found (time limit, not proven optimal)", exact_cost, greedy_cost,
+              exact["gap"], exact["expanded"], exact["time"], exact["expanded"] / max(exact["time"], 1e-9),
+              exact["cut"], exact["skipped"], exact["evicted"]))
+    if tracer.enabled(SUMMARY):
+        tracer.emit(SUMMARY, "exact", **{key: value for key, value in exact.items() if key != "visits"})
+
+# remaining supplies and demands on the graph nodes, as saved in the .dot file
+state.write_to(graph)
 
 exp_total_time = timers.tac()
-save_path_algo.write("\nTotal time of the experiment:{}\n\n".format(exp_total_time))
-save_path_algo.write("\nTruck started at node ({}) with initial load of ({}), and capacity of ({})\n".format(_truck_start_node,_truck_initial_load, _truck_cap_max))
-save_path_algo.write("\nThe algorithm used a threshold factor of ({})\n".format(_load_threshold_factor))
-
-save_path_algo.write("\nThe imported graph file name is '{}'\n".format(_input_dot_graph))
 
+over_cost = route.cost
 
-print("Computing the truck's path overall cost...")
-over_cost = 0
-for path in list_paths:
-    for i in range(0,len(path)-1):
-        # print("edge: {}, {}".format(path[i], path[i+1]))
-        # print("cost: ", graph[path[i]][path[i+1]]['cost'])
-        over_cost += graph[path[i]][path[i+1]]['cost']
-
-save_path_algo.write("\nThe overall cost of the truck's path is: {}".format(over_cost))
-save_path_algo.write("\nThe list of paths is: \n")
-for path in list_paths:
-    save_path_algo.write(str(path) + "\n")
-
+tracer.emit(SUMMARY, "end", iterations=iteration, remaining_demand=state.total_demand, remaining_supply=state.total_supply,
+            truck_load=state.truck_load, overall_cost=over_cost, time=exp_total_time,
+            astar=router.counters if router is not None else None)
 # Closing file to log the algorithm
-save_path_algo.close()
+tracer.close()
 
 
 # --- Result path >>>>>>>>>>>>>>>
 print("\n\nTruck path: \n{}\n\n".format(list_paths))
 print("Experiment time: {} s".format(exp_total_time))
-
-# --- Save path to .txt file
-save_folder = "{:%Y_%m_%d__%H_%M}_{}.txt".format(datetime.datetime.now(), _exp_name)
-save_path_found = open(save_folder,"w+")
-print("Path saved to text file: ", save_folder)
-
-save_path_found.write("Truck started node: {}\nTruck initial load: {}\nTruck max capacity: {}\n".format(_truck_start_node,_truck_initial_load, _truck_cap_max))
-save_path_found.write("\nThe algorithm used a threshold factor of ({})\n".format(_load_threshold_factor))
-
-save_path_found.write("Truck path overall cost: " + str(over_cost) + "\n")
-for path in list_paths:
-    save_path_found.write(str(path) + "\n")
-save_path_found.close()
-
-# --- Save .dot file with truck path
-node_counter = 0
-graph_to_save = copy.copy(graph)
-for path in list_paths:
-    for node_id in path:
-        graph_to_save.nodes[node_id]["label"] += "{}, ".format(node_counter)
-        node_counter+=1
-
-nx.drawing.nx_pydot.write_dot(graph_to_save, "{}.dot".format(save_folder.replace(".txt","")))
-print("Generated graph .dot file with the sequence of nodes the truck should go: \n {}".format(save_folder))
\ No newline at end of file
+if router is not None and router.bound is not None:
+    print("A* ({}): {} searches, {} settled nodes, {} candidates pruned".format(
+        _heuristic, router.counters["searches"], router.counters["settled"], router.counters["pruned"]))
+if _contraction:
+    print("Contraction hierarchy: {} searches, {} settled nodes".format(router.counters["searches"], router.counters["settled"]))
+
+with timers.timer("export"):
+    # --- Save path to .txt file
+    save_folder = "{:%Y_%m_%d__%H_%M}_{}.txt".format(datetime.datetime.now(), _exp_name)
+    save_path_found = open(save_folder,"w+")
+    print("Path saved to text file: ", save_folder)
+
+    save_path_found.write("Truck started node: {}\nTruck initial load: {}\nTruck max capacity: {}\n".format(_truck_start_node,_truck_initial_load, _truck_cap_max))
+    save_path_found.write("\nThe algorithm used a threshold factor of ({})\n".format(_load_threshold_factor))
+
+    route.write_text(save_path_found)
+    save_path_found.close()
+
+    # --- Save .json file with the route and its totals
+    if _export_json:
+        route.write_json(save_folder.replace(".txt", ".json"), truck_start_node=_truck_start_node, truck_initial_load=_truck_initial_load,
+                         truck_cap_max=_truck_cap_max, load_threshold_factor=_load_threshold_factor, improve_history=improve_history)
+        print("Route saved to .json file: {}".format(save_folder.replace(".txt", ".json")))
+
+    # --- Save .dot file with truck path, each node label ends with its positions in the visit sequence
+    route.write_dot(graph, "{}.dot".format(save_folder.replace(".txt","")))
+    print("Generated graph .dot file with the sequence of nodes the truck should go: \n {}".format(save_folder))
+
+# --- Metrics of the run: named timers and counters, as one JSON line and a .json file next to the .txt result
+if router is not None:
+    timers.count("router_searches", router.counters["searches"])
+    if "pruned" in router.counters:
+        timers.count("candidates_pruned", router.counters["pruned"])
+if csr_graph is not None:
+    timers.count("cost_cache_hits", csr_graph.cost_cache_counters["hits"])
+    timers.count("cost_cache_misses", csr_graph.cost_cache_counters["misses"])
+metrics_path = save_folder.replace(".txt", "_metrics.json")
+timers.write_json(metrics_path, name=_exp_name, graph=_input_dot_graph, iterations=iteration, overall_cost=over_cost,
+                  experiment_time=exp_total_time)
+print("Metrics: {}".format(json.dumps(timers.summary())))
+print("Metrics saved to .json file: {}".format(metrics_path))
+
+# --- cProfile stats of the whole run
+if profiler is not None:
+    profiler.disable()
+    profiler.dump_stats(args.profile)
+    print("Profile saved to: {}".format(args.profile))
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(args.profile_top)
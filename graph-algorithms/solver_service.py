@@ -0,0 +1,460 @@
+"""
+Description
+-----------
+
+Resident solver service for the greedy `goto_warehouse_or_store` algorithm, instead of one new process per route.
+
+1. The server (asyncio, HTTP/1.1 on --port, or on a Unix socket with --unix-socket) keeps the imported graphs and
+their stop tables (see stop_table.py) in an LRU cache of --max-graphs entries, keyed by the hash of the graph file
+content and the cost model. A request never imports a graph again, and an edited .txt is imported again.
+
+2. POST /route takes a JSON route request:
+
+    {"graph": "graph2", "truck_start_node": 0, "truck_initial_load": 0, "truck_cap_max": 10, "load_threshold_factor": 0.5}
+
+with the defaults of run_truck_path_search.py for all but "graph" (a .txt of --graph-dir), and an optional
+"cost_model" (see cost_models.py). The answer is the route legs, their cost, distance and time totals and the
+remaining demand and supply. Nothing is written to disk.
+
+3. The requests against the same graph which arrive within --batch-ms are solved together by
+`greedy_search.goto_warehouse_or_store_batch`: every iteration takes the next decision of all their trucks at once.
+The batches are solved one at a time on a solver thread, and the graph files hashed and imported on worker threads,
+so the event loop keeps serving connections meanwhile.
+
+4. GET /stats returns the requests served, batches, graph cache hits/misses and the p50/p99 latency of the last
+requests.
+
+5. --bench N starts the server in process on a Unix socket, sends it N random route requests from
+--bench-concurrency clients and prints their p50/p99 latency, next to the wall time of a cold
+run_truck_path_search.py process on the same graph.
+
+
+# Example to run:
+
+>>> python solver_service.py --port 8820
+>>> curl -s -X POST localhost:8820/route -d '{"graph": "graph2", "truck_start_node": 0, "truck_cap_max": 10}'
+>>> python solver_service.py --bench 2000 --bench-concurrency 32 --bench-graph graph2
+
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import networkx as nx
+import numpy as np
+
+from cost_models import cost_model_from_spec
+from csr_graph import CSRGraph
+from delivery_state import DeliveryState
+from graph import get_stores, get_warehouses, import_graph_from
+from greedy_search import goto_warehouse_or_store_batch
+from route_result import RouteResult
+from stop_table import StopTable
+from utilities import file_content_hash
+
+# number of the last route latencies the /stats percentiles are computed over
+LATENCY_WINDOW = 10000
+# paths kept by every graph entry, between the stops and from the start nodes; the memo is cleared past it
+MAX_CACHED_PATHS = 1 << 18
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+class RequestError(Exception):
+    """A route request the service cannot solve, answered with `status`."""
+
+    def __init__(self, message, status=400):
+        """Constructor."""
+        super().__init__(message)
+        self.status = status
+
+
+class GraphEntry:
+    """An imported graph with what every route on it needs: its stop table, CSR arrays and warehouses/stores."""
+
+    def __init__(self, graph, stop_table, csr, cost_model):
+        """Constructor."""
+        self.graph = graph
+        self.stop_table = stop_table
+        self.csr = csr
+        self.cost_model = cost_model
+        self.warehouses = get_warehouses(graph)
+        self.stores = get_stores(graph)
+        self.paths = {}
+
+    @classmethod
+    def load(cls, graph_path, cost_model=None):
+        graph = nx.Graph()
+        import_graph_from(graph=graph, path=graph_path)
+        stop_table = StopTable.from_graph_file(graph, graph_path, cost_model)
+        return cls(graph, stop_table, CSRGraph.from_networkx(graph), cost_model)
+
+    def new_state(self, truck_node, truck_load, truck_cap_max):
+        """A `delivery_state.DeliveryState` with the supplies and demands of the graph file."""
+        if truck_node not in self.stop_table.node_index:
+            raise RequestError("Unknown truck start node {}".format(truck_node))
+        return DeliveryState(self.warehouses[0], self.warehouses[1], self.stores[0], self.stores[1],
+                             truck_node, truck_load, truck_cap_max)
+
+
+class GraphCache:
+    """`GraphEntry`s keyed by (graph file content hash, cost model spec), the least recently used evicted first.
+
+    The file hashes are remembered with the file modification time and size, so a request only
+    hashes a graph file again once it changed. Graph files are hashed and imported off the event
+    loop, and concurrent requests for a graph being imported wait for the same import.
+    """
+
+    def __init__(self, graph_dir, max_graphs=4):
+        """Constructor."""
+        self.graph_dir = graph_dir
+        self.max_graphs = max_graphs
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._hashes = {}
+
+    def path_for(self, graph_name):
+        if not isinstance(graph_name, str) or not graph_name or os.path.basename(graph_name) != graph_name:
+            raise RequestError("The graph must be the name of a .txt file of the graph directory, not {!r}".format(graph_name))
+        return os.path.join(self.graph_dir, "{}.txt".format(graph_name))
+
+    async def content_hash(self, graph_path):
+        try:
+            stat = os.stat(graph_path)
+        except FileNotFoundError:
+            raise RequestError("No graph file {}".format(os.path.basename(graph_path)), status=404)
+        known = self._hashes.get(graph_path)
+        if known is None or known[:2] != (stat.st_mtime_ns, stat.st_size):
+            content_hash = await asyncio.get_running_loop().run_in_executor(None, file_content_hash, graph_path)
+            known = (stat.st_mtime_ns, stat.st_size, content_hash)
+            self._hashes[graph_path] = known
+        return known[2]
+
+    async def get(self, graph_name, cost_model=None):
+        """(key, `GraphEntry`) of a graph, imported on a miss."""
+        graph_path = self.path_for(graph_name)
+        key = (await self.content_hash(graph_path), cost_model.spec if cost_model is not None else None)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        else:
+            self.misses += 1
+            self.entries[key] = asyncio.get_running_loop().run_in_executor(None, GraphEntry.load, graph_path, cost_model)
+            while len(self.entries) > self.max_graphs:
+                self.entries.popitem(last=False)
+        future = self.entries[key]
+        try:
+            return key, await future
+        except Exception:
+            if self.entries.get(key) is future:
+                del self.entries[key]
+            raise
+
+
+def parse_route_request(request):
+    """Route parameters of a JSON request, with the defaults of run_truck_path_search.py."""
+    if not isinstance(request, dict) or "graph" not in request:
+        raise RequestError("A route request is a JSON object with at least a \"graph\".")
+    try:
+        params = {"graph": request["graph"],
+                  "truck_start_node": int(request.get("truck_start_node", 0)),
+                  "truck_initial_load": int(request.get("truck_initial_load", 0)),
+                  "truck_cap_max": int(request.get("truck_cap_max", 1)),
+                  "load_threshold_factor": float(request.get("load_threshold_factor", 0.5))}
+    except (TypeError, ValueError) as error:
+        raise RequestError("Bad route parameter: {}".format(error))
+    cost_model = None
+    if request.get("cost_model"):
+        try:
+            cost_model = cost_model_from_spec(str(request["cost_model"]))
+        except Exception as error:
+            raise RequestError(str(error))
+        if cost_model.depends_on_load:
+            raise RequestError("The service needs a cost model which does not depend on the load, not {}".format(cost_model.spec))
+    return params, cost_model
+
+
+class RouteBatcher:
+    """Collects the route requests against the same graph for `batch_s` seconds, then solves them in one batch.
+
+    The batches are solved off the event loop, one at a time on a solver thread, so that the
+    graph entries they share are never updated by two batches at once; the thread hands every
+    answer back to the loop with `call_soon_threadsafe`. While the thread is busy, the batches
+    whose wait is over keep collecting requests and are solved in turn once it is free.
+    """
+
+    def __init__(self, cache, batch_s):
+        """Constructor."""
+        self.cache = cache
+        self.batch_s = batch_s
+        self.pending = {}
+        self.n_batches = 0
+        self.n_batched = 0
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # the batch being solved, and the batches ready to be solved after it, by key
+        self.solving = None
+        self.ready = OrderedDict()
+
+    async def route(self, params, cost_model):
+        key, entry = await self.cache.get(params["graph"], cost_model)
+        state = entry.new_state(params["truck_start_node"], params["truck_initial_load"], params["truck_cap_max"])
+        future = asyncio.get_running_loop().create_future()
+        if key not in self.pending:
+            self.pending[key] = []
+            asyncio.get_running_loop().call_later(self.batch_s, self._dispatch, key, entry)
+        self.pending[key].append((params, state, future))
+        return await future
+
+    def _dispatch(self, key, entry):
+        if self.solving is not None:
+            self.ready[key] = entry
+            return
+        batch = self.pending.pop(key)
+        self.n_batches += 1
+        self.n_batched += len(batch)
+        loop = asyncio.get_running_loop()
+        self.solving = loop.run_in_executor(self.executor, self._solve, loop, batch, entry)
+        self.solving.add_done_callback(self._solved)
+
+    def _solved(self, _):
+        self.solving = None
+        if self.ready:
+            self._dispatch(*self.ready.popitem(last=False))
+
+    def _solve(self, loop, batch, entry):
+        # on the solver thread: the futures belong to the loop, which alone sets their results
+        if len(entry.paths) > MAX_CACHED_PATHS:
+            entry.paths.clear()
+        try:
+            results = goto_warehouse_or_store_batch(entry.stop_table, [state for _, state, _ in batch],
+                                                    [params["load_threshold_factor"] * params["truck_cap_max"] for params, _, _ in batch],
+                                                    entry.paths)
+        except Exception as error:
+            for _, _, future in batch:
+                loop.call_soon_threadsafe(_resolve, future, None, error)
+            return
+        # a route which raised, in the search or in its answer, fails alone
+        for (params, state, future), (list_paths, iteration, leg_loads, error) in zip(batch, results):
+            try:
+                if isinstance(error, Exception):
+                    raise error
+                route = RouteResult.from_paths(list_paths).evaluate(entry.csr, entry.cost_model, leg_loads)
+                answer = dict(params, cost=route.cost, distance=route.distance, time=route.time, iterations=iteration,
+                              remaining_demand=state.total_demand, remaining_supply=state.total_supply,
+                              truck_load=state.truck_load, error=error, batch_size=len(batch),
+                              n_legs=route.n_legs, legs=route.to_paths())
+            except Exception as route_error:
+                loop.call_soon_threadsafe(_resolve, future, None, route_error)
+                continue
+            loop.call_soon_threadsafe(_resolve, future, answer, None)
+
+
+def _resolve(future, answer, error):
+    # a client which went away leaves its future cancelled
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(answer)
+
+
+class SolverService:
+    """The HTTP/1.1 front of a `RouteBatcher`, with keep-alive connections and latency statistics."""
+
+    def __init__(self, graph_dir, max_graphs=4, batch_s=0.001):
+        """Constructor."""
+        self.cache = GraphCache(graph_dir, max_graphs)
+        self.batcher = RouteBatcher(self.cache, batch_s)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.n_requests = 0
+        self.n_errors = 0
+
+    def stats(self):
+        latencies = np.array(self.latencies, dtype=np.float64) * 1e3
+        return {"requests": self.n_requests, "errors": self.n_errors,
+                "batches": self.batcher.n_batches, "mean_batch_size": self.batcher.n_batched / max(self.batcher.n_batches, 1),
+                "graphs_cached": len(self.cache.entries), "cache_hits": self.cache.hits, "cache_misses": self.cache.misses,
+                "latency_ms_p50": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                "latency_ms_p99": float(np.percentile(latencies, 99)) if len(latencies) else None}
+
+    async def dispatch(self, method, target, body):
+        """(status, JSON answer) of one request."""
+        if target == "/stats":
+            return 200, self.stats()
+        if target != "/route":
+            return 404, {"error": "Unknown path {}, expected /route or /stats".format(target)}
+        if method != "POST":
+            return 405, {"error": "POST a JSON route request to /route"}
+
+        start = time.perf_counter()
+        self.n_requests += 1
+        try:
+            try:
+                request = json.loads(body or b"null")
+            except ValueError as error:
+                raise RequestError("The body is not JSON: {}".format(error))
+            answer = await self.batcher.route(*parse_route_request(request))
+            status = 200
+        except RequestError as error:
+            status, answer = error.status, {"error": str(error)}
+        except Exception as error:
+            status, answer = 500, {"error": str(error)}
+        if status != 200:
+            self.n_errors += 1
+        self.latencies.append(time.perf_counter() - start)
+        return status, answer
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, answer = await self.dispatch(method, target.split("?")[0], body)
+                payload = json.dumps(answer).encode()
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n".format(
+                    status, _REASONS[status], len(payload), "keep-alive" if keep_alive else "close").encode("latin-1") + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=8820, unix_socket=None):
+        if unix_socket:
+            return await asyncio.start_unix_server(self.handle_connection, path=unix_socket)
+        return await asyncio.start_server(self.handle_connection, host=host, port=port)
+
+
+# --- Load test
+
+async def _post(reader, writer, request):
+    body = json.dumps(request).encode()
+    writer.write("POST /route HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n".format(
+        len(body)).encode("latin-1") + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return status, json.loads(await reader.readexactly(int(headers["content-length"])))
+
+
+async def run_bench(graph_dir, graph_name, n_requests, concurrency, batch_s, seed=0):
+    """Latencies (s) and answers of `n_requests` random route requests sent by `concurrency` keep-alive clients."""
+    graph = nx.Graph()
+    import_graph_from(graph=graph, path=os.path.join(graph_dir, "{}.txt".format(graph_name)))
+    nodes = list(graph.nodes())
+    rnd = random.Random(seed)
+    requests = [{"graph": graph_name, "truck_start_node": rnd.choice(nodes), "truck_cap_max": rnd.choice([5, 10, 25]),
+                 "load_threshold_factor": rnd.choice([0.2, 0.5, 0.7])} for _ in range(n_requests)]
+
+    service = SolverService(graph_dir, batch_s=batch_s)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        unix_socket = os.path.join(tmp_dir, "solver.sock")
+        server = await service.start(unix_socket=unix_socket)
+        # the first request imports the graph: a cache miss, not counted in the latencies
+        reader, writer = await asyncio.open_unix_connection(unix_socket)
+        await _post(reader, writer, requests[0])
+        writer.close()
+
+        latencies = []
+        statuses = []
+
+        async def client(chunk):
+            reader, writer = await asyncio.open_unix_connection(unix_socket)
+            for request in chunk:
+                start = time.perf_counter()
+                status, _ = await _post(reader, writer, request)
+                latencies.append(time.perf_counter() - start)
+                statuses.append(status)
+            writer.close()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(requests[k::concurrency]) for k in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        server.close()
+        await server.wait_closed()
+    return np.array(latencies), statuses, elapsed, service.stats()
+
+
+def cold_start_time(graph_dir, graph_name):
+    """Wall time of one run_truck_path_search.py process (with its cached --stop-table), run in a scratch directory."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_truck_path_search.py")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # the script reads ../graph-generator/<graph>.txt and writes its results in the working directory
+        os.symlink(os.path.abspath(graph_dir), os.path.join(tmp_dir, "graph-generator"))
+        os.mkdir(os.path.join(tmp_dir, "run"))
+        start = time.perf_counter()
+        subprocess.run([sys.executable, script, "--name", "cold", "--input_dot_graph", graph_name, "--truck_cap_max", "10",
+                        "--truck-start-node", "0", "--stop-table"], cwd=os.path.join(tmp_dir, "run"),
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default="127.0.0.1",
+                        help="Address the HTTP server listens on.")
+    parser.add_argument('--port', type=int, default=8820,
+                        help="Port the HTTP server listens on.")
+    parser.add_argument('--unix-socket', type=str,
+                        help="Listen on this Unix socket instead of --host/--port.")
+    parser.add_argument('--graph-dir', type=str, default="../graph-generator",
+                        help="Directory of the .txt graphs the requests name.")
+    parser.add_argument('--max-graphs', type=int, default=4,
+                        help="Number of imported graphs (per cost model) kept in memory.")
+    parser.add_argument('--batch-ms', type=float, default=1.0,
+                        help="How long the first request against a graph waits for others to be solved in the same batch.")
+    parser.add_argument('--bench', type=int, default=0,
+                        help="Instead of serving, send this many random route requests to an in process server and print their latency.")
+    parser.add_argument('--bench-concurrency', type=int, default=32,
+                        help="Number of concurrent clients of --bench.")
+    parser.add_argument('--bench-graph', type=str, default="graph2",
+                        help="Graph of the --bench requests.")
+    args = parser.parse_args()
+
+    if args.bench > 0:
+        latencies, statuses, elapsed, stats = asyncio.run(run_bench(args.graph_dir, args.bench_graph, args.bench,
+                                                                    args.bench_concurrency, args.batch_ms / 1e3))
+        cold = cold_start_time(args.graph_dir, args.bench_graph)
+        print("{} requests ({} failed) in {:.2f} s: {:.0f} requests/s, mean batch size {:.1f}".format(
+            len(latencies), sum(status != 200 for status in statuses), elapsed, len(latencies) / elapsed, stats["mean_batch_size"]))
+        print("Latency p50 {:.2f} ms, p99 {:.2f} ms; a cold run_truck_path_search.py process takes {:.0f} ms".format(
+            np.percentile(latencies, 50) * 1e3, np.percentile(latencies, 99) * 1e3, cold * 1e3))
+    else:
+        async def serve():
+            service = SolverService(args.graph_dir, args.max_graphs, args.batch_ms / 1e3)
+            server = await service.start(args.host, args.port, args.unix_socket)
+            print("Serving on {}".format(args.unix_socket or "http://{}:{}".format(args.host, args.port)))
+            async with server:
+                await server.serve_forever()
+        asyncio.run(serve())
@@ -0,0 +1,374 @@
+import heapq
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+from csr_graph import CSRGraph
+from graph import get_stores, get_warehouses
+from parallel_search import multi_source_dijkstra
+from routing import INF
+from utilities import file_content_hash
+
+STOP_TABLE_VERSION = 3
+
+
+class StopTable:
+    """All-pairs path costs between the warehouses and stores (the stops) of a graph.
+
+    The stops are remapped to dense ids 0..K-1: first the warehouses, then the stores,
+    both in the order of `get_warehouses`/`get_stores`. `dist[k, j]` is the least path
+    cost from stop k to stop j, and `pred[k]` is the shortest path tree rooted at stop k
+    (predecessor dense node index for every graph node, -1 at the root), from which any
+    stop-to-stop path is rebuilt. `node_dist[k]` is the cost from stop k to every node, which
+    `repair` uses to find the rows an edge update changes and which serves the sources off the
+    table. It is as big as `pred` in float64, so it is not cached: a table read from its cache
+    derives it from `pred` and the graph the first time it is needed (see `node_dist`). The costs
+    are those of `cost_model` (see `cost_models`, the imported cost by default), which cannot
+    depend on the truck load.
+    """
+
+    def __init__(self, stop_ids, n_warehouses, node_ids, dist, pred, node_dist=None, cost_model=None):
+        """Constructor."""
+        self.stop_ids = np.asarray(stop_ids, dtype=np.int64)
+        self.n_warehouses = int(n_warehouses)
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+        self._dist = dist
+        self._pred = pred
+        self._node_dist = node_dist
+        self.cost_model = cost_model
+        # rows changed by `repair` and not searched again yet: row -> first batch of `_changes` it misses
+        self._stale = {}
+        self._changes = []
+        self._csr = None
+        # set by `from_graph_file` when the table was read from its cache file
+        self.from_cache = False
+        # networkx graph `node_dist` is derived from, set by `from_graph_file`
+        self._graph = None
+
+        self.stop_index = {int(node_id): k for k, node_id in enumerate(self.stop_ids.tolist())}
+        self.node_index = {int(node_id): ii for ii, node_id in enumerate(self.node_ids.tolist())}
+        self._stops_dense = np.array([self.node_index[stop_id] for stop_id in self.stop_ids.tolist()], dtype=np.int64)
+
+    @property
+    def n_stops(self):
+        return len(self.stop_ids)
+
+    @property
+    def dist(self):
+        self._refresh(list(self._stale))
+        return self._dist
+
+    @property
+    def pred(self):
+        self._refresh(list(self._stale))
+        return self._pred
+
+    @property
+    def node_dist(self):
+        """Cost from every stop to every node, derived from the shortest path trees on first use when the table was not searched here."""
+        self._refresh(list(self._stale))
+        if self._node_dist is None:
+            if self._graph is None:
+                raise Exception("The stop table has no node costs and no graph to derive them from.")
+            csr = CSRGraph.from_networkx(self._graph, weight="cost")
+            if not np.array_equal(csr.node_ids, self.node_ids):
+                raise Exception("The graph nodes differ from the stop table ones.")
+            self._node_dist = self._tree_costs(csr, csr.edge_costs(self.cost_model))
+        return self._node_dist
+
+    def _tree_costs(self, csr, entry_cost):
+        # node_dist from pred: one vectorized step per tree level, every node adding the cost of
+        # its tree edge to the cost of its predecessor, the same sums in the same order as the
+        # search, so the costs are exactly the searched ones
+        node_dist = np.full(self._pred.shape, INF)
+        for k, pred_k in enumerate(self._pred):
+            pred_k = np.asarray(pred_k, dtype=np.int64)
+            node_dist[k, self._stops_dense[k]] = 0.0
+            child = np.flatnonzero(pred_k >= 0)
+            if len(child) == 0:
+                continue
+            edge_cost = entry_cost[csr.edge_entries(pred_k[child], child)]
+            depth = _tree_depths(pred_k)[child]
+            order = np.argsort(depth, kind="stable")
+            ends = np.cumsum(np.bincount(depth[order]))
+            for lo, hi in zip(ends[:-1].tolist(), ends[1:].tolist()):
+                level = order[lo:hi]
+                node_dist[k, child[level]] = node_dist[k, pred_k[child[level]]] + edge_cost[level]
+        return node_dist
+
+    @classmethod
+    def build(cls, graph, cost_model=None, workers=1):
+        """Run one single-source Dijkstra from every warehouse and store of a networkx graph, on `workers` processes.
+
+        The rows are searched by `parallel_search.multi_source_dijkstra`, which shares the graph
+        and the result matrices between the processes instead of pickling them.
+        """
+        if cost_model is not None and cost_model.depends_on_load:
+            raise Exception("The stop table needs a cost model which does not depend on the load, not {}".format(cost_model.spec))
+        warehouses_ids_list, _ = get_warehouses(graph)
+        stores_ids_list, _ = get_stores(graph)
+        stop_ids = warehouses_ids_list + stores_ids_list
+
+        csr = CSRGraph.from_networkx(graph, weight="cost")
+        node_dist, pred = multi_source_dijkstra(csr, stop_ids, cost_model, workers)
+        stops_dense = [csr.node_index[stop_id] for stop_id in stop_ids]
+        return cls(stop_ids, len(warehouses_ids_list), csr.node_ids, node_dist[:, stops_dense], pred, node_dist, cost_model)
+
+    def repair(self, csr, src, dst, old_cost, new_cost):
+        """Mark the rows which the cost change of the edges src[k]--dst[k] (dense indices of `csr`) can alter.
+
+        A row changes when a dearer edge is in its shortest path tree, or when a cheaper edge
+        shortens the path to one of its ends. Finding them is a few vectorized column reads;
+        the rows themselves are repaired on their first lookup (`nearest`, `path`, `costs_from`
+        or a read of `dist`, `pred` or `node_dist`), so a burst of updates costs one repair per
+        row which is read, whatever the number of batches. `csr` must already hold the new costs,
+        keep them until the rows are read and have the node order of the table, and the costs are
+        those of the table cost model. Returns the number of rows marked.
+        """
+        if not np.array_equal(csr.node_ids, self.node_ids):
+            raise Exception("The graph nodes differ from the stop table ones.")
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        old_cost = np.asarray(old_cost, dtype=np.float64)
+        new_cost = np.asarray(new_cost, dtype=np.float64)
+        if self._node_dist is None:
+            # the costs before this change, which `csr` no longer holds
+            entry_cost = csr.edge_costs(self.cost_model).copy()
+            entry_cost[csr.edge_entries(src, dst)] = old_cost
+            entry_cost[csr.edge_entries(dst, src)] = old_cost
+            self._node_dist = self._tree_costs(csr, entry_cost)
+        # a stale row already repairs every later change on its lookup
+        rows = np.array([k for k in range(self.n_stops) if k not in self._stale], dtype=np.int64)
+        dist_src = self._node_dist[rows[:, None], src]
+        dist_dst = self._node_dist[rows[:, None], dst]
+        in_tree = (self._pred[rows[:, None], dst] == src) | (self._pred[rows[:, None], src] == dst)
+        shorter = (dist_src + new_cost < dist_dst) | (dist_dst + new_cost < dist_src)
+        affected = ((in_tree & (new_cost > old_cost)) | (shorter & (new_cost < old_cost))).any(axis=1)
+
+        self._csr = csr
+        for k in rows[affected].tolist():
+            self._stale[k] = len(self._changes)
+        self._changes.append((src, dst, old_cost, new_cost))
+        return int(affected.sum())
+
+    def _refresh(self, rows):
+        """Repair the stale rows among `rows` (see `repair`)."""
+        rows = [k for k in rows if k in self._stale]
+        if not rows:
+            return
+        indptr, indices, cost = self._csr.adjacency_lists(self.cost_model)
+        for k in rows:
+            # every change since the row went stale, with the cost the row was searched with
+            # and the current one
+            edges = {}
+            for src, dst, old_cost, new_cost in self._changes[self._stale.pop(k):]:
+                for a, b, old, new in zip(src.tolist(), dst.tolist(), old_cost.tolist(), new_cost.tolist()):
+                    key = (min(a, b), max(a, b))
+                    edges[key] = (edges[key][0] if key in edges else old, new)
+            src, dst = np.array(list(edges), dtype=np.int64).reshape(-1, 2).T
+            old_cost, new_cost = np.array(list(edges.values()), dtype=np.float64).reshape(-1, 2).T
+            self._repair_row(k, indptr, indices, cost, src, dst, old_cost, new_cost)
+        if not self._stale:
+            self._changes = []
+
+    def _repair_row(self, k, indptr, indices, cost, src, dst, old_cost, new_cost):
+        # dynamic Dijkstra on the tree of stop k: the subtrees below the dearer tree edges lose
+        # their costs, then a search seeded from their neighbours and from the ends of the
+        # cheaper edges settles only the nodes whose cost or predecessor changes
+        pred_k = self._pred[k]
+        dearer = new_cost > old_cost
+        cut = np.concatenate([dst[dearer & (pred_k[dst] == src)], src[dearer & (pred_k[src] == dst)]])
+        lost = np.flatnonzero(_subtrees(pred_k, cut)) if len(cut) else cut
+        self._node_dist[k, lost] = INF
+        pred_k[lost] = -1
+        dist_k = self._node_dist[k].tolist()
+        pred_k = pred_k.tolist()
+
+        heap = []
+        for x in lost.tolist():
+            for e in range(indptr[x], indptr[x + 1]):
+                dist_x = dist_k[indices[e]] + cost[e]
+                if dist_x < INF:
+                    heap.append((dist_x, x, indices[e]))
+        for a, b, c in zip(src.tolist(), dst.tolist(), new_cost.tolist()):
+            if dist_k[a] + c < dist_k[b]:
+                heap.append((dist_k[a] + c, b, a))
+            if dist_k[b] + c < dist_k[a]:
+                heap.append((dist_k[b] + c, a, b))
+        heapq.heapify(heap)
+
+        while heap:
+            dist_x, x, from_x = heapq.heappop(heap)
+            if dist_x >= dist_k[x]:
+                continue
+            dist_k[x] = dist_x
+            pred_k[x] = from_x
+            for e in range(indptr[x], indptr[x + 1]):
+                y = indices[e]
+                dist_y = dist_x + cost[e]
+                if dist_y < dist_k[y]:
+                    heapq.heappush(heap, (dist_y, y, x))
+        self._node_dist[k] = dist_k
+        self._pred[k] = pred_k
+        self._dist[k] = self._node_dist[k, self._stops_dense]
+
+    @staticmethod
+    def cache_path_for(graph_path, content_hash, cost_model=None):
+        model_tag = "-{}".format(cost_model.tag()) if cost_model is not None else ""
+        return "{}.stops-v{}{}-{}.npz".format(os.path.splitext(graph_path)[0], STOP_TABLE_VERSION, model_tag, content_hash[:16])
+
+    @classmethod
+    def from_graph_file(cls, graph, graph_path, cost_model=None, workers=1, mmap=False):
+        """Load the table cached next to the input .txt (memory-mapped with `mmap`, see `load`), or build and cache it.
+
+        The cache file name carries the hash of the .txt content and the table version, so
+        an edited graph or an older table layout never reuses a stale table; each cost model
+        has its own file. `node_dist` is not cached, a cached table derives it from `graph` when needed.
+        """
+        cache_path = cls.cache_path_for(graph_path, file_content_hash(graph_path), cost_model)
+        if os.path.exists(cache_path):
+            table = cls.load(cache_path, cost_model, mmap)
+            table.from_cache = True
+            table._graph = graph
+            return table
+        table = cls.build(graph, cost_model, workers)
+        table.save(cache_path)
+        return table
+
+    def save(self, path):
+        # write to a temporary name first so concurrent runs never read a partial file
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, version=STOP_TABLE_VERSION, stop_ids=self.stop_ids, n_warehouses=self.n_warehouses,
+                 node_ids=self.node_ids, dist=self.dist, pred=self.pred)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, cost_model=None, mmap=False):
+        """Read a file written by `save`.
+
+        With `mmap` the dist and pred matrices are read-only views on a np.memmap of the file,
+        so every process loading the same file shares one physical copy through the page cache;
+        such a table cannot be repaired.
+        """
+        with np.load(path) as data:
+            if int(data["version"]) != STOP_TABLE_VERSION:
+                raise Exception("Stop table cache {} has an unsupported version".format(path))
+            if mmap:
+                dist, pred = _npz_memmap(path, "dist"), _npz_memmap(path, "pred")
+            else:
+                dist, pred = data["dist"], data["pred"]
+            return cls(data["stop_ids"], data["n_warehouses"], data["node_ids"], dist, pred, cost_model=cost_model)
+
+    def warehouses_slice(self):
+        return slice(0, self.n_warehouses)
+
+    def stores_slice(self):
+        return slice(self.n_warehouses, self.n_stops)
+
+    def path(self, source_id, target_id):
+        """Node ids of the least cost path between two stops."""
+        k = self.stop_index[source_id]
+        self._refresh([k])
+        pred_k = self._pred[k]
+        node = self.node_index[target_id]
+        path = [node]
+        while pred_k[node] != -1:
+            node = pred_k[node]
+            path.append(node)
+        path.reverse()
+        return self.node_ids[path].tolist()
+
+    def costs_from(self, source_ids):
+        """Costs from every source to every stop, one row per source; a source which is not a stop reads its `node_dist` column (the graph is undirected)."""
+        rows = np.empty((len(source_ids), self.n_stops), dtype=np.float64)
+        on_table = np.array([source_id in self.stop_index for source_id in source_ids], dtype=bool)
+        if on_table.any():
+            stops = [self.stop_index[source_id] for source_id, on in zip(source_ids, on_table) if on]
+            self._refresh(stops)
+            rows[on_table] = self._dist[stops]
+        if not on_table.all():
+            rows[~on_table] = self.node_dist[:, [self.node_index[source_id] for source_id, on in zip(source_ids, on_table) if not on]].T
+        return rows
+
+    def path_from(self, source_id, target_id):
+        """Node ids of the least cost path from any node to a stop."""
+        if source_id in self.stop_index:
+            return self.path(source_id, target_id)
+        return self.path(target_id, source_id)[::-1]
+
+    def nearest(self, source_id, candidates, mask):
+        """Cheapest stop within `candidates` (a warehouses/stores slice) whose `mask` entry is True.
+
+        `mask` is aligned with the slice, e.g. the warehouses with supply left. The
+        decision is a single vectorized argmin over the slice row; returns a tuple
+        (stop_id, cost, path), or (None, None, []) if no candidate is reachable.
+        """
+        k = self.stop_index[source_id]
+        self._refresh([k])
+        row = self._dist[k, candidates]
+        masked_row = np.where(mask, row, np.inf)
+        if masked_row.size == 0:
+            return None, None, []
+        best = int(np.argmin(masked_row))
+        if not np.isfinite(masked_row[best]):
+            return None, None, []
+        target_id = int(self.stop_ids[candidates][best])
+        return target_id, float(masked_row[best]), self.path(source_id, target_id)
+
+    def candidate_costs(self, source_id, candidates, mask):
+        """(stop_id, cost) of every candidate whose `mask` entry is True, for tracing."""
+        k = self.stop_index[source_id]
+        self._refresh([k])
+        row = self._dist[k, candidates]
+        return list(zip(self.stop_ids[candidates][mask].tolist(), row[mask].tolist()))
+
+
+def _npz_memmap(path, name):
+    """np.memmap of the array `name` stored (np.savez does not compress) in the .npz file `path`."""
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(name + ".npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise Exception("{} is compressed in {} and cannot be memory-mapped".format(name, path))
+    with open(path, "rb") as npzfile:
+        # the .npy data follows the zip local header: 30 bytes, then the file name and the extra field
+        npzfile.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack("<HH", npzfile.read(4))
+        npzfile.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(npzfile)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(npzfile)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(npzfile)
+        offset = npzfile.tell()
+    if not shape or 0 in shape:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape, order="F" if fortran_order else "C")
+
+
+def _tree_depths(pred):
+    """Number of edges between every node of a shortest path tree (`pred`, -1 at the root) and its root, 0 when unreachable."""
+    # pointer jumping as in `_subtrees`, adding the length of every jump
+    n_nodes = len(pred)
+    up = np.append(np.where(pred >= 0, pred, n_nodes), n_nodes)
+    depth = np.append((pred >= 0).astype(np.int64), 0)
+    while not (up == n_nodes).all():
+        depth = depth + depth[up]
+        up = up[up]
+    return depth[:n_nodes]
+
+
+def _subtrees(pred, roots):
+    """Mask of the nodes of a shortest path tree (`pred`, -1 at the root) lying below any of `roots`, roots included."""
+    # pointer jumping: after step j every node has looked at its 2^(j+1) - 1 first ancestors
+    n_nodes = len(pred)
+    up = np.append(np.where(pred >= 0, pred, n_nodes), n_nodes)
+    below = np.zeros(n_nodes + 1, dtype=bool)
+    below[roots] = True
+    while True:
+        below |= below[up]
+        if (up == n_nodes).all():
+            break
+        up = up[up]
+    return below[:n_nodes]
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of graph-algorithms are imported as flat modules, as the scripts there do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,62 @@
+import random
+
+import networkx as nx
+import numpy as np
+
+from checkpoint import Checkpointer, encode_paths, load_checkpoint
+from delivery_state import DeliveryState
+from greedy_search import goto_warehouse_or_store
+
+
+def _graph():
+    rnd = random.Random(3)
+    graph = nx.connected_watts_strogatz_graph(60, 4, 0.3, seed=3)
+    for node_id in graph:
+        node_type = rnd.choice([0, 0, 1, 2])
+        graph.nodes[node_id].update(type=node_type, supply=rnd.randint(10, 30) if node_type == 2 else 0,
+                                    demand=rnd.randint(1, 9) if node_type == 1 else 0)
+    for node_id1, node_id2 in graph.edges():
+        graph[node_id1][node_id2]["cost"] = rnd.uniform(1, 100)
+    return graph
+
+
+def _search(graph, state, leg_loads, checkpointer, max_iterations=None):
+    list_paths, iteration = goto_warehouse_or_store(graph, state, 3, max_iterations=max_iterations, leg_loads=leg_loads,
+                                                    checkpointer=checkpointer)
+    checkpointer.submit(state, list_paths, leg_loads, iteration)
+    checkpointer.close()
+    return list_paths, iteration
+
+
+def test_encode_paths_in_parts():
+    list_paths = [[5, 3, 9], [9], [9, 2, 7, 1], [1, 4]]
+    lengths, visits_delta, last_visit = encode_paths(list_paths)
+    parts = [encode_paths(list_paths[:1]), encode_paths(list_paths[1:], 9)]
+    assert np.concatenate([part[0] for part in parts]).tolist() == lengths.tolist()
+    assert np.concatenate([part[1] for part in parts]).tolist() == visits_delta.tolist()
+    assert parts[1][2] == last_visit == 4
+
+
+def test_resume_reproduces_the_uninterrupted_route(tmp_path):
+    graph = _graph()
+    full_loads = []
+    full_paths, full_iterations = goto_warehouse_or_store(graph, DeliveryState.from_graph(graph, 0, 0, 10), 3, leg_loads=full_loads)
+    assert full_iterations > 10
+
+    path = str(tmp_path / "route.ckpt.npz")
+    state = DeliveryState.from_graph(graph, 0, 0, 10)
+    checkpointer = Checkpointer(path, {"graph": "test"}, every_iterations=2, every_s=1e9)
+    list_paths, iteration = _search(graph, state, [], checkpointer, max_iterations=7)
+
+    meta, state, resumed_paths, leg_loads, resumed_iteration = load_checkpoint(path)
+    assert meta == {"graph": "test"}
+    assert (resumed_paths, resumed_iteration) == (list_paths, 7)
+    checkpointer = Checkpointer(path, meta, every_iterations=2, every_s=1e9, prefix_paths=resumed_paths, prefix_iterations=resumed_iteration)
+    list_paths, iteration = _search(graph, state, leg_loads, checkpointer)
+    assert resumed_paths + list_paths == full_paths
+    assert resumed_iteration + iteration == full_iterations
+
+    # the last checkpoint, written in parts, holds the whole route
+    _, state, saved_paths, saved_loads, saved_iteration = load_checkpoint(path)
+    assert (saved_paths, saved_loads, saved_iteration) == (full_paths, full_loads, full_iterations)
+    assert state.is_done()
@@ -0,0 +1,64 @@
+import random
+
+import networkx as nx
+import pytest
+
+from contraction import CHRouter, ContractionHierarchy
+from csr_graph import CSRGraph
+from routing import nearest_target_path
+
+
+def _graph(node_types, edges):
+    graph = nx.Graph()
+    for node_id, node_type in node_types.items():
+        graph.add_node(node_id, type=node_type, supply=5 if node_type == 2 else 0, demand=5 if node_type == 1 else 0)
+    for node_id1, node_id2, cost in edges:
+        graph.add_edge(node_id1, node_id2, cost=cost, distance=cost, time=0.0)
+    return graph
+
+
+def _path_cost(graph, path):
+    return sum(graph[node_id1][node_id2]["cost"] for node_id1, node_id2 in zip(path[:-1], path[1:]))
+
+
+def _check_against_dijkstra(graph, sources, targets):
+    router = CHRouter(ContractionHierarchy.build(CSRGraph.from_networkx(graph)))
+    for source in sources:
+        target_id, cost, path = router.nearest(source, targets)
+        expected_id, expected_cost, _ = nearest_target_path(graph, source, targets)
+        assert target_id == expected_id
+        if expected_id is None:
+            assert path == []
+            continue
+        assert cost == pytest.approx(expected_cost)
+        assert path[0] == source and path[-1] == target_id
+        assert _path_cost(graph, path) == pytest.approx(expected_cost)
+
+
+def test_loop_chain_on_one_core_node():
+    # warehouse 0 with the junction loop 0-1-2-0, and the chain 0-4-3 to store 3
+    graph = _graph({0: 2, 1: 0, 2: 0, 3: 1, 4: 0}, [(0, 1, 1.0), (1, 2, 1.0), (2, 0, 1.0), (0, 4, 1.0), (4, 3, 1.0)])
+    router = CHRouter(ContractionHierarchy.build(CSRGraph.from_networkx(graph)))
+    assert router.nearest(1, {3: 0}) == (3, 3.0, [1, 0, 4, 3])
+    _check_against_dijkstra(graph, list(graph.nodes), {3: 0})
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_graphs_with_chains_and_loops(seed):
+    rnd = random.Random(seed)
+    node_types = {node_id: rnd.choice([0, 0, 0, 1, 2]) for node_id in range(40)}
+    edges = {}
+    for node_id in range(1, 40):
+        # a random tree, then extra edges which close cycles and loops
+        edges[(rnd.randrange(node_id), node_id)] = rnd.randint(1, 20)
+    for _ in range(15):
+        node_id1, node_id2 = rnd.sample(range(40), 2)
+        edges[(min(node_id1, node_id2), max(node_id1, node_id2))] = rnd.randint(1, 20)
+    # a junction loop hanging off node 0
+    edges.update({(0, 40): 3, (40, 41): 2, (0, 41): 4})
+    node_types.update({40: 0, 41: 0})
+    graph = _graph(node_types, [(node_id1, node_id2, float(cost)) for (node_id1, node_id2), cost in edges.items()])
+    stops = [node_id for node_id, node_type in node_types.items() if node_type != 0]
+    for _ in range(5):
+        targets = {node_id: rank for rank, node_id in enumerate(rnd.sample(stops, min(3, len(stops))))}
+        _check_against_dijkstra(graph, list(graph.nodes), targets)
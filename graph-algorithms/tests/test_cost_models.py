@@ -0,0 +1,49 @@
+import random
+
+import networkx as nx
+import pytest
+
+from cost_models import FuelTollCost, LinearCost, LoadCost, cost_model_from_spec
+from csr_graph import CSRGraph
+from graph import edge_simple_cost
+
+_MODELS = [LinearCost(), LinearCost(0.5, 3.0), FuelTollCost(1.6, 0.08, 0.02, 0.5), LoadCost(1.0, 0.05, 1.0)]
+
+
+def _per_edge_cost(model, distance, time, load):
+    # the formula of every model, one edge at a time
+    if isinstance(model, LoadCost):
+        return (model.distance_weight + model.load_weight * load) * distance + model.time_weight * time
+    if isinstance(model, FuelTollCost):
+        return (model.fuel_price * model.consumption + model.toll) * distance + model.time_value * time
+    return model.distance_weight * distance + model.time_weight * time
+
+
+def _csr():
+    rnd = random.Random(0)
+    graph = nx.connected_watts_strogatz_graph(50, 4, 0.3, seed=1)
+    for node_id1, node_id2 in graph.edges():
+        distance, time = rnd.uniform(0, 500), rnd.randint(0, 100)
+        graph[node_id1][node_id2].update(distance=distance, time=time, cost=edge_simple_cost(distance, time))
+    return CSRGraph.from_networkx(graph)
+
+
+@pytest.mark.parametrize("model", _MODELS, ids=lambda model: model.spec)
+@pytest.mark.parametrize("load", [0, 7])
+def test_edge_costs_equal_a_per_edge_loop(model, load):
+    csr = _csr()
+    expected = [_per_edge_cost(model, distance, time, load) for distance, time in zip(csr.distance.tolist(), csr.time.tolist())]
+    assert csr.edge_costs(model, load).tolist() == pytest.approx(expected, rel=1e-12)
+    assert csr.adjacency_lists(model, load)[2] == csr.edge_costs(model, load).tolist()
+    # read again from the cache of the graph
+    assert csr.cost_cache_counters["hits"] >= 1
+
+
+def test_default_model_gives_the_imported_cost():
+    csr = _csr()
+    assert csr.edge_costs(LinearCost()).tolist() == csr.cost.tolist()
+
+
+def test_spec_round_trip():
+    for model in _MODELS:
+        assert cost_model_from_spec(model.spec).spec == model.spec
@@ -0,0 +1,47 @@
+import networkx as nx
+
+from csr_graph import CSRGraph
+from graph import import_graph_from, read_graph_arrays
+
+# an edge before its nodes, a node only referenced by edges, a repeated edge (reversed, last line wins),
+# a self loop and a node line without a label
+_GRAPH_TXT = """graph G {
+"2"--"0"[label=" d = 5\\n t = 1", distance=5, time=1]
+"0" [label="0STORE", type=1, supply=0, demand=4]
+"1" [label="1WAREHOUSE", type=2, supply=9, demand=0]
+"0"--"1"[label=" d = 3\\n t = 2", distance=3, time=2]
+"2" [label="2JOINT", type=0, supply=0, demand=0]
+"1"--"1"[label=" d = 1\\n t = 0", distance=1, time=0]
+"3"--"2"[label=" d = 7\\n t = 1", distance=7, time=1]
+"0"--"2"[label=" d = 4\\n t = 1", distance=4, time=1]
+"4" [type=0, supply=0, demand=0]
+"4"--"1"[label=" d = 2\\n t = 2", distance=2, time=2]
+}
+"""
+
+
+def test_binary_round_trip_gives_the_imported_graph(tmp_path):
+    path = tmp_path / "graph.txt"
+    path.write_text(_GRAPH_TXT)
+    expected = nx.Graph()
+    import_graph_from(expected, str(path))
+
+    CSRGraph.from_arrays(read_graph_arrays(str(path))).save_binary(str(tmp_path / "graph.csr"))
+    graph = CSRGraph.load_binary(str(tmp_path / "graph.csr")).to_networkx()
+
+    assert list(graph.nodes(data=True)) == list(expected.nodes(data=True))
+    assert list(graph.edges(data=True)) == list(expected.edges(data=True))
+    for node_id in expected:
+        assert list(graph[node_id]) == list(expected[node_id])
+
+
+def test_arrays_and_networkx_give_the_same_csr(tmp_path):
+    path = tmp_path / "graph.txt"
+    path.write_text(_GRAPH_TXT)
+    graph = nx.Graph()
+    import_graph_from(graph, str(path))
+    from_graph = CSRGraph.from_networkx(graph)
+    from_arrays = CSRGraph.from_arrays(read_graph_arrays(str(path)))
+
+    for name in ("node_ids", "indptr", "indices", "cost", "distance", "time", "node_line", "label_ptr", "labels"):
+        assert getattr(from_arrays, name).tolist() == getattr(from_graph, name).tolist()
@@ -0,0 +1,42 @@
+import random
+
+import networkx as nx
+import pytest
+
+from delivery_state import DeliveryState
+
+
+def _graph(rnd):
+    graph = nx.Graph()
+    for node_id in range(30):
+        node_type = rnd.choice([0, 1, 2])
+        graph.add_node(node_id, type=node_type, supply=rnd.randint(0, 9) if node_type == 2 else 0,
+                       demand=rnd.randint(0, 9) if node_type == 1 else 0)
+    return graph
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_incremental_state_equals_a_rescan(seed):
+    rnd = random.Random(seed)
+    graph = _graph(rnd)
+    state = DeliveryState.from_graph(graph, truck_node=None, truck_load=0, truck_cap_max=rnd.randint(1, 12))
+    for _ in range(40):
+        if state.is_done():
+            break
+        if rnd.random() < 0.5:
+            state.load_at(rnd.choice(state.warehouses_ids_list))
+        else:
+            state.unload_at(rnd.choice(state.stores_ids_list))
+
+        state.write_to(graph)
+        rescan = DeliveryState.from_graph(graph, state.truck_node, state.truck_load, state.truck_cap_max)
+        assert state.total_supply == rescan.initial_total_supply
+        assert state.total_demand == rescan.initial_total_demand
+        assert state.active_warehouses == rescan.active_warehouses
+        assert state.active_stores == rescan.active_stores
+        assert state.active_warehouses_mask.tolist() == rescan.active_warehouses_mask.tolist()
+        assert state.active_stores_mask.tolist() == rescan.active_stores_mask.tolist()
+        assert 0 <= state.truck_load <= state.truck_cap_max
+        assert state.is_done() == rescan.is_done()
+    # goods are only moved between the warehouses, the truck and the stores
+    assert state.initial_total_supply - state.total_supply == state.truck_load + state.initial_total_demand - state.total_demand
@@ -0,0 +1,16 @@
+import numpy as np
+
+from delivery_state import DeliveryState
+from exact_search import solve_exact
+from local_search import VisitCosts
+
+
+def test_long_route_does_not_recurse():
+    # start 0, warehouse 1 and store 2: a capacity of 1 makes 2 visits per good, far deeper than the recursion limit
+    dist = np.array([[0.0, 1.0, 2.0], [1.0, 0.0, 1.5], [2.0, 1.5, 0.0]])
+    state = DeliveryState([1], [1500], [2], [1500], 0, 0, 1)
+    result = solve_exact(VisitCosts([0, 1, 2], dist, None), state)
+    assert result["optimal"]
+    assert len(result["visits"]) == 3000
+    assert result["visits"][:2] == [(1, 1), (2, -1)]
+    assert result["cost"] == 1.0 + 1500 * 1.5 + 1499 * 1.5
@@ -0,0 +1,45 @@
+import networkx as nx
+
+from csr_graph import CSRGraph
+from distance_cache import DistanceCache
+from fleet import FleetTruck, run_fleet
+from routing import nearest_target_path
+
+
+def _graph():
+    # warehouse 0 (5 goods) -- junction 1 -- store 2 (8 wanted) -- store 3 (8 wanted)
+    graph = nx.Graph()
+    graph.add_node(0, type=2, supply=5, demand=0)
+    graph.add_node(1, type=0, supply=0, demand=0)
+    graph.add_node(2, type=1, supply=0, demand=8)
+    graph.add_node(3, type=1, supply=0, demand=8)
+    for node_id1, node_id2, cost in ((0, 1, 1.0), (1, 2, 2.0), (2, 3, 4.0)):
+        graph.add_edge(node_id1, node_id2, cost=cost, distance=cost, time=cost)
+    return graph
+
+
+def test_loaded_truck_delivers_when_the_warehouses_are_empty():
+    graph = _graph()
+    # the threshold asks for 9 goods, the only warehouse has 5
+    truck = FleetTruck(0, 1, 10, load_threshold_factor=0.9)
+    run_fleet(graph, [truck], DistanceCache(CSRGraph.from_networkx(graph)))
+    assert truck.list_paths == [[1, 0], [0, 1, 2]]
+    assert truck.load == 0
+
+
+def test_full_truck_under_its_threshold_delivers():
+    graph = _graph()
+    truck = FleetTruck(0, 0, 4, initial_load=4, load_threshold_factor=2.0)
+    run_fleet(graph, [truck], DistanceCache(CSRGraph.from_networkx(graph)))
+    assert truck.list_paths[0] == [0, 1, 2]
+
+
+def test_cache_keeps_searches_within_the_node_budget():
+    graph = _graph()
+    csr = CSRGraph.from_networkx(graph)
+    cache = DistanceCache(csr, max_nodes=5)
+    for source in (0, 1, 2, 3):
+        assert cache.nearest(source, {3: 0})[:2] == nearest_target_path(graph, source, {3: 0})[:2]
+        assert cache.n_nodes == sum(len(search.dist) for search in cache.rows.values())
+        assert cache.n_nodes <= 5 or len(cache.rows) == 1
+    assert list(cache.rows)[-1] == 3
@@ -0,0 +1,33 @@
+import networkx as nx
+import pytest
+
+from graph import import_graph_from, read_graph_arrays
+
+# node lines whose label holds "--", one in the generator's layout and one in another attribute order
+_GRAPH_TXT = """graph G {
+"0" [label="0--STORE", type=1, supply=0, demand=4]
+"1" [type=2, label="1--WAREHOUSE", supply=9, demand=0]
+"0"--"1"[label=" d = 3\\n t = 2", distance=3, time=2]
+}
+"""
+
+
+def test_node_label_with_an_edge_separator(tmp_path):
+    path = tmp_path / "graph.txt"
+    path.write_text(_GRAPH_TXT)
+    graph = nx.Graph()
+    import_graph_from(graph, str(path))
+    assert list(graph.nodes(data="label")) == [(0, '"0--STORE": '), (1, '"1--WAREHOUSE": ')]
+    assert graph.nodes[1]["supply"] == 9
+    assert list(graph.edges(data="distance")) == [(0, 1, 3.0)]
+
+    arrays = read_graph_arrays(str(path))
+    assert arrays.node_ids.tolist() == [0, 1]
+    assert arrays.edge_src.tolist() == [0] and arrays.edge_dst.tolist() == [1]
+
+
+def test_edge_line_without_attributes_is_an_error(tmp_path):
+    path = tmp_path / "graph.txt"
+    path.write_text('graph G {\n"0"--"1"\n}\n')
+    with pytest.raises(Exception, match="Edge params"):
+        import_graph_from(nx.Graph(), str(path))
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from local_search import VisitCosts, _apply, _best_move, improve_visits
+
+
+def _route(rng, n_nodes, n_visits, cap):
+    # asymmetric costs, as rounding makes them between real path costs, and a feasible load sequence
+    dist = rng.uniform(1, 100, (n_nodes, n_nodes))
+    dist = dist + dist.T + rng.uniform(0, 1e-6, (n_nodes, n_nodes))
+    np.fill_diagonal(dist, 0.0)
+    load = int(rng.integers(0, cap + 1))
+    start_load = load
+    moved = []
+    for _ in range(n_visits):
+        amount = int(rng.integers(-load, cap - load + 1))
+        moved.append(amount)
+        load += amount
+    visits = rng.integers(0, n_nodes, n_visits).tolist()
+    return dist, visits, moved, start_load
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("window", [2, 5, 100])
+def test_predicted_delta_equals_recomputed_cost(seed, window):
+    rng = np.random.default_rng(seed)
+    cap = 8
+    dist, visits, moved, start_load = _route(rng, 12, 40, cap)
+    # the open route ends at a virtual node reached at no cost, as in improve_visits
+    extended = np.zeros((len(dist) + 1, len(dist) + 1))
+    extended[:-1, :-1] = dist
+    seq = np.array([0] + visits)
+    amounts = np.array([0] + moved)
+    for _ in range(30):
+        loads = start_load + np.cumsum(amounts)
+        cost = extended[seq[:-1], seq[1:]].sum()
+        move = _best_move(extended, np.append(seq, len(dist)), np.append(loads, loads[-1]), cap, window)
+        if move is None or move[0] >= 0:
+            break
+        delta, kind, first, second, length = move
+        assert abs(second - first) <= window + length
+        order = _apply(len(seq), kind, first, second, length)
+        seq = seq[order]
+        amounts = amounts[order]
+        new_loads = start_load + np.cumsum(amounts)
+        assert extended[seq[:-1], seq[1:]].sum() - cost == pytest.approx(delta, abs=1e-9)
+        assert new_loads.min() >= 0 and new_loads.max() <= cap
+
+
+def test_budget_bounds_a_long_route():
+    rng = np.random.default_rng(0)
+    dist, visits, moved, start_load = _route(rng, 50, 5000, 10)
+    costs = VisitCosts(range(50), dist, None)
+    new_visits, new_moved, history, _ = improve_visits(costs, 0, visits, moved, start_load, 10, 0.05)
+    assert history[-1][0] < 0.5
+    assert sorted(zip(new_visits, new_moved)) == sorted(zip(visits, moved))
+    assert history[-1][1] <= history[0][1]
@@ -0,0 +1,49 @@
+import random
+
+import networkx as nx
+import pytest
+
+from cost_models import LoadCost
+from csr_graph import CSRGraph
+from greedy_search import paths_cost
+from route_result import RouteResult
+
+
+def _graph_and_paths(rnd):
+    graph = nx.connected_watts_strogatz_graph(40, 4, 0.3, seed=rnd.randint(0, 1000))
+    for node_id1, node_id2 in graph.edges():
+        distance, time = rnd.uniform(1, 100), rnd.randint(0, 20)
+        graph[node_id1][node_id2].update(distance=distance, time=time, cost=distance + time)
+    # random walks chained end to start, with a leg of a single node (a stop on the truck node)
+    list_paths = []
+    node = 0
+    for leg in range(12):
+        path = [node]
+        for _ in range(rnd.randint(0, 6) if leg != 5 else 0):
+            path.append(rnd.choice(list(graph[path[-1]])))
+        list_paths.append(path)
+        node = path[-1]
+    return graph, list_paths
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_evaluate_equals_paths_cost(seed):
+    graph, list_paths = _graph_and_paths(random.Random(seed))
+    for route_graph in (graph, CSRGraph.from_networkx(graph)):
+        route = RouteResult.from_paths(list_paths).evaluate(route_graph)
+        assert route.to_paths() == list_paths
+        for total, weight in ((route.cost, "cost"), (route.distance, "distance"), (route.time, "time")):
+            assert total == paths_cost(graph, list_paths, weight)
+
+
+def test_evaluate_with_a_load_cost_model():
+    graph, list_paths = _graph_and_paths(random.Random(0))
+    model = LoadCost(1.0, 0.1, 2.0)
+    leg_loads = list(range(len(list_paths)))
+    expected = 0
+    for path, load in zip(list_paths, leg_loads):
+        for node_id1, node_id2 in zip(path[:-1], path[1:]):
+            edge = graph[node_id1][node_id2]
+            expected += (1.0 + 0.1 * load) * edge["distance"] + 2.0 * edge["time"]
+    route = RouteResult.from_paths(list_paths).evaluate(CSRGraph.from_networkx(graph), model, leg_loads)
+    assert route.cost == pytest.approx(expected, rel=1e-12)
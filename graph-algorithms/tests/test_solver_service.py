@@ -0,0 +1,44 @@
+import asyncio
+
+from solver_service import GraphEntry, RouteBatcher
+
+_GRAPH_TXT = """graph G {
+"0" [label="0WAREHOUSE", type=2, supply=20, demand=0]
+"1" [label="1JOINT", type=0, supply=0, demand=0]
+"2" [label="2STORE", type=1, supply=0, demand=4]
+"3" [label="3STORE", type=1, supply=0, demand=5]
+"0"--"1"[label=" d = 3\\n t = 2", distance=3, time=2]
+"1"--"2"[label=" d = 4\\n t = 1", distance=4, time=1]
+"1"--"3"[label=" d = 6\\n t = 2", distance=6, time=2]
+"2"--"3"[label=" d = 1\\n t = 1", distance=1, time=1]
+}
+"""
+
+
+def _solve(entry, requests):
+    # one batch solved on the loop thread, as the solver thread does it
+    async def solve():
+        loop = asyncio.get_running_loop()
+        batch = []
+        for truck_node, truck_cap_max in requests:
+            params = {"truck_start_node": truck_node, "truck_cap_max": truck_cap_max, "load_threshold_factor": 0.5}
+            state = entry.new_state(1, 0, truck_cap_max)
+            state.truck_node = truck_node
+            batch.append((params, state, loop.create_future()))
+        RouteBatcher(None, 0.001)._solve(loop, batch, entry)
+        return await asyncio.gather(*(future for _, _, future in batch), return_exceptions=True)
+    return asyncio.run(solve())
+
+
+def test_a_failing_route_does_not_fail_its_batch(tmp_path):
+    path = tmp_path / "graph.txt"
+    path.write_text(_GRAPH_TXT)
+    entry = GraphEntry.load(str(path))
+    alone = [_solve(entry, [request])[0] for request in ((1, 3), (0, 5))]
+
+    # node 99 is not in the graph: its stop table lookup raises
+    answers = _solve(entry, [(1, 3), (99, 4), (0, 5)])
+    assert isinstance(answers[1], Exception)
+    for answer, expected in zip(answers[::2], alone):
+        assert answer["error"] is None
+        assert dict(answer, batch_size=1) == expected
@@ -0,0 +1,57 @@
+import networkx as nx
+import numpy as np
+
+from graph import import_graph_from
+from routing import nearest_target_path
+from stop_table import StopTable
+
+_GRAPH_TXT = """graph G {
+"0" [label="0WAREHOUSE", type=2, supply=9, demand=0]
+"1" [label="1JOINT", type=0, supply=0, demand=0]
+"2" [label="2STORE", type=1, supply=0, demand=4]
+"3" [label="3STORE", type=1, supply=0, demand=5]
+"0"--"1"[label=" d = 3\\n t = 2", distance=3, time=2]
+"1"--"2"[label=" d = 4\\n t = 1", distance=4, time=1]
+"1"--"3"[label=" d = 6\\n t = 2", distance=6, time=2]
+"2"--"3"[label=" d = 1\\n t = 1", distance=1, time=1]
+}
+"""
+
+
+def _import(path):
+    graph = nx.Graph()
+    import_graph_from(graph, str(path))
+    return graph
+
+
+def test_cache_hit_and_miss(tmp_path):
+    path = tmp_path / "graph.txt"
+    path.write_text(_GRAPH_TXT)
+    graph = _import(path)
+    built = StopTable.from_graph_file(graph, str(path))
+    assert not built.from_cache
+    assert len(list(tmp_path.glob("graph.stops-*.npz"))) == 1
+
+    cached = StopTable.from_graph_file(graph, str(path))
+    assert cached.from_cache
+    assert np.array_equal(cached.dist, built.dist)
+    assert np.array_equal(cached.pred, built.pred)
+    # node_dist is not cached but derived from the trees, to the same costs
+    assert np.array_equal(cached.node_dist, built.node_dist)
+    for source_id in (0, 2, 3):
+        for target_id in (0, 2, 3):
+            cost = nearest_target_path(graph, source_id, {target_id: 0})[1]
+            assert cached.dist[cached.stop_index[source_id], cached.stop_index[target_id]] == cost
+
+
+def test_edited_graph_is_not_read_from_the_cache(tmp_path):
+    path = tmp_path / "graph.txt"
+    path.write_text(_GRAPH_TXT)
+    StopTable.from_graph_file(_import(path), str(path))
+
+    path.write_text(_GRAPH_TXT.replace("distance=1, time=1", "distance=9, time=1"))
+    graph = _import(path)
+    table = StopTable.from_graph_file(graph, str(path))
+    assert not table.from_cache
+    assert len(list(tmp_path.glob("graph.stops-*.npz"))) == 2
+    assert table.dist[table.stop_index[2], table.stop_index[3]] == nearest_target_path(graph, 2, {3: 0})[1]
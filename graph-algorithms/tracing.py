@@ -0,0 +1,63 @@
+import json
+
+# --- Trace levels, each one includes the previous ones
+OFF = 0
+# one event at the start and at the end of a run
+SUMMARY = 1
+# one event per greedy decision: target, cost, load, remaining totals and path
+DECISION = 2
+# the candidates (id, cost) seen by every decision
+CANDIDATE = 3
+
+TRACE_LEVELS = {"off": OFF, "summary": SUMMARY, "decision": DECISION, "candidate": CANDIDATE}
+
+
+class Tracer:
+    """Algorithm trace with levels, written as compact JSON Lines through a buffered file.
+
+    At level OFF no file is opened and `emit` returns right away; hot loops and costly events
+    should still test `tracer.enabled(LEVEL)` before building their fields. Field values may be
+    callables, which are only called when the event is actually written.
+    """
+
+    def __init__(self, path=None, level=OFF, buffer_size=1 << 16):
+        """Constructor."""
+        self.level = level if path is not None else OFF
+        self.path = path
+        self._file = open(path, "w", buffering=buffer_size) if self.level > OFF else None
+        self._encode = json.JSONEncoder(separators=(",", ":"), default=_to_json).encode
+
+    def enabled(self, level):
+        """True when events of `level` are written."""
+        return self.level >= level
+
+    def emit(self, level, event, **fields):
+        if self.level < level:
+            return
+        record = {"event": event}
+        for key, value in fields.items():
+            record[key] = value() if callable(value) else value
+        self._file.write(self._encode(record))
+        self._file.write("\n")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _to_json(value):
+    # numpy scalars and arrays
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError("{!r} is not JSON serializable".format(value))
+
+
+# a tracer which never writes, the default of the searches
+NO_TRACE = Tracer()
@@ -1,12 +1,22 @@
+import functools
+import hashlib
+import importlib.util
+import json
+import os
 import time
 
 class TicTac:
-    """Simple class for timing execution."""
+    """Simple class for timing execution.
+
+    Besides the nested tic/tac, `timer(name)` gives named timers, used as context managers or
+    decorators, whose times add up per name in `totals` (name -> [seconds, calls]).
+    """
 
     def __init__(self):
         """Constructor."""
         self.timers = {}
         self.timers_ids_stack = []
+        self.totals = {}
 
     def tic(self):
         """Start timer."""
@@ -23,4 +33,112 @@ class TicTac:
         if len(self.timers_ids_stack) != 0:
             current_id = self.timers_ids_stack.pop()
             self.timers[current_id].append(time.perf_counter())
-            return (self.timers[current_id][1] - self.timers[current_id][0])
\ No newline at end of file
+            return (self.timers[current_id][1] - self.timers[current_id][0])
+
+    def timer(self, name):
+        """Named timer: `with timers.timer("search"): ...` or `@timers.timer("search")`."""
+        total = self.totals.get(name)
+        if total is None:
+            total = self.totals[name] = [0.0, 0]
+        return _NamedTimer(total)
+
+
+class _NamedTimer:
+    """Adds the time spent in a `with` block (or in every call of a decorated function) to a [seconds, calls] total."""
+
+    __slots__ = ("total", "start")
+
+    def __init__(self, total):
+        """Constructor."""
+        self.total = total
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.total[0] += time.perf_counter() - self.start
+        self.total[1] += 1
+
+    def __call__(self, function):
+        total = self.total
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            with _NamedTimer(total):
+                return function(*args, **kwargs)
+        return timed
+
+
+class _NoTimer:
+    """A named timer which measures nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def __call__(self, function):
+        return function
+
+
+_NO_TIMER = _NoTimer()
+
+
+class Metrics(TicTac):
+    """Named timers and counters of a run, summarised as JSON.
+
+    The searches take a `Metrics` the way they take a `tracing.Tracer`: with the default
+    `NO_METRICS`, `timer` returns a shared do-nothing timer and `count` returns right away, so the
+    hooks cost one call each. Counters are plain integers added up per name (`count`).
+    """
+
+    def __init__(self, enabled=True):
+        """Constructor."""
+        super().__init__()
+        self.enabled = enabled
+        self.counters = {}
+
+    def timer(self, name):
+        if not self.enabled:
+            return _NO_TIMER
+        return super().timer(name)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        """{"timers": {name: {"s": seconds, "calls": calls}}, "counters": {name: count}}."""
+        return {"timers": {name: {"s": total[0], "calls": total[1]} for name, total in self.totals.items()},
+                "counters": dict(self.counters)}
+
+    def write_json(self, path, **fields):
+        """Save the summary, with `fields` (e.g. the run arguments), to a .json file."""
+        with open(path, "w") as outputfile:
+            json.dump(dict(fields, **self.summary()), outputfile, indent=1)
+
+
+# metrics which record nothing, the default of the searches
+NO_METRICS = Metrics(enabled=False)
+
+
+def file_content_hash(path):
+    """sha1 of the file content, used to key the caches built from an input graph."""
+    sha = hashlib.sha1()
+    with open(path, "rb") as inputfile:
+        for chunk in iter(lambda: inputfile.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def load_graph_generator():
+    """The ../graph-generator/generate_graph.py module, loaded from its file without putting its directory on sys.path."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "graph-generator", "generate_graph.py")
+    spec = importlib.util.spec_from_file_location("generate_graph", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
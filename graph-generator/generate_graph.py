@@ -0,0 +1,121 @@
+"""
+Shipping roadmap graph generator (python)
+-----------
+
+Writes the same GraphViz-like .txt format as main.cpp (node types 0 joint / 1 store / 2 warehouse,
+supply, demand, x/y coordinates, edge distance and time), for sizes well beyond what main.cpp is practical for,
+with a seedable road-like planar topology:
+
+- nodes are placed on a jittered square grid over the MAX_MAP_SIZE map;
+- every row is a road, column 0 links the rows, so the graph is always connected;
+- the other vertical links exist with probability `--vertical-prob`, and a `--diagonal-prob`
+  share of the grid cells get one diagonal (never two crossing ones), so the road map stays planar;
+- the edge distance is the euclidean distance and the time is computed as in main.cpp, from an
+  assumed average velocity between 40 and 100 km/h;
+- stores and warehouses are random joints, the total supply and demand are spread over them
+  one good at a time, as main.cpp does.
+
+# Example to run:
+
+>>> python generate_graph.py --nodes 10000 --stores 100 --warehouses 20 --supply 2000 --demand 1500 --seed 1 --output graph10k.txt
+
+"""
+
+import argparse
+import math
+import random
+
+MAX_MAP_SIZE = 1000.0
+
+
+def generate_graph(path, n_nodes, n_stores, n_warehouses, total_supply, total_demand, seed=0,
+                   vertical_prob=0.6, diagonal_prob=0.15):
+    """Write a random road-like graph with `n_nodes` nodes to `path`."""
+    if n_stores + n_warehouses > n_nodes:
+        raise Exception("More warehouses/stores than the number of nodes to be generated.")
+    rnd = random.Random(seed)
+
+    # --- Nodes on a jittered grid
+    n_cols = max(1, int(math.ceil(math.sqrt(n_nodes))))
+    step = MAX_MAP_SIZE / n_cols
+    coords = []
+    for node_id in range(n_nodes):
+        row, col = divmod(node_id, n_cols)
+        coords.append(((col + rnd.uniform(0.1, 0.9)) * step, (row + rnd.uniform(0.1, 0.9)) * step))
+
+    # --- Node types, supply and demand
+    node_type = [0] * n_nodes
+    special = rnd.sample(range(n_nodes), n_stores + n_warehouses)
+    store_ids = special[:n_stores]
+    warehouse_ids = special[n_stores:]
+    for node_id in store_ids:
+        node_type[node_id] = 1
+    for node_id in warehouse_ids:
+        node_type[node_id] = 2
+    supply = [0] * n_nodes
+    demand = [0] * n_nodes
+    for ii in range(total_supply if warehouse_ids else 0):
+        supply[warehouse_ids[ii % len(warehouse_ids)]] += 1
+    for ii in range(total_demand if store_ids else 0):
+        demand[store_ids[ii % len(store_ids)]] += 1
+
+    # --- Edges
+    edges = [[] for _ in range(n_nodes)]
+    for node_id in range(n_nodes):
+        col = node_id % n_cols
+        right = node_id + 1
+        down = node_id + n_cols
+        if col + 1 < n_cols and right < n_nodes:
+            edges[node_id].append(right)
+        if down < n_nodes and (col == 0 or rnd.random() < vertical_prob):
+            edges[node_id].append(down)
+        # at most one diagonal per grid cell, either \ or /, so no two edges cross
+        if col + 1 < n_cols and down + 1 < n_nodes and rnd.random() < diagonal_prob:
+            if rnd.random() < 0.5:
+                edges[node_id].append(down + 1)
+            else:
+                edges[right].append(down)
+
+    type_letters = "JSW"
+    with open(path, "w") as graph:
+        graph.write("graph G {\n")
+        for node_id in range(n_nodes):
+            x1, y1 = coords[node_id]
+            graph.write("\"{0}\" [label=\"{0} {1}\", type={2}, supply={3}, demand={4}, x={5}, y={6}]\n".format(
+                node_id, type_letters[node_type[node_id]], node_type[node_id], supply[node_id], demand[node_id],
+                round(x1, 4), round(y1, 4)))
+            for dest_id in edges[node_id]:
+                x2, y2 = coords[dest_id]
+                distance = round(math.hypot(x1 - x2, y1 - y2), 4)
+                # minutes of transition at the assumed average velocity (km/h) of this edge
+                time = int(distance / rnd.uniform(40.0, 100.0) * 60)
+                graph.write("\"{}\"--\"{}\"[label=\" d = {}\\n t = {}\", distance={}, time={}]\n".format(
+                    node_id, dest_id, distance, time, distance, time))
+        graph.write("}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, required=True,
+                        help="Number of nodes to generate.")
+    parser.add_argument('--stores', type=int, required=True,
+                        help="Number of stores.")
+    parser.add_argument('--warehouses', type=int, required=True,
+                        help="Number of warehouses.")
+    parser.add_argument('--supply', type=int, required=True,
+                        help="Total number of goods supplied by the warehouses.")
+    parser.add_argument('--demand', type=int, required=True,
+                        help="Total number of goods demanded by the stores.")
+    parser.add_argument('--vertical-prob', type=float, default=0.6,
+                        help="Probability of a link between two rows, besides column 0.")
+    parser.add_argument('--diagonal-prob', type=float, default=0.15,
+                        help="Probability of a diagonal in a grid cell.")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed of the random generator.")
+    parser.add_argument('--output', type=str, default="graph.txt",
+                        help="The .txt file to write.")
+    args = parser.parse_args()
+
+    generate_graph(args.output, args.nodes, args.stores, args.warehouses, args.supply, args.demand, seed=args.seed,
+                   vertical_prob=args.vertical_prob, diagonal_prob=args.diagonal_prob)
+    print("The shipping roadmap graph has been saved to: {}".format(args.output))
@@ -276,7 +276,7 @@ int main() {
 		}
 
 		if (saveGraphForm){
-			graph << "\"" << nodes[i].id << "\" [label=\"" << nodes[i].id << " " << nodeType << "\", type=" << nodes[i].type <<  ", supply=" << nodes[i].supply[0] << ", demand=" << nodes[i].demand[0] << "]" << endl;
+			graph << "\"" << nodes[i].id << "\" [label=\"" << nodes[i].id << " " << nodeType << "\", type=" << nodes[i].type <<  ", supply=" << nodes[i].supply[0] << ", demand=" << nodes[i].demand[0] << ", x=" << nodes[i].x << ", y=" << nodes[i].y << "]" << endl;
 		}
 		
 		